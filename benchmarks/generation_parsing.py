@@ -0,0 +1,56 @@
+# Measures how long it takes to parse the energy generation of one day with
+# every provider of python-energy, using the fixtures that come with it. Run it
+# from this directory.
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.join('..', 'python-energy'))
+from server.generation_providers import ChartProvider, TransparencyApiProvider
+
+ROUNDS = 200
+
+
+def parse_chart_naively(content):
+    # How the chart was parsed before there were providers: the keywords are
+    # matched against every key for every interval.
+    chart = json.loads(str(content).split('var chart = ')[1].split(';')[0])
+    output = []
+    for data in chart['chartData']:
+        sums = [0, 0, 0, 0]
+        for key in chart['chartKeys']:
+            name = chart['graphDesign'][key]['title'].lower()
+            if 'consumption' in name:
+                continue
+            if any(it in name for it in ['reservoir', 'storage']):
+                sums[0] += int(data[key])
+            elif any(it in name for it in ['biomass', 'geothermal', 'hydro', 'renewable', 'solar', 'waste', 'wind']):
+                sums[1] += int(data[key])
+            elif any(it in name for it in ['fossil', 'nuclear']):
+                sums[2] += int(data[key])
+            else:
+                sums[3] += int(data[key])
+        output.append(sums)
+    return output
+
+
+def benchmark(name, parse):
+    seconds = min(timeit.repeat(parse, number=ROUNDS, repeat=5)) / ROUNDS
+    print(f'{name:24} {seconds * 1000:8.3f} ms per day')
+
+
+with open(os.path.join('..', 'python-energy', 'chart.json')) as file:
+    # The page contains the chart on a single line.
+    chart = json.dumps(json.load(file))
+    page = f'<script>var chart = {chart};</script>'.encode('utf-8')
+with open(os.path.join('..', 'python-energy', 'generation.xml'), 'rb') as file:
+    document = file.read()
+day = datetime(2022, 1, 16)
+chart_provider = ChartProvider()
+api_provider = TransparencyApiProvider('token')
+
+benchmark('chart (naive)', lambda: parse_chart_naively(page))
+benchmark('chart', lambda: chart_provider.parse(page, day))
+benchmark('api (xml)', lambda: api_provider.parse(document, day))
@@ -0,0 +1,246 @@
+# Runs the bundled notebooks headlessly with nbclient, alternately with and
+# without the extension, and adds the energy and time of every run to
+# new-measurements.json (in the format of measurements.json, which holds the
+# measurements we collected by hand and is never touched unless you pass it as
+# --output).
+#
+# With the extension, the energy server and a Jupyter server with the
+# extension run in the background, and the metrics are polled once per second
+# like the frontend does. Without it, only the notebook runs. The notebook's
+# kernel is started by nbclient either way.
+#
+# The energy is measured through the measurement library of python-energy:
+# RAPL for the internal energy and, if one is connected, an MCP for the
+# external energy. `time.user` is the user CPU time of the extension's
+# processes, so it's only there with the extension.
+#
+# Run it from this directory. Reading RAPL usually needs root.
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+
+import nbformat
+import psutil
+import requests
+from nbclient import NotebookClient
+
+sys.path.insert(0, os.path.join('..', 'python-energy'))
+from measure import McpDevice, MeasureError, RaplGroup
+
+NOTEBOOKS = {
+    'kmeans': 'kmeans.ipynb',
+    'blas/lapack': 'blas-lapack.ipynb',
+    'bible': 'bible.ipynb',
+}
+RAPL_EVENTS = [('all', 'energy-pkg'), ('cpu', 'energy-cores'), ('ram', 'energy-ram'), ('gpu', 'energy-gpu')]
+MCP_DEVICE = '/dev/ttyACM0'
+# The MCP only reports watts, so we sample it this often (in seconds).
+MCP_INTERVAL = 0.1
+
+JUPYTER_PORT = 8890
+# How often the frontend asks for metrics (in seconds).
+POLL_INTERVAL = 1.0
+STARTUP_TIMEOUT = 30
+
+
+class Measurement:
+    # The energy used between `start` and `stop`.
+
+    def __init__(self):
+        self.rapl = RaplGroup()
+        self.rapl_ids = []
+        for id, event_type in RAPL_EVENTS:
+            try:
+                self.rapl.add(event_type)
+                self.rapl_ids.append(id)
+            except MeasureError:
+                pass  # Event is not available on this machine.
+        if not self.rapl_ids:
+            self.rapl = None  # Reading an empty group fails.
+        try:
+            self.mcp = McpDevice(MCP_DEVICE)
+        except MeasureError:
+            self.mcp = None
+        self.mcp_joules = [0.0, 0.0]
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._stopped.clear()
+        self.mcp_joules = [0.0, 0.0]
+        if self.mcp is not None:
+            self._sampler = threading.Thread(target=self._sample_mcp)
+            self._sampler.start()
+        self.started_at = time.time()
+        self.rapl_before = self._read_rapl()
+
+    def stop(self) -> dict:
+        rapl_after = self._read_rapl()
+        wall = time.time() - self.started_at
+        self._stopped.set()
+        if self.mcp is not None:
+            self._sampler.join()
+
+        internal = {id: 0 for id, _ in RAPL_EVENTS}
+        for id, before, after in zip(self.rapl_ids, self.rapl_before, rapl_after):
+            internal[id] = after - before
+        external = {}
+        if self.mcp is not None:
+            external = {
+                'all': sum(self.mcp_joules),
+                'mcp0ch0': self.mcp_joules[0],
+                'mcp0ch1': self.mcp_joules[1],
+            }
+        return {'internal': internal, 'external': external, 'time': {'wall': wall}}
+
+    def _read_rapl(self) -> list:
+        return [] if self.rapl is None else self.rapl.used_joules()
+
+    def _sample_mcp(self):
+        last = time.monotonic()
+        while not self._stopped.wait(MCP_INTERVAL):
+            watts = self.mcp.current_watts()
+            now = time.monotonic()
+            for channel in range(2):
+                self.mcp_joules[channel] += watts[channel] * (now - last)
+            last = now
+
+
+class Extension:
+    # The energy server and a Jupyter server with the extension, plus a thread
+    # that polls the metrics like the frontend.
+
+    def __init__(self):
+        self.token = secrets.token_hex(16)
+        self.store = tempfile.TemporaryDirectory()
+        self.energy_server = subprocess.Popen(
+            [sys.executable, 'main.py', '--store', self.store.name],
+            cwd=os.path.join('..', 'python-energy'),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self.jupyter_server = subprocess.Popen(
+            # Reading RAPL usually needs root, and so does this script.
+            [sys.executable, '-m', 'jupyter_server', '--no-browser', '--allow-root',
+             f'--port={JUPYTER_PORT}', f'--ServerApp.token={self.token}',
+             "--ServerApp.jpserver_extensions={'jupyter_energy': True}"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'token {self.token}'
+        self.url = f'http://localhost:{JUPYTER_PORT}/api/energy-metrics/v1'
+        self._stopped = threading.Event()
+        self._wait_until_ready()
+        self._poller = threading.Thread(target=self._poll)
+        self._poller.start()
+
+    def _wait_until_ready(self):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                if self.session.get(self.url, timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        self.stop()
+        raise RuntimeError("The energy server or Jupyter with the extension didn't start.")
+
+    def _poll(self):
+        seq = None
+        while not self._stopped.wait(POLL_INTERVAL):
+            params = {} if seq is None else {'since': seq}
+            try:
+                response = self.session.get(self.url, params=params, timeout=5)
+                if response.status_code == 200:
+                    seq = response.json()['seq']
+            except requests.RequestException:
+                pass
+
+    def cpu_seconds(self) -> float:
+        # The user CPU time of the servers so far.
+        seconds = 0.0
+        for server in [self.energy_server, self.jupyter_server]:
+            try:
+                seconds += psutil.Process(server.pid).cpu_times().user
+            except psutil.NoSuchProcess:
+                pass
+        return seconds
+
+    def stop(self):
+        self._stopped.set()
+        if hasattr(self, '_poller'):
+            self._poller.join()
+        for server in [self.jupyter_server, self.energy_server]:
+            server.terminate()
+            server.wait()
+        self.store.cleanup()
+
+
+def run_notebook(filename: str, measurement: Measurement, with_extension: bool) -> dict:
+    notebook = nbformat.read(filename, as_version=4)
+    client = NotebookClient(notebook, kernel_name='python3', resources={'metadata': {'path': '.'}})
+    extension = Extension() if with_extension else None
+    try:
+        cpu_before = extension.cpu_seconds() if extension else None
+        measurement.start()
+        client.execute()
+        result = measurement.stop()
+        if extension is not None:
+            result['time']['user'] = extension.cpu_seconds() - cpu_before
+    finally:
+        if extension is not None:
+            extension.stop()
+    return result
+
+
+def load(path: str) -> dict:
+    # Runs are added to the ones that are already there, and benchmarks that
+    # aren't run (like idle) are kept.
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save(path: str, data: dict):
+    with open(path + '.tmp', 'w') as file:
+        json.dump(data, file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10, help='how often to run every notebook in each mode')
+    parser.add_argument(
+        '--notebooks', default=','.join(NOTEBOOKS),
+        help=f'comma-separated benchmarks to run, out of {", ".join(NOTEBOOKS)}',
+    )
+    parser.add_argument(
+        '--output', default='new-measurements.json',
+        help='where to add the results to, keeping the runs that are already there',
+    )
+    args = parser.parse_args()
+
+    names = args.notebooks.split(',')
+    data = load(args.output)
+    for name in names:
+        data.setdefault(name, {})
+        data[name].setdefault('withExtension', [])
+        data[name].setdefault('withoutExtension', [])
+    measurement = Measurement()
+
+    for run in range(args.runs):
+        for name in names:
+            # Alternating which mode goes first cancels out drift, like the
+            # machine warming up.
+            for with_extension in ([True, False] if run % 2 == 0 else [False, True]):
+                mode = 'withExtension' if with_extension else 'withoutExtension'
+                print(f'Run {run + 1}/{args.runs} of {name} {mode}...', flush=True)
+                data[name][mode].append(run_notebook(NOTEBOOKS[name], measurement, with_extension))
+                # Every run is saved, so that aborting doesn't lose the others.
+                save(args.output, data)
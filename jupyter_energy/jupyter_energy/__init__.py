@@ -4,10 +4,13 @@ import os.path as osp
 from jupyter_server.utils import url_path_join
 from tornado import ioloop
 
-from jupyter_energy.api import ApiHandler
+from jupyter_energy.api import ApiHandler, CellsHandler, QueryHandler, SharesHandler
+from jupyter_energy.cells import CellRecorder
+from jupyter_energy.client import EnergyServerClient
 from jupyter_energy.config import ResourceUseDisplay
 from jupyter_energy.metrics import PSUtilMetricsLoader
 from jupyter_energy.prometheus import PrometheusHandler
+from jupyter_energy.stream import MetricsBroadcaster, StreamHandler
 
 HERE = osp.abspath(osp.dirname(__file__))
 
@@ -53,16 +56,34 @@ def _load_jupyter_server_extension(server_app):
     print("A notebook started and the jupyter_energy extension is loaded.")
     resuseconfig = ResourceUseDisplay(parent=server_app)
     server_app.web_app.settings["jupyter_energy_config"] = resuseconfig
+    # Nothing is fetched until the first client asks for metrics, so the
+    # energy server doesn't need to be running yet.
+    client = EnergyServerClient()
+    server_app.web_app.settings["jupyter_energy_client"] = client
+    server_app.web_app.settings["jupyter_energy_broadcaster"] = MetricsBroadcaster(client)
+    cells = CellRecorder(server_app.kernel_manager, client)
+    server_app.web_app.settings["jupyter_energy_cells"] = cells
     base_url = server_app.web_app.settings["base_url"]
 
     server_app.web_app.add_handlers(
-        ".*", [(url_path_join(base_url, "/api/energy-metrics/v1"), ApiHandler)]
+        ".*",
+        [
+            (url_path_join(base_url, "/api/energy-metrics/v1"), ApiHandler),
+            (url_path_join(base_url, "/api/energy-metrics/v1/stream"), StreamHandler),
+            (url_path_join(base_url, "/api/energy-metrics/v1/query"), QueryHandler),
+            (url_path_join(base_url, "/api/energy-metrics/v1/cells"), CellsHandler),
+            (url_path_join(base_url, "/api/energy-metrics/v1/shares"), SharesHandler),
+        ],
     )
 
-    callback = ioloop.PeriodicCallback(
-        PrometheusHandler(PSUtilMetricsLoader(server_app)), 1000
-    )
-    callback.start()
+    if resuseconfig.prometheus_interval > 0:
+        callback = ioloop.PeriodicCallback(
+            PrometheusHandler(PSUtilMetricsLoader(server_app), client),
+            1000 * resuseconfig.prometheus_interval,
+        )
+        callback.start()
+    # Kernels come and go, so we look for new ones to listen to.
+    ioloop.PeriodicCallback(cells.watch_kernels, 1000).start()
 
 
 load_jupyter_server_extension = _load_jupyter_server_extension
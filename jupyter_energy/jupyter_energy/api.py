@@ -1,43 +1,153 @@
-import json
+import getpass
 import time
-from concurrent.futures import ThreadPoolExecutor
 
-import requests as req
 from jupyter_server.base.handlers import APIHandler
+from requests import HTTPError, RequestException
 from tornado import web
 
+from jupyter_energy import frame
 
-def fetch_energy_metrics():
-    return json.loads(req.get('http://localhost:35396').text)
 
+def build_response(client, metrics):
+    """
+    Turn metrics of the energy server into what we send to the frontend,
+    which only cares about the energy used since Jupyter started.
+    """
+    response = {
+        'time': {
+            'wall': time.time(),
+            'user': time.process_time(),
+        },
+        'run': metrics['run'],
+        'seq': metrics['seq'],
+        'usage': {},
+        'sampler': metrics['sampler'],
+    }
+    if 'since' in metrics:
+        response['since'] = metrics['since']
+    for id, source in metrics['usage'].items():
+        response['usage'][id] = {
+            'name': source['name'],
+            'joules': source['joules'] - client.initial_joules.get(id, 0),
+            'watts': source['watts'],
+            'stale': source['stale'],
+            'wattsOverTime': source['wattsOverTime'],
+            'longTermJoulesFrom': source['longTermJoulesFrom'],
+            'longTermJoules': source['longTermJoules'],
+        }
+    # Incremental responses only contain the generation if it changed.
+    if 'generation' in metrics:
+        response['generation'] = metrics['generation']
+    if 'attribution' in metrics:
+        response['attribution'] = metrics['attribution']
+    return response
 
-class ApiHandler(APIHandler):
-    executor = ThreadPoolExecutor(max_workers=5)
-    initial_metrics = fetch_energy_metrics()
 
+class ApiHandler(APIHandler):
     @web.authenticated
     async def get(self):
         """
         Calculate and return current energy metrics
+
+        Clients can pass the `seq` and `run` of the last response as
+        `?since=<seq>&run=<run>` to only get the samples that are new since
+        then.
         """
-        metrics = fetch_energy_metrics()
-        response = {
-            'time': {
-                'wall': time.time(),
-                'user': time.process_time(),
-            },
-            'usage': {},
-            'generation': {}
+        client = self.settings["jupyter_energy_client"]
+        try:
+            await client.get()
+        except RequestException as e:
+            raise web.HTTPError(503, f"Couldn't reach the energy server: {e}")
+
+        if client.etag is not None:
+            if self.request.headers.get('If-None-Match') == client.etag:
+                self.set_status(304)
+                return
+            self.set_header('ETag', client.etag)
+
+        since = self.get_argument('since', None)
+        try:
+            metrics = client.changes_since(
+                None if since is None else int(since), self.get_argument('run', None))
+        except ValueError:
+            raise web.HTTPError(400, 'since must be an integer')
+        response = build_response(client, metrics)
+        self.set_header('Vary', 'Accept')
+        if frame.CONTENT_TYPE in self.request.headers.get('Accept', ''):
+            self.set_header('Content-Type', frame.CONTENT_TYPE)
+            self.write(frame.encode(response))
+        else:
+            self.write(frame.to_json(response))
+
+
+class QueryHandler(APIHandler):
+    # The parameters the energy server understands for queries.
+    PARAMS = ['from', 'to', 'resolution', 'max_points', 'sources', 'method']
+
+    @web.authenticated
+    async def get(self):
+        """
+        Return aggregated buckets of the energy history, so that charts of
+        long sessions don't need all samples.
+        """
+        client = self.settings["jupyter_energy_client"]
+        params = {
+            name: self.get_argument(name) for name in self.PARAMS
+            if self.get_argument(name, None) is not None
         }
-        for id, source in metrics['usage'].items():
-            initial_source = self.initial_metrics['usage'][id]
-            response['usage'][id] = {
-                'name': source['name'],
-                'joules': source['joules'] - initial_source['joules'],
-                'watts': source['watts'],
-                'wattsOverTime': source['wattsOverTime'],  # TODO: possibly shorten it
-                'longTermJoules': source['longTermJoules'],
+        try:
+            body, content_type = await client.query(params, self.request.headers.get('Accept'))
+        except HTTPError as e:
+            raise web.HTTPError(e.response.status_code, f"The energy server rejected the query: {e}")
+        except RequestException as e:
+            raise web.HTTPError(503, f"Couldn't reach the energy server: {e}")
+        self.set_header('Content-Type', content_type or 'application/json')
+        self.set_header('Vary', 'Accept')
+        self.write(body)
+
+
+class CellsHandler(APIHandler):
+    @web.authenticated
+    async def get(self):
+        """
+        Return the energy every execution of a cell used, with its duration
+        and the mean and peak watts of every source.
+
+        Clients can pass `?kernel=<id>` to only get the cells of one kernel.
+        Cells that finished a moment ago may not have their energy yet.
+        """
+        recorder = self.settings["jupyter_energy_cells"]
+        await recorder.resolve()
+        self.write(recorder.to_json(self.get_argument('kernel', None)))
+
+
+class SharesHandler(APIHandler):
+    @web.authenticated
+    async def get(self):
+        """
+        Return the part of the energy of every RAPL source that the user of
+        this Jupyter server and each of its kernels used. On machines that
+        many people share, that's what they are responsible for, while the
+        sources themselves measure everyone.
+        """
+        client = self.settings["jupyter_energy_client"]
+        try:
+            attribution = await client.cpu_attribution()
+        except HTTPError as e:
+            raise web.HTTPError(e.response.status_code, f"The energy server can't split its energy: {e}")
+        except RequestException as e:
+            raise web.HTTPError(503, f"Couldn't reach the energy server: {e}")
+
+        user = getpass.getuser()
+        kernel_ids = self.kernel_manager.list_kernel_ids()
+        response = {'user': user, 'sources': {}}
+        for id, source in attribution['sources'].items():
+            response['sources'][id] = {
+                'idle': source['idle'],
+                'user': source['users'].get(user, {'joules': 0.0, 'watts': 0.0}),
+                'kernels': {
+                    kernel_id: source['kernels'][kernel_id]
+                    for kernel_id in kernel_ids if kernel_id in source['kernels']
+                },
             }
-        response['generation'] = metrics['generation']
-        print(f'Response: {response}')
-        self.write(json.dumps(response))
+        self.write(response)
@@ -0,0 +1,198 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+
+from jupyter_client.session import Session
+from requests import RequestException
+from tornado import ioloop
+
+# How many executions are kept. Older ones are dropped.
+MAX_CELLS = 10000
+
+# The energy server only knows the energy of a time range once it ticked after
+# its end, so we wait a bit before asking for it. Cells that finish within
+# this time of each other are resolved with a single request.
+RESOLVE_DELAY_SECONDS = 1.5
+
+# If the energy server still can't tell the energy of a cell this long after
+# it finished (because it doesn't run or didn't keep the data), we give up.
+RESOLVE_TIMEOUT_SECONDS = 120.0
+
+
+class CellExecution:
+    """
+    One execution of a cell. `start` and `end` are the unix timestamps at
+    which the kernel became busy with the execute request and idle again,
+    according to the kernel's own clock. `sources` is None until the energy
+    server told us how much energy every source used in between.
+    """
+
+    __slots__ = ['kernel_id', 'msg_id', 'execution_count', 'start', 'end', 'sources']
+
+    def __init__(self, kernel_id, msg_id, start):
+        self.kernel_id = kernel_id
+        self.msg_id = msg_id
+        self.execution_count = None
+        self.start = start
+        self.end = None
+        self.sources = None
+
+    def to_json(self):
+        response = {
+            'kernel': self.kernel_id,
+            'msgId': self.msg_id,
+            'executionCount': self.execution_count,
+            'start': self.start,
+            'end': self.end,
+            'duration': None if self.end is None else self.end - self.start,
+            'sources': self.sources,
+        }
+        if self.sources is not None:
+            joules = sum(source['joules'] for source in self.sources.values())
+            duration = self.end - self.start
+            response['joules'] = joules
+            response['meanWatts'] = joules / duration if duration > 0 else sum(
+                source['meanWatts'] for source in self.sources.values())
+        return response
+
+
+class CellRecorder:
+    """
+    Records when cells run by listening to the status messages every kernel
+    publishes on its IOPub channel, and asks the energy server how much
+    energy was used in between.
+
+    Recording only notes two timestamps per execution, so running thousands
+    of small cells doesn't slow anything down. The energy of all cells that
+    finished recently is then fetched with a single request.
+    """
+
+    def __init__(self, kernel_manager, client):
+        self.kernel_manager = kernel_manager
+        self.client = client
+        self.cells = deque([], maxlen=MAX_CELLS)
+
+        # IOPub streams and sessions by kernel id.
+        self._streams = {}
+        # Executions that started but didn't finish yet, by message id.
+        self._running = {}
+        # Finished executions without energy, oldest first.
+        self._unresolved = deque()
+        self._resolving = None
+        self._resolve_scheduled = False
+
+    def watch_kernels(self):
+        """
+        Start listening to new kernels and stop listening to ones that are
+        gone. Should be called periodically.
+        """
+        kernel_ids = set(self.kernel_manager.list_kernel_ids())
+        for kernel_id in kernel_ids - self._streams.keys():
+            self._watch(kernel_id)
+        for kernel_id in self._streams.keys() - kernel_ids:
+            stream, _ = self._streams.pop(kernel_id)
+            if not stream.closed():
+                stream.close()
+
+    def _watch(self, kernel_id):
+        try:
+            kernel = self.kernel_manager.get_kernel(kernel_id)
+            stream = kernel.connect_iopub()
+        except Exception:
+            # Like remote kernels, which we can't listen to.
+            self._streams[kernel_id] = (_ClosedStream(), None)
+            return
+        session = Session(config=kernel.session.config, key=kernel.session.key)
+        self._streams[kernel_id] = (stream, session)
+        stream.on_recv(lambda msg_list: self._on_iopub(kernel_id, session, msg_list))
+
+    def _on_iopub(self, kernel_id, session, msg_list):
+        # This runs for every message of every kernel, so we only unpack the
+        # parts we need. The signature doesn't need to be checked, because
+        # only the kernel can publish on its IOPub channel.
+        _, msg_list = session.feed_identities(msg_list)
+        header = session.unpack(msg_list[1])
+        msg_type = header['msg_type']
+        if msg_type not in ('status', 'execute_input'):
+            return
+        parent_header = session.unpack(msg_list[2])
+        if parent_header.get('msg_type') != 'execute_request':
+            return
+        msg_id = parent_header['msg_id']
+        content = session.unpack(msg_list[4])
+        timestamp = datetime.fromisoformat(header['date'].replace('Z', '+00:00')).timestamp()
+
+        if msg_type == 'execute_input':
+            cell = self._running.get(msg_id)
+            if cell is not None:
+                cell.execution_count = content.get('execution_count')
+        elif content['execution_state'] == 'busy':
+            self._running[msg_id] = CellExecution(kernel_id, msg_id, timestamp)
+        elif content['execution_state'] == 'idle':
+            cell = self._running.pop(msg_id, None)
+            if cell is None:
+                return  # We started listening while it was running.
+            cell.end = timestamp
+            self.cells.append(cell)
+            self._unresolved.append(cell)
+            if not self._resolve_scheduled:
+                self._resolve_scheduled = True
+                ioloop.IOLoop.current().call_later(RESOLVE_DELAY_SECONDS, self._resolve_later)
+
+    def _resolve_later(self):
+        self._resolve_scheduled = False
+        asyncio.ensure_future(self.resolve())
+
+    async def resolve(self):
+        """
+        Ask the energy server for the energy of all finished cells that don't
+        have it yet.
+        """
+        resolving = self._resolving
+        if resolving is None:
+            resolving = self._resolving = asyncio.ensure_future(self._resolve())
+        try:
+            await resolving
+        finally:
+            # A later call may have started the next one in the meantime.
+            if self._resolving is resolving:
+                self._resolving = None
+
+    async def _resolve(self):
+        cells = list(self._unresolved)
+        if not cells:
+            return
+        try:
+            results = await self.client.intervals([(cell.start, cell.end) for cell in cells])
+        except RequestException:
+            results = [None] * len(cells)
+
+        now = time.time()
+        done = set()
+        for cell, result in zip(cells, results):
+            if result is not None:
+                cell.sources = result
+            if result is not None or now - cell.end > RESOLVE_TIMEOUT_SECONDS:
+                done.add(cell.msg_id)
+        # Cells may have finished while we waited for the energy server.
+        self._unresolved = deque(cell for cell in self._unresolved if cell.msg_id not in done)
+        if self._unresolved and not self._resolve_scheduled:
+            self._resolve_scheduled = True
+            ioloop.IOLoop.current().call_later(RESOLVE_DELAY_SECONDS, self._resolve_later)
+
+    def to_json(self, kernel_id=None):
+        return {
+            'cells': [
+                cell.to_json() for cell in self.cells
+                if kernel_id is None or cell.kernel_id == kernel_id
+            ],
+        }
+
+
+class _ClosedStream:
+    # Stands in for the stream of kernels we can't listen to, so that we
+    # don't try again every time.
+
+    def closed(self):
+        return True
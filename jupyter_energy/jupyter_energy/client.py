@@ -0,0 +1,356 @@
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests as req
+
+from jupyter_energy import frame
+from jupyter_energy.shared import SharedSnapshotReader
+
+ENERGY_SERVER_URL = 'http://localhost:35396'
+
+# The energy server samples once per second, so asking it more often than this
+# doesn't give us new data.
+CACHE_TTL_SECONDS = 0.5
+
+# The energy server only keeps this many seconds of short-term history.
+WATTS_OVER_TIME_LENGTH = 100
+
+# If the snapshot in shared memory doesn't change for this long, the energy
+# server backed off (or stopped), so we ask it over HTTP, which wakes it up.
+SHARED_STALE_SECONDS = 2.0
+# How long to wait before looking for the shared memory again if it's missing.
+SHARED_ATTACH_INTERVAL_SECONDS = 5.0
+# Readers of the shared memory don't send requests, so the energy server
+# wouldn't know that anyone is watching and back off. We tell it this often
+# with a conditional request, which it answers with an empty 304.
+SHARED_KEEP_ALIVE_SECONDS = 2.0
+
+ATTRIBUTION_CATEGORIES = ['storage', 'renewable', 'nonRenewable', 'unknown']
+
+# The energy server doesn't answer more time ranges at once.
+MAX_INTERVALS_PER_REQUEST = 500
+
+
+def _decode(response):
+    if response.headers.get('Content-Type') == frame.CONTENT_TYPE:
+        return frame.decode(response.content)
+    return json.loads(response.text)
+
+
+class EnergyServerClient:
+    """
+    Keeps a local copy of the metrics of the energy server.
+
+    The copy is refreshed at most once per `ttl` seconds, no matter how many
+    clients ask for it, and only the changes since the last refresh are
+    fetched. Requests happen on a background thread over a pooled
+    connection, so they never block the event loop. If the energy server
+    runs on this host, the snapshots are read from shared memory instead.
+    """
+
+    def __init__(self, url=ENERGY_SERVER_URL, ttl=CACHE_TTL_SECONDS):
+        self.url = url
+        self.ttl = ttl
+        self.session = req.Session()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.metrics = None
+        self.etag = None
+        # The joules of every source when we first saw it (sources may come
+        # online long after we first talked to the energy server). Jupyter
+        # only reports energy used since then.
+        self.initial_joules = {}
+
+        self._fetched_at = 0.0
+        self._refreshing = None
+        # The index of the long-term bucket that was current at the sequence
+        # numbers we fetched, oldest first.
+        self._long_term_buckets = deque([], maxlen=WATTS_OVER_TIME_LENGTH)
+        # The sequence number at which the generation data last changed.
+        self._generation_seq = 0
+        # The sequence number at which sources last came online.
+        self._sources_seq = 0
+
+        self._shared = None
+        self._local = urlparse(url).hostname in ['localhost', '127.0.0.1', '::1']
+        self._next_attach = 0.0
+        self._next_keep_alive = 0.0
+
+    async def get(self):
+        """
+        Return the current metrics, refreshing them if necessary.
+        """
+        if self.metrics is None or time.monotonic() - self._fetched_at >= self.ttl:
+            if self._refreshing is None:
+                self._refreshing = asyncio.ensure_future(self._refresh())
+            await self._refreshing
+        return self.metrics
+
+    async def _refresh(self):
+        try:
+            since, run = (None, None) if self.metrics is None else \
+                (self.metrics['seq'], self.metrics['run'])
+            loop = asyncio.get_running_loop()
+            update, etag = await loop.run_in_executor(
+                self.executor, self._fetch, since, run, self.etag
+            )
+            self._fetched_at = time.monotonic()
+            if update is not None:
+                self._merge(update)
+                self.etag = etag
+        finally:
+            self._refreshing = None
+
+    def _fetch(self, since, run, etag):
+        try:
+            shared = self._attach_shared()
+        except OSError:
+            # Like a segment we may not read or one that disappeared while
+            # the energy server restarted. Maybe it works next time.
+            shared = None
+        if shared is not None:
+            try:
+                snapshot = shared.read()
+                if snapshot is not None:
+                    self._keep_alive(snapshot['seq'], snapshot['run'])
+                    return snapshot, _etag(snapshot['seq'], snapshot['run'])
+                if time.monotonic() - shared.changed_at < SHARED_STALE_SECONDS:
+                    self._keep_alive(since, run)
+                    return None, etag
+            except LookupError:
+                pass
+            self._shared = None
+            shared.close()
+        return self._fetch_http(since, run, etag)
+
+    def _attach_shared(self):
+        if self._shared is None and self._local and time.monotonic() >= self._next_attach:
+            self._next_attach = time.monotonic() + SHARED_ATTACH_INTERVAL_SECONDS
+            self._shared = SharedSnapshotReader.attach()
+        return self._shared
+
+    def _keep_alive(self, seq, run):
+        if seq is None or time.monotonic() < self._next_keep_alive:
+            return
+        self._next_keep_alive = time.monotonic() + SHARED_KEEP_ALIVE_SECONDS
+        # If the energy server ticked in the meantime, it only sends what
+        # changed since then.
+        headers = {'Accept': frame.CONTENT_TYPE, 'If-None-Match': _etag(seq, run)}
+        params = {'since': seq, 'run': run}
+        try:
+            self.session.get(self.url, params=params, headers=headers, timeout=5).close()
+        except req.RequestException:
+            pass  # We only read the shared memory anyway.
+
+    def _fetch_http(self, since, run, etag):
+        params = {} if since is None else {'since': since, 'run': run}
+        # Frames keep all series as arrays of floats, so we never have to
+        # parse or print the individual numbers.
+        headers = {'Accept': f'{frame.CONTENT_TYPE}, text/json;q=0.5'}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        response = self.session.get(self.url, params=params, headers=headers, timeout=5)
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        return _decode(response), response.headers.get('ETag')
+
+    async def query(self, params, accept=None):
+        """
+        Ask the energy server for aggregated buckets of its history. The
+        `params` and `accept` header are passed on as they are; see `/query`
+        of the energy server. Returns the body and its content type.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._fetch_query, params, accept)
+
+    def _fetch_query(self, params, accept):
+        headers = {} if accept is None else {'Accept': accept}
+        response = self.session.get(self.url + '/query', params=params, headers=headers, timeout=5)
+        response.raise_for_status()
+        return response.content, response.headers.get('Content-Type')
+
+    async def intervals(self, intervals):
+        """
+        Ask the energy server how much energy every source used during each
+        of the `(start, end)` unix timestamps. See `/intervals` of the energy
+        server for what the results look like.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._fetch_intervals, intervals)
+
+    def _fetch_intervals(self, intervals):
+        results = []
+        for first in range(0, len(intervals), MAX_INTERVALS_PER_REQUEST):
+            params = []
+            for start, end in intervals[first:first + MAX_INTERVALS_PER_REQUEST]:
+                params += [('from', repr(start)), ('to', repr(end))]
+            response = self.session.get(
+                self.url + '/intervals', params=params,
+                headers={'Accept': f'{frame.CONTENT_TYPE}, text/json;q=0.5'}, timeout=5,
+            )
+            response.raise_for_status()
+            results += _decode(response)['intervals']
+        return results
+
+    async def cpu_attribution(self):
+        """
+        Ask the energy server how its RAPL energy is split between the users
+        and kernels of this machine. See `/cpu-attribution` of the energy
+        server.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._fetch_cpu_attribution)
+
+    def _fetch_cpu_attribution(self):
+        response = self.session.get(self.url + '/cpu-attribution', timeout=5)
+        response.raise_for_status()
+        return _decode(response)
+
+    def _merge(self, update):
+        previous = self.metrics
+        if previous is not None and update['run'] != previous['run']:
+            # The energy server restarted, so nothing we know about its
+            # sequence numbers holds anymore.
+            previous = None
+            self._long_term_buckets.clear()
+            self._sources_seq = update['seq']
+        if previous is None or 'since' not in update or update['since'] != previous['seq']:
+            self.metrics = update
+            # Full updates of the same server run (like the ones from shared
+            # memory) don't invalidate the buckets we saw so far.
+            if previous is None or update['generation'] != previous['generation']:
+                self._generation_seq = update['seq']
+        else:
+            metrics = {
+                'run': update['run'],
+                'seq': update['seq'],
+                'usage': {},
+                'generation': update.get('generation', previous['generation']),
+                'attribution': _merge_attribution(
+                    previous.get('attribution', {}), update.get('attribution', {})),
+                'sampler': update['sampler'],
+            }
+            for id, source in update['usage'].items():
+                previous_source = previous['usage'].get(id)
+                if previous_source is None:  # The source just came online.
+                    metrics['usage'][id] = source
+                    continue
+                watts_over_time = previous_source['wattsOverTime'] + source['wattsOverTime']
+                metrics['usage'][id] = {
+                    'name': source['name'],
+                    'joules': source['joules'],
+                    'watts': source['watts'],
+                    'stale': source['stale'],
+                    'wattsOverTime': watts_over_time[-WATTS_OVER_TIME_LENGTH:],
+                    'longTermJoulesFrom': previous_source['longTermJoulesFrom'],
+                    'longTermJoules': previous_source['longTermJoules'][
+                        :source['longTermJoulesFrom'] - previous_source['longTermJoulesFrom']
+                    ] + source['longTermJoules'],
+                }
+            if 'generation' in update:
+                self._generation_seq = update['seq']
+            self.metrics = metrics
+
+        if previous is not None and self.metrics['usage'].keys() != previous['usage'].keys():
+            self._sources_seq = self.metrics['seq']
+        self._long_term_buckets.append((self.metrics['seq'], self._current_long_term_bucket()))
+        for id, source in self.metrics['usage'].items():
+            if id not in self.initial_joules:
+                self.initial_joules[id] = source['joules']
+
+    def _current_long_term_bucket(self):
+        # Buckets are numbered since the energy server started.
+        ends = [
+            source['longTermJoulesFrom'] + len(source['longTermJoules'])
+            for source in self.metrics['usage'].values()
+        ]
+        return max(ends, default=1) - 1
+
+    def changes_since(self, since, run):
+        """
+        Return the metrics that changed since the one with the given sequence
+        number and run of the energy server in the same format as the energy
+        server, or all metrics if a client that saw that sequence number needs
+        them.
+        """
+        metrics = self.metrics
+        if since is None or run != metrics['run'] or since > metrics['seq'] \
+                or since < self._sources_seq:
+            return metrics
+
+        # We may not have fetched exactly that sequence number, but any bucket
+        # from before it is also fine – the client will just replace a few
+        # more values.
+        from_bucket = None
+        for seq, bucket in self._long_term_buckets:
+            if seq > since:
+                break
+            from_bucket = bucket
+        num_new = metrics['seq'] - since
+        if from_bucket is None or any(
+            num_new > len(source['wattsOverTime'])
+            or from_bucket < source['longTermJoulesFrom']
+            for source in metrics['usage'].values()
+        ):
+            return metrics
+
+        changes = {
+            'run': metrics['run'],
+            'seq': metrics['seq'],
+            'since': since,
+            'usage': {},
+            'sampler': metrics['sampler'],
+        }
+        for id, source in metrics['usage'].items():
+            changes['usage'][id] = {
+                'name': source['name'],
+                'joules': source['joules'],
+                'watts': source['watts'],
+                'stale': source['stale'],
+                'wattsOverTime': source['wattsOverTime'][len(source['wattsOverTime']) - num_new:],
+                'longTermJoulesFrom': from_bucket,
+                'longTermJoules': source['longTermJoules'][from_bucket - source['longTermJoulesFrom']:],
+            }
+        if since < self._generation_seq:
+            # The attribution of older buckets changes with the generation.
+            changes['generation'] = metrics['generation']
+            changes['attribution'] = metrics.get('attribution', {})
+        else:
+            changes['attribution'] = {
+                id: _attribution_since(attribution, from_bucket)
+                for id, attribution in metrics.get('attribution', {}).items()
+            }
+        return changes
+
+
+def _etag(seq, run):
+    # The ETag the energy server sends with the given snapshot.
+    return f'W/"{run}-{seq}"'
+
+
+def _merge_attribution(previous, update):
+    # Updates only contain the buckets from `from` on.
+    merged = dict(previous)
+    for id, attribution in update.items():
+        previous_attribution = previous.get(id)
+        if previous_attribution is None or attribution['from'] <= previous_attribution['from']:
+            merged[id] = attribution
+            continue
+        keep = attribution['from'] - previous_attribution['from']
+        merged[id] = {'from': previous_attribution['from']}
+        for category in ATTRIBUTION_CATEGORIES:
+            merged[id][category] = previous_attribution[category][:keep] + attribution[category]
+    return merged
+
+
+def _attribution_since(attribution, bucket):
+    first = max(0, bucket - attribution['from'])
+    since = {'from': attribution['from'] + first}
+    for category in ATTRIBUTION_CATEGORIES:
+        since[category] = attribution[category][first:]
+    return since
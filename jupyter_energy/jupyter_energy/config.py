@@ -8,3 +8,35 @@ class ResourceUseDisplay(Configurable):
     """
     Holds server-side configuration for jupyter-energy
     """
+
+    process_memory_metrics = List(
+        trait=Dict(),
+        default_value=[{"name": "memory_info", "attribute": "rss"}],
+    )
+
+    system_memory_metrics = List(trait=Dict(), default_value=[])
+
+    # Process objects are kept across snapshots, so a non-blocking
+    # cpu_percent compares with the previous snapshot.
+    process_cpu_metrics = List(
+        trait=Dict(),
+        default_value=[{"name": "cpu_percent", "kwargs": {"interval": None}}],
+    )
+
+    system_cpu_metrics = List(trait=Dict(), default_value=[])
+
+    track_cpu_percent = Bool(
+        default_value=False,
+        help="""
+        Set to True in order to also export the CPU usage of the server and
+        its kernels.
+        """,
+    ).tag(config=True)
+
+    prometheus_interval = Float(
+        default_value=1.0,
+        help="""
+        How often (in seconds) the Prometheus metrics of the extension are
+        updated from the metrics it already has. 0 disables them.
+        """,
+    ).tag(config=True)
@@ -0,0 +1 @@
+../../python-energy/server/frame.py
\ No newline at end of file
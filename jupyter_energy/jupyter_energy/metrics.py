@@ -1,3 +1,6 @@
+import os
+import time
+
 try:
     import psutil
 except ImportError:
@@ -6,10 +9,44 @@ except ImportError:
 from jupyter_server.serverapp import ServerApp
 
 
+# Process metrics are read at most this often. Asking for them more often
+# returns the values of the last snapshot.
+SNAPSHOT_INTERVAL_SECONDS = 1.0
+
+
+class ProcessTreeSnapshot:
+    """
+    The sums of some metrics over the Jupyter server and all of its
+    descendants at one point in time.
+
+    The tree is enumerated once per snapshot and all metrics of a process are
+    read inside a single `Process.oneshot()`. `Process` objects are reused
+    across snapshots as long as their process lives, so that metrics like
+    `cpu_percent` that compare with the previous call work.
+    """
+
+    def __init__(self, metrics, processes, read_value):
+        self.time = time.monotonic()
+        self.totals = {key: 0 for key in metrics}
+        for process in processes:
+            with process.oneshot():
+                for key in metrics:
+                    name, kwargs, attribute = key
+                    self.totals[key] += read_value(process, name, dict(kwargs), attribute)
+
+
 class PSUtilMetricsLoader:
-    def __init__(self, server_app: ServerApp):
+    def __init__(self, server_app: ServerApp, snapshot_interval=SNAPSHOT_INTERVAL_SECONDS):
         self.config = server_app.web_app.settings["jupyter_energy_config"]
         self.server_app = server_app
+        self.snapshot_interval = snapshot_interval
+
+        # Every process metric that was asked for, as (name, kwargs, attribute)
+        # with the kwargs as a sorted tuple of items.
+        self._metrics = set()
+        self._snapshot = None
+        # The processes of the last snapshot by pid.
+        self._processes = {}
 
     def get_process_metric_value(self, process, name, kwargs, attribute=None):
         try:
@@ -28,14 +65,29 @@ class PSUtilMetricsLoader:
         if psutil is None:
             return None
         else:
-            current_process = psutil.Process()
-            all_processes = [current_process] + current_process.children(recursive=True)
-
-            def process_metric_value(process): return self.get_process_metric_value(
-                process, name, kwargs, attribute
-            )
-
-            return sum([process_metric_value(process) for process in all_processes])
+            key = (name, tuple(sorted(kwargs.items())), attribute)
+            snapshot = self._snapshot
+            if snapshot is None or key not in snapshot.totals or \
+                    time.monotonic() - snapshot.time >= self.snapshot_interval:
+                self._metrics.add(key)
+                snapshot = self.take_snapshot()
+            return snapshot.totals[key]
+
+    def take_snapshot(self):
+        """
+        Read all process metrics that were asked for so far.
+        """
+        current_process = self._processes.get(os.getpid()) or psutil.Process()
+        processes = {current_process.pid: current_process}
+        for process in current_process.children(recursive=True):
+            cached = self._processes.get(process.pid)
+            # The pid may belong to a new process that has the same pid.
+            processes[process.pid] = cached if cached == process else process
+        # Processes that died are forgotten.
+        self._processes = processes
+        self._snapshot = ProcessTreeSnapshot(
+            self._metrics, processes.values(), self.get_process_metric_value)
+        return self._snapshot
 
     def system_metric(self, name, kwargs={}, attribute=None):
         if psutil is None:
@@ -1,6 +1,6 @@
 from typing import Optional
 
-from prometheus_client import Gauge
+from prometheus_client import Counter, Gauge
 
 from jupyter_energy.metrics import PSUtilMetricsLoader
 
@@ -10,55 +10,88 @@ try:
 except ImportError:
     from .utils import Callable
 
+GENERATION_CATEGORIES = [
+    ('storage', 'storage'), ('renewable', 'renewable'),
+    ('nonRenewable', 'non_renewable'), ('unknown', 'unknown'),
+]
+
 
 class PrometheusHandler(Callable):
-    def __init__(self, metricsloader: PSUtilMetricsLoader):
+    """
+    Exports the metrics of the energy server that the client already has, so
+    that they appear on the `/metrics` endpoint of Jupyter. Nothing is
+    fetched for this; the metrics are as recent as the last time a frontend
+    asked for them.
+
+    Also exports the memory (and, if enabled, CPU) usage of the server and
+    its kernels, read from the snapshots of the metrics loader. Their names
+    have a prefix so that they don't clash with the ones of
+    jupyter-resource-usage, which registers the same names.
+    """
+
+    def __init__(self, metricsloader: PSUtilMetricsLoader, client):
         super().__init__()
         self.metricsloader = metricsloader
         self.config = metricsloader.config
         self.session_manager = metricsloader.server_app.session_manager
+        self.client = client
 
-        # gauge_names = ["total_memory", "max_memory", "total_cpu", "max_cpu"]
-        gauge_names = []
-        for name in gauge_names:
-            phrase = name + "_usage"
-            gauge = Gauge(phrase, "counter for " + phrase.replace("_", " "), [])
-            setattr(self, phrase.upper(), gauge)
+        self.JOULES = Counter(
+            "energy_joules", "energy used by the source since Jupyter started", ["source", "name"]
+        )
+        self.WATTS = Gauge("energy_watts", "current power of the source", ["source", "name"])
+        self.GENERATION_SHARE = Gauge(
+            "energy_generation_share",
+            "share of the latest known energy generation by category",
+            ["category"],
+        )
+        self.MEMORY_USAGE = Gauge(
+            "jupyter_energy_memory_usage", "memory used by the server and its kernels", []
+        )
+        self.CPU_USAGE = Gauge(
+            "jupyter_energy_cpu_usage", "cpu percent used by the server and its kernels", []
+        )
+        # The joules we already counted, by source.
+        self._counted = {}
+        self._seq = None
 
     async def __call__(self, *args, **kwargs):
-        pass
-        # memory_metric_values = self.metricsloader.memory_metrics()
-        # if memory_metric_values is not None:
-        #     self.TOTAL_MEMORY_USAGE.set(memory_metric_values["memory_info_rss"])
-        #     self.MAX_MEMORY_USAGE.set(self.apply_memory_limit(memory_metric_values))
-        # if self.config.track_cpu_percent:
-        #     cpu_metric_values = self.metricsloader.cpu_metrics()
-        #     if cpu_metric_values is not None:
-        #         self.TOTAL_CPU_USAGE.set(cpu_metric_values["cpu_percent"])
-        #         self.MAX_CPU_USAGE.set(self.apply_cpu_limit(cpu_metric_values))
+        memory_metric_values = self.metricsloader.memory_metrics()
+        if memory_metric_values is not None:
+            self.MEMORY_USAGE.set(memory_metric_values["memory_info_rss"])
+        if self.config.track_cpu_percent:
+            cpu_metric_values = self.metricsloader.cpu_metrics()
+            if cpu_metric_values is not None:
+                self.CPU_USAGE.set(cpu_metric_values["cpu_percent"])
+
+        metrics = self.client.metrics
+        if metrics is None or (metrics["run"], metrics["seq"]) == self._seq:
+            return
+        self._seq = (metrics["run"], metrics["seq"])
+
+        for id, source in metrics["usage"].items():
+            joules = source["joules"] - self.client.initial_joules.get(id, 0)
+            counted = self._counted.get(id, 0)
+            # Counters only go up. If the energy server lost energy (because
+            # it restarted without a store), we count from there again.
+            if joules > counted:
+                self.JOULES.labels(id, source["name"]).inc(joules - counted)
+            self._counted[id] = joules
+            self.WATTS.labels(id, source["name"]).set(source["watts"])
+        for category, share in generation_shares(metrics["generation"]).items():
+            self.GENERATION_SHARE.labels(category).set(share)
 
-    def apply_memory_limit(self, memory_metric_values) -> Optional[int]:
-        if memory_metric_values is None:
-            return None
-        else:
-            if callable(self.config.mem_limit):
-                return self.config.mem_limit(
-                    rss=memory_metric_values["memory_info_rss"]
-                )
-            elif self.config.mem_limit > 0:  # mem_limit is an Int
-                return self.config.mem_limit
-            else:
-                return memory_metric_values["virtual_memory_total"]
 
-    def apply_cpu_limit(self, cpu_metric_values) -> Optional[float]:
-        if cpu_metric_values is None:
-            return None
-        else:
-            if callable(self.config.cpu_limit):
-                return self.config.cpu_limit(
-                    cpu_percent=cpu_metric_values["cpu_percent"]
-                )
-            elif self.config.cpu_limit > 0.0:  # cpu_limit is a Float
-                return self.config.cpu_limit
-            else:
-                return 100.0 * cpu_metric_values["cpu_count"]
+def generation_shares(generation):
+    """
+    Return the share of every category in the latest bucket that has
+    generation data, or nothing if there is none.
+    """
+    for index in reversed(range(len(generation["unknown"]))):
+        total = sum(generation[category][index] for category, _ in GENERATION_CATEGORIES)
+        if total > 0:
+            return {
+                label: generation[category][index] / total
+                for category, label in GENERATION_CATEGORIES
+            }
+    return {}
@@ -0,0 +1,96 @@
+import mmap
+import os
+import struct
+import time
+
+from jupyter_energy import frame
+
+# The energy server publishes its latest snapshot as a frame in shared memory,
+# see server/shared.py of python-energy. The layout is:
+#
+#     uint64:  seqlock counter, odd while the snapshot is being written
+#     uint64:  length of the frame
+#     uint64:  reserved
+#     uint64:  reserved
+#     frame
+#
+# Readers never write to it, so it's mapped read-only. That way, it also works
+# if the energy server runs as another user. Like the energy server, we open it
+# as a file in SHARED_MEMORY_DIRECTORY, which is where Linux keeps POSIX shared
+# memory.
+
+SHARED_MEMORY_NAME = 'python-energy'
+SHARED_MEMORY_DIRECTORY = '/dev/shm'
+
+_HEADER = struct.Struct('<QQQQ')
+
+# How often to try again when the energy server is being written to while we
+# read it. It writes once per second, so this basically never happens twice.
+MAX_READ_ATTEMPTS = 10
+
+
+class SharedSnapshotReader:
+    """
+    Reads the snapshots the energy server publishes in shared memory.
+
+    Every reader decodes the snapshot right out of the shared memory, so
+    there are no requests, no copies of the whole frame and no work for the
+    energy server, no matter how many readers there are.
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.buffer = memoryview(memory)
+        self._counter = None
+        self.changed_at = time.monotonic()
+
+    @staticmethod
+    def attach(name=SHARED_MEMORY_NAME):
+        """
+        Attach to the shared memory of the energy server or return None if it
+        doesn't publish any (for example because it runs on another host).
+        Raises an `OSError` if it exists but can't be mapped.
+        """
+        try:
+            fd = os.open(os.path.join(SHARED_MEMORY_DIRECTORY, name), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            size = os.fstat(fd).st_size
+            if size < _HEADER.size:
+                return None  # The energy server is still creating it.
+            memory = mmap.mmap(fd, size, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        return SharedSnapshotReader(memory)
+
+    def read(self):
+        """
+        Return the latest snapshot, None if it didn't change since the last
+        call, or raise a `LookupError` if it's not in the shared memory (for
+        example because it's too big or we keep reading while it's written).
+        """
+        buffer = self.buffer
+        for _ in range(MAX_READ_ATTEMPTS):
+            counter, length, _, _ = _HEADER.unpack_from(buffer, 0)
+            if counter % 2 == 1:
+                time.sleep(0.001)
+                continue
+            if counter == self._counter:
+                return None
+            if length == 0:
+                raise LookupError('The energy server publishes no snapshot.')
+            try:
+                with buffer[_HEADER.size:_HEADER.size + length] as data:
+                    snapshot = frame.decode(data)
+            except (ValueError, TypeError, KeyError, struct.error):
+                snapshot = None  # The frame changed while we decoded it.
+            if _HEADER.unpack_from(buffer, 0)[0] == counter and snapshot is not None:
+                self._counter = counter
+                self.changed_at = time.monotonic()
+                return snapshot
+        raise LookupError('The snapshot in shared memory keeps changing.')
+
+    def close(self):
+        self.buffer.release()
+        self.memory.close()
@@ -6,14 +6,117 @@ define([
     'notebook/js/codecell',
     'nbextensions/jupyter_energy/charts'
 ], function ($, Jupyter, events, utils, codecell, charts) {
-    function getJson(url) {
-        return new Promise(resolve => {
-            $.getJSON({ url: url, success: (response) => resolve(response) });
+    // Frames are a binary format of the server, where lists of numbers are
+    // float64s instead of text, so they don't need to be parsed one by one.
+    const FRAME_CONTENT_TYPE = 'application/vnd.python-energy.frame';
+
+    function decodeFrame(buffer) {
+        // A frame is a magic, the length of a JSON header, the header, and
+        // the float64s that lists in the header refer to as {"$f64": [offset,
+        // length]}. All browsers we care about are little endian, so we can
+        // just look at the floats through a Float64Array.
+        const headerLength = new DataView(buffer).getUint32(4, true);
+        const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+        const floats = new Float64Array(buffer, 8 + headerLength);
+        function restore(value) {
+            if (Array.isArray(value)) return value.map(restore);
+            if (value === null || typeof value !== 'object') return value;
+            if ('$f64' in value) {
+                const [offset, length] = value['$f64'];
+                return Array.from(floats.subarray(offset, offset + length));
+            }
+            const restored = {};
+            for (const key of Object.keys(value)) restored[key] = restore(value[key]);
+            return restored;
+        }
+        return restore(header);
+    }
+
+    async function getFrame(url) {
+        const response = await fetch(url, {
+            headers: { 'Accept': FRAME_CONTENT_TYPE + ', application/json;q=0.5' },
         });
+        if (response.status === 304) return undefined;
+        if (response.headers.get('Content-Type') === FRAME_CONTENT_TYPE) {
+            return decodeFrame(await response.arrayBuffer());
+        }
+        return await response.json();
     }
 
+    // The server only keeps this many seconds of short-term history.
+    const WATTS_OVER_TIME_LENGTH = 100;
+
+    // We remember the last metrics and then only ask the server for what
+    // changed since then.
+    let latestMetrics = undefined;
+
     async function getMetrics() {
-        return await getJson(utils.get_body_data('baseUrl') + 'api/energy-metrics/v1');
+        let url = utils.get_body_data('baseUrl') + 'api/energy-metrics/v1';
+        if (latestMetrics !== undefined) {
+            url += '?since=' + latestMetrics.seq + '&run=' + latestMetrics.run;
+        }
+        const response = await getFrame(url);
+        latestMetrics = mergeMetrics(latestMetrics, response);
+        return latestMetrics;
+    }
+
+    function mergeMetrics(previous, update) {
+        if (update === undefined) return previous; // Not modified.
+        // After the energy server restarted, sequence numbers start over.
+        if (previous === undefined || update.since === undefined || update.run !== previous.run) {
+            return update;
+        }
+        // Concurrent requests may have asked for the same changes.
+        if (update.seq <= previous.seq) return previous;
+        const numNew = update.seq - previous.seq;
+
+        const merged = {
+            run: update.run,
+            seq: update.seq,
+            time: update.time,
+            usage: {},
+            generation: update.generation || previous.generation,
+            attribution: mergeAttribution(previous.attribution, update.attribution),
+        };
+        for (const id of Object.keys(update.usage)) {
+            const source = update.usage[id];
+            const previousSource = previous.usage[id];
+            merged.usage[id] = {
+                name: source.name,
+                joules: source.joules,
+                watts: source.watts,
+                stale: source.stale,
+                wattsOverTime: previousSource.wattsOverTime
+                    .concat(source.wattsOverTime.slice(-numNew))
+                    .slice(-WATTS_OVER_TIME_LENGTH),
+                longTermJoulesFrom: previousSource.longTermJoulesFrom,
+                longTermJoules: previousSource.longTermJoules
+                    .slice(0, source.longTermJoulesFrom - previousSource.longTermJoulesFrom)
+                    .concat(source.longTermJoules),
+            };
+        }
+        return merged;
+    }
+
+    function mergeAttribution(previous, update) {
+        // Updates only contain the buckets from `from` on.
+        if (previous === undefined || update === undefined) return update || previous;
+        const merged = Object.assign({}, previous);
+        for (const id of Object.keys(update)) {
+            const source = update[id];
+            const previousSource = previous[id];
+            if (previousSource === undefined || source.from <= previousSource.from) {
+                merged[id] = source;
+                continue;
+            }
+            merged[id] = { from: previousSource.from };
+            for (const category of ['storage', 'renewable', 'nonRenewable', 'unknown']) {
+                merged[id][category] = previousSource[category]
+                    .slice(0, source.from - previousSource.from)
+                    .concat(source[category]);
+            }
+        }
+        return merged;
     }
 
     function runCell(cell) {
@@ -295,8 +398,33 @@ define([
     }
 
     async function displayMetrics() {
-        console.log("Displaying metrics");
-        const metrics = await getMetrics();
+        renderMetrics(await getMetrics());
+    }
+
+    // Instead of polling, we let the server push new metrics to us while the
+    // tab is in the foreground.
+    let metricsStream = undefined;
+
+    function subscribeToMetrics() {
+        let url = utils.get_body_data('baseUrl') + 'api/energy-metrics/v1/stream';
+        if (latestMetrics !== undefined) {
+            url += '?since=' + latestMetrics.seq + '&run=' + latestMetrics.run;
+        }
+        metricsStream = new EventSource(url);
+        metricsStream.onmessage = (event) => {
+            latestMetrics = mergeMetrics(latestMetrics, JSON.parse(event.data));
+            renderMetrics(latestMetrics);
+        };
+    }
+
+    function unsubscribeFromMetrics() {
+        if (metricsStream !== undefined) {
+            metricsStream.close();
+            metricsStream = undefined;
+        }
+    }
+
+    function renderMetrics(metrics) {
         console.debug(metrics);
         const comparison = comparisonForJoules(metrics.usage.all.joules);
 
@@ -325,7 +453,7 @@ define([
         for (const source of Object.values(metrics.usage)) {
             const color = colors.pop();
             data.datasets.push({
-                label: source.name + ' (' + humanEnergy(source.joules) + ')',
+                label: source.name + ' (' + (source.stale ? 'not responding' : humanEnergy(source.joules)) + ')',
                 backgroundColor: color,
                 borderColor: color,
                 data: source.wattsOverTime,
@@ -361,29 +489,49 @@ define([
         }
     }
 
-    function displayLongTermChart(metrics) {
-        const timelineLength = metrics.usage.all.longTermJoules.length;
+    // The long-term chart shows aggregated buckets of the whole history, so
+    // its size doesn't depend on how long the energy server has been running.
+    const LONG_TERM_POINTS = 200;
+    let longTermHistory = undefined;
+    let longTermHistoryFetchedAt = 0;
+
+    function getLongTermHistory() {
+        // New buckets only start every few minutes, so we don't ask more often.
+        if (longTermHistory === undefined || Date.now() - longTermHistoryFetchedAt > 60 * 1000) {
+            longTermHistory = getFrame(utils.get_body_data('baseUrl')
+                + 'api/energy-metrics/v1/query?max_points=' + LONG_TERM_POINTS);
+            longTermHistoryFetchedAt = Date.now();
+        }
+        return longTermHistory;
+    }
+
+    async function displayLongTermChart(metrics) {
+        const history = await getLongTermHistory();
+        if (!showLongTerm) return; // The user switched while we waited.
+
+        const timelineLength = Math.round((history.to - history.from) / history.resolution);
         const labels = Array(timelineLength).fill().map((_, index) => {
-            const totalMinutes = (timelineLength - index - 1) * 15;
+            const totalMinutes = Math.round((timelineLength - index - 1) * history.resolution / 60);
             const hours = Math.floor(totalMinutes / 60);
             const minutes = (totalMinutes % 60);
             return '-' + hours + ':' + (minutes.toString().length < 2 ? ('0' + minutes) : minutes) + 'h';
         });
 
         const data = { labels: labels, datasets: [] };
-        let max = Object.values(metrics.usage)
-            .map((it) => it.longTermJoules.reduce((a, b) => a > b ? a : b))
-            .reduce((a, b) => a > b ? a : b);
+        let max = Object.values(history.sources)
+            .map((it) => it.joules.reduce((a, b) => a > b ? a : b, 0))
+            .reduce((a, b) => a > b ? a : b, 0);
         max = Math.round((max * 1.2) / 10) * 10;
 
         const colors = ['#BD74E7', '#264653', '#2A9D8F', '#E9C46A', '#F4A261', '#E76F51'];
-        for (const source of Object.values(metrics.usage)) {
+        for (const id of Object.keys(history.sources)) {
             const color = colors.pop();
+            const joules = metrics.usage[id] === undefined ? 0 : metrics.usage[id].joules;
             data.datasets.push({
-                label: source.name + ' (' + humanEnergy(source.joules) + ')',
+                label: history.sources[id].name + ' (' + humanEnergy(joules) + ')',
                 backgroundColor: color,
                 borderColor: color,
-                data: source.longTermJoules,
+                data: history.sources[id].joules,
                 radius: 0,
             });
         }
@@ -396,7 +544,7 @@ define([
             generationStacked[source] = [];
             for (let i = 0; i < timelineLength; i++) {
                 const previous = previousSource == null ? 0 : generationStacked[previousSource][i];
-                generationStacked[source].push(previous + metrics.generation[source][i]);
+                generationStacked[source].push(previous + (history.generation[source][i] || 0));
             }
         }
         for (const source of generationSources) {
@@ -450,16 +598,28 @@ define([
         load_ipython_extension: async function () {
             setupDOM();
 
-            // Call `displayMetrics` every second, but only if the tab is in the
-            // foreground.
+            // Update the metrics whenever there are new ones, but only if the
+            // tab is in the foreground. Browsers without server-sent events
+            // call `displayMetrics` every second instead.
             await displayMetrics();
-            setInterval(() => {
-                if (document.hidden) return; // Don't poll when nobody is looking.
-                displayMetrics();
-            }, 1000);
+            if (window.EventSource !== undefined) {
+                subscribeToMetrics();
+            } else {
+                setInterval(() => {
+                    if (document.hidden) return; // Don't poll when nobody is looking.
+                    displayMetrics();
+                }, 1000);
+            }
             document.addEventListener("visibilitychange", async function () {
+                if (document.hidden) {
+                    unsubscribeFromMetrics();
+                    return;
+                }
                 // Update instantly when user activates notebook tab.
                 await displayMetrics();
+                if (window.EventSource !== undefined && metricsStream === undefined) {
+                    subscribeToMetrics();
+                }
             }, false);
 
             // We record when the notebook was running vs. when it wasn't.
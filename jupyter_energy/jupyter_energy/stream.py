@@ -0,0 +1,131 @@
+import asyncio
+
+from jupyter_server.base.handlers import JupyterHandler
+from requests import RequestException
+from tornado import web
+from tornado.iostream import StreamClosedError
+
+from jupyter_energy import frame
+from jupyter_energy.api import build_response
+
+
+class MetricsBroadcaster:
+    """
+    Polls the energy server while anyone is subscribed and hands every new
+    sample to all subscribers.
+
+    Messages are encoded once per sample and `since` they are relative to, so
+    subscribers that keep up all share the same message. Subscribers that are
+    too slow skip samples and get all changes since the last one they saw in
+    a single message instead.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.subscribers = 0
+        self._polling = None
+        self._next_metrics = None
+        self._notified_seq = None
+        # Encoded messages for the `(run, seq)` of `_messages_seq` by the
+        # `(since, run)` they are relative to.
+        self._messages_seq = None
+        self._messages = {}
+
+    async def updates(self, since=None, run=None):
+        """
+        Yield `(run, seq, message)` tuples with the changes since the given
+        sequence number and run of the energy server, whenever there are new
+        metrics.
+        """
+        self.subscribers += 1
+        try:
+            while True:
+                # Also restarts polling if it stopped for whatever reason.
+                if self._polling is None:
+                    self._polling = asyncio.ensure_future(self._poll())
+                metrics = self.client.metrics
+                if metrics is None or (metrics['seq'], metrics['run']) == (since, run):
+                    await self._wait_for_next_metrics()
+                    continue
+                yield metrics['run'], metrics['seq'], self._message(metrics, since, run)
+                since, run = metrics['seq'], metrics['run']
+        finally:
+            self.subscribers -= 1
+
+    def _message(self, metrics, since, run):
+        if self._messages_seq != (metrics['run'], metrics['seq']):
+            self._messages_seq = (metrics['run'], metrics['seq'])
+            self._messages = {}
+        if (since, run) not in self._messages:
+            changes = self.client.changes_since(since, run)
+            self._messages[since, run] = frame.to_json(build_response(self.client, changes))
+        return self._messages[since, run]
+
+    async def _wait_for_next_metrics(self):
+        if self._next_metrics is None:
+            self._next_metrics = asyncio.get_running_loop().create_future()
+        await asyncio.shield(self._next_metrics)
+
+    async def _poll(self):
+        try:
+            while self.subscribers > 0:
+                try:
+                    await self.client.get()
+                except RequestException as e:
+                    print(f"Couldn't reach the energy server: {e}")
+                except Exception as e:
+                    # Like a frame we can't decode. Subscribers still want
+                    # the next samples, so we keep polling.
+                    print(f'Polling the energy server failed: {e!r}')
+                # Other handlers may also have refreshed the client since we
+                # last looked.
+                metrics = self.client.metrics
+                if metrics is not None and (metrics['run'], metrics['seq']) != self._notified_seq:
+                    self._notified_seq = (metrics['run'], metrics['seq'])
+                    self._notify()
+                await asyncio.sleep(self.client.ttl)
+        finally:
+            self._polling = None
+            # Subscribers that wait for the next metrics restart polling.
+            self._notify()
+
+    def _notify(self):
+        if self._next_metrics is not None:
+            self._next_metrics.set_result(None)
+            self._next_metrics = None
+
+
+class StreamHandler(JupyterHandler):
+    @web.authenticated
+    async def get(self):
+        """
+        Stream energy metrics as server-sent events
+
+        Every event contains the changes since the previous one, in the same
+        format as the incremental responses of the `ApiHandler`. Reconnecting
+        clients continue where they left off: the id of every event is
+        `<run>:<seq>`.
+        """
+        since = self.get_argument('since', None)
+        run = self.get_argument('run', None)
+        last_event_id = self.request.headers.get('Last-Event-ID')
+        if last_event_id is not None:
+            run, _, since = last_event_id.rpartition(':')
+        try:
+            since = None if since is None else int(since)
+        except ValueError:
+            raise web.HTTPError(400, 'since must be an integer')
+
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        updates = self.settings["jupyter_energy_broadcaster"].updates(since, run)
+        try:
+            async for run, seq, message in updates:
+                self.write(f'id: {run}:{seq}\ndata: {message}\n\n')
+                # Only continues once the client received the event, so slow
+                # clients don't pile up messages in our buffers.
+                await self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            await updates.aclose()
@@ -1,4 +1,78 @@
+import json
+import os
+from argparse import ArgumentParser
+from datetime import timedelta
+
 import server
+import server.utils as utils
+
+CONFIG_FILE = os.path.expanduser('~/.config/python-energy/config.json')
+
+
+def load_config(path: str) -> dict:
+    # The config file is optional. Command line arguments take precedence.
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
 
 if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument(
+        '--config', default=CONFIG_FILE,
+        help='JSON file with defaults, like {"sources": ["cpu", "mcp*"], "cpu_attribution": true}',
+    )
+    parser.add_argument(
+        '--sources',
+        help='only use sources whose ids match these comma-separated patterns, like cpu,mcp*',
+    )
+    parser.add_argument(
+        '--high-rate-ms', type=float,
+        help='also sample cheap devices (like RAPL) every this many milliseconds',
+    )
+    parser.add_argument(
+        '--high-rate-history', type=float, default=10,
+        help='seconds of high-rate samples to keep',
+    )
+    parser.add_argument(
+        '--store', default=utils.store_directory,
+        help='directory to keep the history in, so that it survives restarts',
+    )
+    parser.add_argument(
+        '--no-store', action='store_true',
+        help='keep the history in memory only',
+    )
+    parser.add_argument(
+        '--no-shared-memory', action='store_true',
+        help='only serve metrics over HTTP, not in shared memory',
+    )
+    parser.add_argument(
+        '--cpu-attribution', action='store_true',
+        help='split the energy between users and kernels by their CPU time (reads /proc every tick)',
+    )
+    parser.add_argument(
+        '--generation-url', default=utils.generation_url,
+        help='where to fetch the energy generation from, {date} is replaced with dd.mm.yyyy',
+    )
+    parser.add_argument(
+        '--entsoe-token',
+        help='security token for the ENTSO-E API, used instead of scraping the generation page',
+    )
+    args = parser.parse_args()
+    config = load_config(args.config)
+    if args.high_rate_ms is not None:
+        utils.high_rate_resolution = timedelta(milliseconds=args.high_rate_ms)
+        utils.high_rate_history = timedelta(seconds=args.high_rate_history)
+    utils.store_directory = None if args.no_store else args.store
+    utils.generation_url = args.generation_url
+    utils.entsoe_api_token = args.entsoe_token
+    if args.sources is not None:
+        utils.source_allowlist = args.sources.split(',')
+    elif 'sources' in config:
+        utils.source_allowlist = config['sources']
+    if args.no_shared_memory:
+        utils.shared_memory_name = None
+    utils.cpu_attribution = args.cpu_attribution or config.get('cpu_attribution', False)
+
     server.run()
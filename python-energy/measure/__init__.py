@@ -3,13 +3,6 @@
 import ctypes
 import os.path as osp
 
-try:
-    from py3nvml import py3nvml as nvml
-    nvml.nvmlInit()
-except ImportError:
-    print("Couldn't import NVML. If you think this should be supported, try installing the py3nvml Python package.")
-    pass
-
 HERE = osp.abspath(osp.dirname(__file__))
 
 
@@ -49,85 +42,157 @@ def assert_valid(name, obj):
     raise fail('Shared library returned unknown error code.')
 
 
-_rapl = ctypes.CDLL(f'{HERE}/rapl.so')
-_mcp = ctypes.CDLL(f'{HERE}/mcp.so')
+class _Library:
+    # A shared library that is only loaded when it's used for the first time,
+    # so that importing this module is cheap and doesn't fail if a library
+    # can't be loaded.
+    #
+    # Pointers to handles are passed around as longs because the libraries
+    # encode errors as negative pointers. Binding the signatures once up front
+    # keeps the per-read cost of a call low.
+
+    def __init__(self, filename: str, signatures: dict):
+        self._filename = filename
+        self._signatures = signatures
+
+    def __getattr__(self, name):
+        # Only called for functions that aren't bound yet.
+        if name not in self._signatures:
+            raise AttributeError(name)
+        try:
+            library = ctypes.CDLL(f'{HERE}/{self._filename}')
+        except OSError as e:
+            raise MeasureError(self._filename, f"Couldn't load the library: {e}")
+        for function_name, (restype, argtypes) in self._signatures.items():
+            function = getattr(library, function_name)
+            function.restype = restype
+            function.argtypes = argtypes
+            setattr(self, function_name, function)
+        return getattr(self, name)
+
+
+_rapl = _Library('rapl.so', {
+    'create_handle': (ctypes.c_long, [ctypes.c_char_p]),
+    'read_handle_in_joules': (ctypes.c_double, [ctypes.c_long]),
+    'drop_handle': (ctypes.c_int, [ctypes.c_long]),
+    'create_group': (ctypes.c_long, []),
+    'add_to_group': (ctypes.c_int, [ctypes.c_long, ctypes.c_char_p]),
+    'read_group_in_joules': (ctypes.c_int, [ctypes.c_long, ctypes.POINTER(ctypes.c_double)]),
+    'drop_group': (ctypes.c_int, [ctypes.c_long]),
+})
+_mcp = _Library('mcp.so', {
+    'create_device': (ctypes.c_long, [ctypes.c_char_p]),
+    'read_device_in_watts': (ctypes.c_int, [ctypes.c_long, ctypes.POINTER(ctypes.c_double)]),
+    'drop_device': (ctypes.c_int, [ctypes.c_long]),
+})
 
 class RaplHandle:
     def __init__(self, event_type: str):
         self.event_type = event_type
         self.handle = -1
-        create_handle = _rapl.create_handle
-        create_handle.restype = ctypes.c_long
-        self.handle = self.assert_valid(create_handle(event_type.encode('utf-8')))
+        self.handle = self.assert_valid(_rapl.create_handle(event_type.encode('utf-8')))
 
     def assert_valid(self, obj):
         return assert_valid(self.event_type, obj)
 
     def used_joules(self):
-        read_handle_in_joules = _rapl.read_handle_in_joules
-        read_handle_in_joules.restype = ctypes.c_double
-        return self.assert_valid(read_handle_in_joules(self.handle))
+        return self.assert_valid(_rapl.read_handle_in_joules(self.handle))
 
     def __del__(self):
-        drop_handle = _rapl.drop_handle
-        drop_handle.restype = ctypes.c_int
         try:
-            self.assert_valid(drop_handle(self.handle))
+            self.assert_valid(_rapl.drop_handle(self.handle))
         except MeasureError:
             pass
 
 
-class McpDevice:
-    def __init__(self, filename: str):
-        self.filename = filename
-        self.device = -1
-        create_device = _mcp.create_device
-        create_device.restype = ctypes.c_long
-        self.device = self.assert_valid(create_device(filename.encode('utf-8')))
+class RaplGroup:
+    # Several RAPL events that are read with a single syscall, so that their
+    # values are consistent with each other.
 
-    def assert_valid(self, obj):
-        return assert_valid(self.filename, obj)
+    # The C library supports at most this many events per group.
+    max_events = 8
+
+    def __init__(self):
+        self.event_types = []
+        self.group = -1
+        self.group = assert_valid('rapl group', _rapl.create_group())
+
+    def add(self, event_type: str) -> int:
+        # Returns the index of the event in the values returned by
+        # `used_joules`.
+        index = assert_valid(event_type, _rapl.add_to_group(self.group, event_type.encode('utf-8')))
+        self.event_types.append(event_type)
+        return index
+
+    def used_joules(self):
+        # Returns the joules used by each event since it was added. The
+        # high-rate recorder and the sampler read the same group from different
+        # threads, so every call gets its own buffer.
+        joules = (ctypes.c_double * self.max_events)()
+        num_events = assert_valid('rapl group', _rapl.read_group_in_joules(self.group, joules))
+        return joules[:num_events]
 
     def __del__(self):
-        drop_device = _mcp.drop_device
         try:
-            self.assert_valid(drop_device(self.device))
+            assert_valid('rapl group', _rapl.drop_group(self.group))
         except MeasureError:
             pass
 
 
-class McpHandle:
-    def __init__(self, device: McpDevice, channel: int):
-        self.device = device
-        self.handle = -1
-        create_handle = _mcp.create_handle
-        create_handle.restype = ctypes.c_long
-        self.handle = self.assert_valid(create_handle(device.device, channel))
+class McpDevice:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.device = -1
+        self.device = self.assert_valid(_mcp.create_device(filename.encode('utf-8')))
+        self._watts = (ctypes.c_double * 2)()
 
     def assert_valid(self, obj):
-        return assert_valid(self.device.filename, obj)
+        return assert_valid(self.filename, obj)
 
     def current_watts(self):
-        read_handle_in_watts = _mcp.read_handle_in_watts
-        read_handle_in_watts.restype = ctypes.c_double
-        return self.assert_valid(read_handle_in_watts(self.handle))
+        # Returns the watts of both channels, which are read with a single
+        # serial command.
+        self.assert_valid(_mcp.read_device_in_watts(self.device, self._watts))
+        return self._watts[:]
 
     def __del__(self):
-        drop_handle = _mcp.drop_handle
         try:
-            self.assert_valid(drop_handle(self.handle))
+            self.assert_valid(_mcp.drop_device(self.device))
         except MeasureError:
             pass
 
+
+_nvml = None
+_nvml_error = None
+
+
+def _load_nvml():
+    # py3nvml is optional and initializing it loads the driver, which can take
+    # a while, so it's only done when the first NVML handle is created.
+    global _nvml, _nvml_error
+    if _nvml is None and _nvml_error is None:
+        try:
+            from py3nvml import py3nvml as nvml
+            nvml.nvmlInit()
+            _nvml = nvml
+        except ImportError:
+            _nvml_error = 'NVML is not supported. Try installing the py3nvml library.'
+        except Exception as e:
+            _nvml_error = f"Couldn't initialize NVML: {e}"
+    return _nvml
+
+
 class NvmlHandle:
     def __init__(self, gpu_index: int):
         name = f'nvml{gpu_index}'
+        nvml = _load_nvml()
         if nvml is None:
-            raise MeasureError(name, 'NVML is not supported. Try installing the py3nvml library.')
+            raise MeasureError(name, _nvml_error)
+        self.nvml = nvml
         try:
             self.device = nvml.nvmlDeviceGetHandleByIndex(gpu_index)
-        except nvml.NVMLError_InvalidArgument as e:
+        except nvml.NVMLError as e:
             raise MeasureError(name, f"Couldn't get the device: {e}")
 
     def current_watts(self):
-        return nvml.nvmlDeviceGetPowerUsage(self.device) / 1000
+        return self.nvml.nvmlDeviceGetPowerUsage(self.device) / 1000
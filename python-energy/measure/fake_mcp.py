@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# A fake MCP39F511 power meter on a pseudo terminal, so that the MCP code can be
+# tried out without the physical device. It understands the subset of the
+# protocol that `mcp_com.c` uses.
+#
+# Run it with `python3 fake_mcp.py [watts of channel 0] [watts of channel 1]`
+# and then point `McpDevice` (or `./mcp`) to the printed device path.
+
+import os
+import pty
+import sys
+import termios
+import tty
+
+ACK = 0x06
+HEADER = 0xa5
+# Commands that read data send a reply after the ACK, others don't.
+READ_COMMANDS = [0x44, 0x52, 0x4e]
+
+
+class FakeMcp:
+    def __init__(self, watts=(0.0, 0.0)):
+        self.watts = list(watts)
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        self.filename = os.ttyname(self.slave)
+        self.num_commands = 0
+
+    def _read_exactly(self, length):
+        data = b''
+        while len(data) < length:
+            data += os.read(self.master, length - len(data))
+        return data
+
+    def _read_packet(self):
+        # Packets look like this: header, length of the whole packet, command
+        # bytes, checksum.
+        while self._read_exactly(1)[0] != HEADER:
+            pass
+        length = self._read_exactly(1)[0]
+        rest = self._read_exactly(length - 2)
+        command, checksum = rest[:-1], rest[-1]
+        if (HEADER + length + sum(command)) & 0xff != checksum:
+            return None
+        return command
+
+    def _reply(self, command):
+        if len(command) < 4 or command[3] not in READ_COMMANDS:
+            return bytes([ACK])
+        # The active power of both channels in 10 mW steps, little endian.
+        data = b''.join(
+            round(watts * 100).to_bytes(4, 'little') for watts in self.watts
+        )
+        length = len(data) + 3
+        checksum = (ACK + length + sum(data)) & 0xff
+        return bytes([ACK, length]) + data + bytes([checksum])
+
+    def serve_forever(self):
+        while True:
+            command = self._read_packet()
+            if command is None:
+                continue
+            self.num_commands += 1
+            os.write(self.master, self._reply(command))
+            termios.tcdrain(self.master)
+
+
+if __name__ == '__main__':
+    watts = [float(arg) for arg in sys.argv[1:3]]
+    fake = FakeMcp(watts + [0.0] * (2 - len(watts)))
+    print(f'Fake MCP listening on {fake.filename}')
+    sys.stdout.flush()
+    try:
+        fake.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -67,6 +67,29 @@ long int _read_device(McpDevice *device, int channel)
     return device->data[channel];
 }
 
+/// Reads the power of both channels of the device with a single command and
+/// writes them to `watts`, which needs to have space for two values.
+///
+/// Returns:
+/// 0:        Everything went successful.
+/// negative: One of the errors defined in utils.
+///
+/// Ownership: Borrows the device and the output.
+int read_device_in_watts(McpDevice *device, POWER_IN_WATTS *watts)
+{
+    if ((long int)device < 0)
+        return ERR_INVALID_HANDLE;
+
+    int result = f511_get_power(&device->data[0], &device->data[1], device->file_descriptor);
+    if (result < 0)
+        return result;
+
+    // MCP returns data in 10mW steps.
+    for (int channel = 0; channel < 2; channel++)
+        watts[channel] = 0.01 * (POWER_IN_WATTS)device->data[channel];
+    return 0;
+}
+
 int drop_device(McpDevice *device)
 {
     if ((long int)device < 0)
@@ -153,11 +176,12 @@ int drop_handle(McpHandle *handle)
 // program, which is especially useful for testing it in isolation. That's what
 // the main function is for. It also shows how to use the library.
 
-void main()
+void main(int argc, char **argv)
 {
     printf("Hello, world! Measuring your energy consumption...\n");
 
-    McpDevice *device = create_device("/dev/ttyACM1");
+    char *filename = argc > 1 ? argv[1] : "/dev/ttyACM1";
+    McpDevice *device = create_device(filename);
     if ((long int)device < 0)
     {
         printf("Error: Device is %ld.\n", (long int)device);
@@ -180,6 +204,10 @@ void main()
         printf("The MCP currently uses %0.3f watts.\n", watts);
     }
 
+    double both_watts[2];
+    if (read_device_in_watts(device, both_watts) == 0)
+        printf("Channel 0 uses %0.3f watts, channel 1 uses %0.3f watts.\n", both_watts[0], both_watts[1]);
+
     drop_handle(handle);
     drop_device(device);
     printf("Recording stopped.\n");
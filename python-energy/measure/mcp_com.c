@@ -39,15 +39,13 @@ enum mcp_states
     validate_checksum
 };
 
-enum mcp_states mcp_state = wait_ack;
-
-int fd;
-
+/* Several devices are opened and read concurrently, so the file descriptor
+ * and the state of the reply parser are local to every call. */
 int init_serial(const char *port, int baud)
 {
     struct termios tty;
 
-    fd = open(port, O_RDWR | O_NOCTTY | O_SYNC);
+    int fd = open(port, O_RDWR | O_NOCTTY | O_SYNC);
     if (fd < 0)
     {
         return -1;
@@ -55,6 +53,7 @@ int init_serial(const char *port, int baud)
 
     if (tcgetattr(fd, &tty) < 0)
     {
+        close(fd);
         return -1;
     }
 
@@ -80,9 +79,10 @@ int init_serial(const char *port, int baud)
 
     if (tcsetattr(fd, TCSANOW, &tty) != 0)
     {
+        close(fd);
         return -1;
     }
-    return 0;
+    return fd;
 }
 
 int mcp_cmd(unsigned char *cmd, unsigned int cmd_length, unsigned char *reply, int fd)
@@ -99,6 +99,7 @@ int mcp_cmd(unsigned char *cmd, unsigned int cmd_length, unsigned char *reply, i
     uint8_t i;
     uint8_t checksum = 0;
     uint8_t datap = 0;
+    enum mcp_states mcp_state = wait_ack;
 
     command_packet[0] = 0xa5;
     command_packet[1] = cmd_length + 3;
@@ -201,7 +202,8 @@ int f511_init(const char *port)
     unsigned char reply[80];
     int res;
 
-    if (init_serial(port, B115200) < 0)
+    int fd = init_serial(port, B115200);
+    if (fd < 0)
     {
         return -1;
     }
@@ -210,6 +212,9 @@ int f511_init(const char *port)
                 sizeof(f511_set_accumulation_interval),
                 (unsigned char *)&reply, fd);
     if (res < 0)
+    {
+        close(fd);
         return res;
+    }
     return fd;
 }
@@ -51,63 +51,52 @@ char *_concat_strings(char *first, char *second, char *third)
     return result;
 }
 
-/// When users of this library start tracking an energy event, they are given a
-/// pointer to this handle. They should treat it as an opaque token (not look at
-/// the content) and instead only use it for further communication with this
-/// library, such as reading out the energy consumption since the token creation
-/// or dropping it.
-typedef struct RaplHandle
-{
-    long file_descriptor;
-    double joules_per_tick;
-    long int ticks_at_creation;
-} RaplHandle;
-
-/// Starts capturing events and returns a handle that allows you to request the
-/// energy currently consumed as joules.
+/// Opens a perf event file descriptor for the given RAPL event. If a group
+/// file descriptor is given, the event becomes part of that group.
 ///
 /// Returns:
-/// positive: Everything went successful. This is a RaplHandle.
+/// positive: The file descriptor. The event's joules per tick are written to
+///           `joules_per_tick`.
 /// negative: One of the errors defined in utils.
 ///
-/// Ownership: Borrows input. Gives caller ownership of returned handle.
-RaplHandle *create_handle(char *event)
+/// Ownership: Borrows input. Gives caller ownership of the file descriptor.
+long _open_event(char *event, long group_file_descriptor, long read_format, double *joules_per_tick)
 {
     char *base_path = "/sys/bus/event_source/devices/power/events/";
 
     // Determine the power type.
     char *power_type_str = _read_stripped_file("/sys/bus/event_source/devices/power/type");
     if (power_type_str == 0)
-        return (RaplHandle *)ERR_CANNOT_ACCESS_POWER_MEASUREMENT;
+        return ERR_CANNOT_ACCESS_POWER_MEASUREMENT;
     long power_type = strtol(power_type_str, NULL, 10);
     free(power_type_str);
 
     // Make sure the energy is measured in joules.
     char *unit = _read_stripped_file(_concat_strings(base_path, event, ".unit"));
     if (unit == 0)
-        return (RaplHandle *)ERR_EVENT_NOT_SUPPORTED;
+        return ERR_EVENT_NOT_SUPPORTED;
     if (0 != strcmp(unit, "Joules"))
     {
         printf("Unknown unit \"%s\".\n", unit);
-        return (RaplHandle *)ERR_UNKNOWN_UNIT;
+        return ERR_UNKNOWN_UNIT;
     }
     free(unit);
 
     // Determine the scale (joules per tick).
     char *scale = _read_stripped_file(_concat_strings(base_path, event, ".scale"));
     if (scale == 0)
-        return (RaplHandle *)ERR_EVENT_NOT_SUPPORTED;
-    double joules_per_tick = strtod(scale, NULL);
+        return ERR_EVENT_NOT_SUPPORTED;
+    *joules_per_tick = strtod(scale, NULL);
     free(scale);
 
     // Determine the energy config of the event. For example, "energy-pkg" and
     // "energy-cpu" have different configs.
     char *event_config_str = _read_stripped_file(_concat_strings(base_path, event, ""));
     if (event_config_str == 0)
-        return (RaplHandle *)ERR_EVENT_NOT_SUPPORTED;
+        return ERR_EVENT_NOT_SUPPORTED;
     char *prefix = "event=0x";
     if (0 != strncmp(prefix, event_config_str, strlen(prefix)))
-        return (RaplHandle *)ERR_UNEXPECTED_EVENT_CONFIG;
+        return ERR_UNEXPECTED_EVENT_CONFIG;
     long event_config = strtol(event_config_str + strlen(prefix), NULL, 16);
     free(event_config_str);
 
@@ -117,23 +106,53 @@ RaplHandle *create_handle(char *event)
     attr.type = power_type;
     attr.size = sizeof(attr);
     attr.config = event_config;
+    attr.read_format = read_format;
     long perf_file_descriptor = syscall(
         __NR_perf_event_open,
         &attr,
         -1, // pid is not supported
         0,  // default cpu?
-        -1, // group_fd is not supported
-        0   // no flags
+        group_file_descriptor,
+        0 // no flags
     );
     if (perf_file_descriptor < 0)
     {
         if (errno == EACCES)
-            return (RaplHandle *)ERR_MISSING_PERMISSION;
+            return ERR_MISSING_PERMISSION;
         if (errno == EINVAL || errno == ENOENT)
-            return (RaplHandle *)ERR_EVENT_NOT_SUPPORTED;
+            return ERR_EVENT_NOT_SUPPORTED;
         printf("syscall to perf_event_open failed for unknown reasons (errno %d)\n", errno);
-        return (RaplHandle *)ERR_SYSCALL_FAILED_FOR_UNKNOWN_REASON;
+        return ERR_SYSCALL_FAILED_FOR_UNKNOWN_REASON;
     }
+    return perf_file_descriptor;
+}
+
+/// When users of this library start tracking an energy event, they are given a
+/// pointer to this handle. They should treat it as an opaque token (not look at
+/// the content) and instead only use it for further communication with this
+/// library, such as reading out the energy consumption since the token creation
+/// or dropping it.
+typedef struct RaplHandle
+{
+    long file_descriptor;
+    double joules_per_tick;
+    long int ticks_at_creation;
+} RaplHandle;
+
+/// Starts capturing events and returns a handle that allows you to request the
+/// energy currently consumed as joules.
+///
+/// Returns:
+/// positive: Everything went successful. This is a RaplHandle.
+/// negative: One of the errors defined in utils.
+///
+/// Ownership: Borrows input. Gives caller ownership of returned handle.
+RaplHandle *create_handle(char *event)
+{
+    double joules_per_tick;
+    long perf_file_descriptor = _open_event(event, -1, 0, &joules_per_tick);
+    if (perf_file_descriptor < 0)
+        return (RaplHandle *)perf_file_descriptor;
 
     // Get current number of joules.
     long int current_ticks;
@@ -187,6 +206,135 @@ int drop_handle(RaplHandle *handle)
     return 0;
 }
 
+/// Several events can be combined into a group. All events of a group are read
+/// with a single syscall, so reading them is cheaper and the values of the
+/// different events belong to the same instant.
+///
+/// Like handles, groups should be treated as opaque tokens.
+#define MAX_EVENTS_PER_GROUP 8
+
+typedef struct RaplGroup
+{
+    int num_events;
+    long file_descriptors[MAX_EVENTS_PER_GROUP];
+    double joules_per_tick[MAX_EVENTS_PER_GROUP];
+    long int ticks_at_creation[MAX_EVENTS_PER_GROUP];
+} RaplGroup;
+
+/// The layout of what the kernel returns when reading a group.
+typedef struct RaplGroupReadout
+{
+    long int num_events;
+    long int ticks[MAX_EVENTS_PER_GROUP];
+} RaplGroupReadout;
+
+/// Creates an empty group.
+///
+/// Returns:
+/// positive: Everything went successful. This is a RaplGroup.
+/// negative: One of the errors defined in utils.
+///
+/// Ownership: Gives caller ownership of returned group.
+RaplGroup *create_group()
+{
+    RaplGroup *group = malloc(sizeof(RaplGroup));
+    group->num_events = 0;
+    return group;
+}
+
+int _read_group_ticks(RaplGroup *group, RaplGroupReadout *readout)
+{
+    long int expected_size = sizeof(long int) * (1 + group->num_events);
+    if (read(group->file_descriptors[0], readout, sizeof(RaplGroupReadout)) != expected_size)
+        return ERR_COULDNT_READ_CONSUMED_ENERGY;
+    if (readout->num_events != group->num_events)
+        return ERR_COULDNT_READ_CONSUMED_ENERGY;
+    return 0;
+}
+
+/// Starts capturing the given event as part of the group.
+///
+/// Returns:
+/// non-negative: The index of the event in the group.
+/// negative:     One of the errors defined in utils.
+///
+/// Ownership: Borrows input.
+int add_to_group(RaplGroup *group, char *event)
+{
+    if ((long int)group < 0l)
+        return ERR_INVALID_HANDLE;
+    if (group->num_events == MAX_EVENTS_PER_GROUP)
+        return ERR_EVENT_NOT_SUPPORTED;
+
+    // The first event becomes the group leader. Reading it returns the
+    // values of all events in the group.
+    int index = group->num_events;
+    long leader = index == 0 ? -1 : group->file_descriptors[0];
+    double joules_per_tick;
+    long perf_file_descriptor = _open_event(event, leader, PERF_FORMAT_GROUP, &joules_per_tick);
+    if (perf_file_descriptor < 0)
+        return (int)perf_file_descriptor;
+
+    group->file_descriptors[index] = perf_file_descriptor;
+    group->joules_per_tick[index] = joules_per_tick;
+    group->num_events++;
+
+    // Get current number of joules.
+    RaplGroupReadout readout;
+    int result = _read_group_ticks(group, &readout);
+    if (result < 0)
+    {
+        group->num_events--;
+        close(perf_file_descriptor);
+        return result;
+    }
+    group->ticks_at_creation[index] = readout.ticks[index];
+    return index;
+}
+
+/// Given a group, this function determines the energy in joules consumed by
+/// each of its events since they were added and writes it to `joules`, which
+/// needs to have space for all events.
+///
+/// Returns:
+/// non-negative: The number of events.
+/// negative:     One of the errors defined in utils.
+///
+/// Ownership: Borrows the group and the output.
+int read_group_in_joules(RaplGroup *group, ENERGY_IN_JOULES *joules)
+{
+    if ((long int)group < 0l || group->num_events == 0)
+        return ERR_INVALID_HANDLE;
+
+    RaplGroupReadout readout;
+    int result = _read_group_ticks(group, &readout);
+    if (result < 0)
+        return result;
+
+    for (int i = 0; i < group->num_events; i++)
+    {
+        long int ticks_since_creation = readout.ticks[i] - group->ticks_at_creation[i];
+        joules[i] = group->joules_per_tick[i] * (ENERGY_IN_JOULES)ticks_since_creation;
+    }
+    return group->num_events;
+}
+
+/// Drops the given group.
+///
+/// Ownership: Takes ownership of the group.
+int drop_group(RaplGroup *group)
+{
+    if ((long int)group < 0l)
+        return ERR_INVALID_HANDLE;
+
+    // Siblings have to be closed before the leader.
+    for (int i = group->num_events - 1; i >= 0; i--)
+        close(group->file_descriptors[i]);
+    free(group);
+
+    return 0;
+}
+
 // This file can not only used as a library, but can also as a standalone
 // program, which is especially useful for testing it in isolation. That's what
 // the main function is for. It also shows how to use the library.
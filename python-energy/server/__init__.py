@@ -1,47 +1,234 @@
 #!/usr/bin/env python
 
-import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from threading import Thread
+from urllib.parse import parse_qs, urlparse
 
+import server.cpu_attribution as cpu_attribution
+import server.discovery as discovery
 import server.energy_generation as generation
 import server.energy_usage as usage
+import server.frame as frame
+import server.intervals as intervals
+import server.prometheus as prometheus
+import server.query as query
+import server.snapshot as snapshot
 import server.utils as utils
+from server.shared import SharedSnapshot
+from server.store import Store
+
+# Clients can't ask for more records of the store at once.
+MAX_HISTORY_RECORDS = 1000000
 
 
 class MyServer(BaseHTTPRequestHandler):
+    # Allows clients that poll every second to reuse their connection.
+    protocol_version = 'HTTP/1.1'
+
     def do_GET(self):
+        # Someone is watching, so the usage monitor shouldn't back off.
+        usage.adaptive_rate.client_seen()
+
+        url = urlparse(self.path)
+        if url.path == '/high-resolution':
+            self._send_high_resolution()
+            return
+        if url.path == '/history':
+            self._send_history(parse_qs(url.query))
+            return
+        if url.path == '/query':
+            self._send_query(parse_qs(url.query))
+            return
+        if url.path == '/intervals':
+            self._send_intervals(parse_qs(url.query))
+            return
+        if url.path == '/cpu-attribution':
+            self._send_cpu_attribution()
+            return
+        if url.path == '/metrics':
+            self._send_body(prometheus.render(snapshot.latest), prometheus.CONTENT_TYPE, None)
+            return
+
+        # The snapshot is immutable, so we don't need any locking here and
+        # never block the monitors.
+        latest = snapshot.latest
+
+        if self.headers.get('If-None-Match') == latest.etag:
+            self.send_response(304)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('ETag', latest.etag)
+            self.end_headers()
+            return
+
+        # Clients that already have an older snapshot can pass its `seq` and
+        # `run` as `?since=<seq>&run=<run>` to only receive what changed since
+        # then.
+        params = parse_qs(url.query)
+        since = params.get('since', [None])[0]
+        run = params.get('run', [None])[0]
+        try:
+            since = None if since is None else int(since)
+        except ValueError:
+            self.send_error(400, 'since must be an integer')
+            return
+        content_type, content_encoding = self._negotiate()
+        self._send_body(
+            latest.encoded(since, run, content_type, content_encoding),
+            content_type, content_encoding, latest.etag,
+        )
+
+    def _negotiate(self):
+        # The content type and encoding the client understands best.
+        accept = self.headers.get('Accept', '')
+        content_type = frame.CONTENT_TYPE if frame.CONTENT_TYPE in accept else snapshot.JSON
+        accept_encoding = self.headers.get('Accept-Encoding', '')
+        content_encoding = next(
+            (it for it in ['gzip', 'deflate'] if it in accept_encoding), None)
+        return content_type, content_encoding
+
+    def _send_body(self, body: bytes, content_type: str, content_encoding: str, etag: str = None):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Content-type', 'text/json')
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept, Accept-Encoding')
+        if content_encoding is not None:
+            self.send_header('Content-Encoding', content_encoding)
         self.end_headers()
-        response = {
-            'usage': {},
-            'generation': {},
-        }
+        self.wfile.write(body)
+
+    def _send_history(self, params: dict):
+        # The records of the store between `?from=` and `?to=` (unix seconds,
+        # defaulting to the last hour): for every source the times and the
+        # joules it used so far at those times.
+        if usage.store is None:
+            self.send_error(404, 'the server has no store')
+            return
+        try:
+            end = float(params.get('to', [time.time()])[0])
+            start = float(params.get('from', [end - 3600])[0])
+        except ValueError:
+            self.send_error(400, 'from and to must be numbers')
+            return
+
+        response = {'sources': {}}
+        num_records = 0
         for source in usage.sources:
-            response['usage'][source.id] = {
-                'name': source.name,
-                'joules': source.joules,
-                'watts': source.watts,
-                'wattsOverTime': list(source.watts_over_time),
-                'longTermJoules': source.long_term_joules,
-            }
-        response['generation'] = {
-            'storage': list(map(lambda info: info.storage, generation.infos)),
-            'renewable': list(map(lambda info: info.renewable, generation.infos)),
-            'nonRenewable': list(map(lambda info: info.non_renewable, generation.infos)),
-            'unknown': list(map(lambda info: info.unknown, generation.infos)),
-        }
-        self.wfile.write(bytes(json.dumps(response), 'utf-8'))
-        self.wfile.write(bytes('\n', 'utf-8'))
+            times, joules = [], []
+            for segment_times, segment_joules in usage.store.records(source.id, start, end):
+                times.extend(segment_times.tolist())
+                joules.extend(segment_joules.tolist())
+            num_records += len(times)
+            if num_records > MAX_HISTORY_RECORDS:
+                self.send_error(400, 'too many records, ask for a shorter time range')
+                return
+            response['sources'][source.id] = {'times': times, 'joules': joules}
+        self._send_response(response)
+
+    def _send_query(self, params: dict):
+        # Aggregated buckets of the history, see server.query. Takes `?from=`
+        # and `?to=` (unix seconds, defaulting to the whole history),
+        # `?resolution=` (seconds) or `?max_points=`, `?sources=` (ids
+        # separated by commas) and `?method=` (buckets or lttb).
+        ids = params.get('sources', [','.join(source.id for source in usage.sources)])[0]
+        sources = [source for source in usage.sources if source.id in ids.split(',')]
+        method = params.get('method', ['buckets'])[0]
+        try:
+            end = float(params.get('to', [time.time()])[0])
+            start = float(params.get('from', [utils.server_started.timestamp()])[0])
+            resolution = params.get('resolution', [None])[0]
+            resolution = None if resolution is None else float(resolution)
+            max_points = int(params.get('max_points', [300])[0])
+        except ValueError:
+            self.send_error(400, 'from, to, resolution and max_points must be numbers')
+            return
+        if method not in ['buckets', 'lttb'] or end <= start or \
+                (resolution is not None and resolution <= 0) or max_points <= 0:
+            self.send_error(400, 'invalid query')
+            return
+        self._send_response(query.query(start, end, sources, resolution, max_points, method))
+
+    def _send_intervals(self, params: dict):
+        # The energy of every source during time ranges, see server.intervals.
+        # Takes pairs of `?from=` and `?to=` (unix seconds), one per range.
+        try:
+            starts = [float(it) for it in params.get('from', [])]
+            ends = [float(it) for it in params.get('to', [])]
+        except ValueError:
+            self.send_error(400, 'from and to must be numbers')
+            return
+        if len(starts) != len(ends) or any(end < start for start, end in zip(starts, ends)):
+            self.send_error(400, 'every from needs a to that is not before it')
+            return
+        if len(starts) > intervals.MAX_INTERVALS:
+            self.send_error(400, 'too many intervals, ask for fewer at once')
+            return
+        self._send_response({'intervals': intervals.energy(list(zip(starts, ends)))})
+
+    def _send_cpu_attribution(self):
+        # The energy of the RAPL sources split between users and kernels, see
+        # server.cpu_attribution.
+        if not utils.cpu_attribution:
+            self.send_error(404, 'CPU attribution is disabled, see --cpu-attribution')
+            return
+        self._send_response(cpu_attribution.latest)
+
+    def _send_high_resolution(self):
+        # The samples of devices that are sampled with a high rate, if enabled.
+        # Every device has its own timestamps.
+        if not usage.high_rate_recorders:
+            self.send_error(404, 'high-rate sampling is disabled')
+            return
+        self._send_response({
+            'devices': [recorder.to_json() for recorder in usage.high_rate_recorders],
+        })
+
+    def _send_response(self, response: dict):
+        content_type, content_encoding = self._negotiate()
+        self._send_body(
+            snapshot.encode(response, content_type, content_encoding),
+            content_type, content_encoding,
+        )
 
 
 def run():
-    Thread(target=usage.monitor, args=()).start()
-    Thread(target=generation.monitor, args=()).start()
+    if utils.store_directory is not None:
+        store = Store(
+            utils.store_directory,
+            round(utils.store_segment_length / utils.short_term_resolution),
+            utils.store_history.total_seconds(),
+        )
+        utils.server_started = store.epoch(utils.server_started)
+        usage.use_store(store)
+        generation.use_store(store)
+        print(f'Keeping the history in {utils.store_directory}')
+
+    # Binding the port first makes sure that no other instance of the server
+    # is running, whose shared memory we would replace.
+    web_server = ThreadingHTTPServer(('localhost', 35396), MyServer)
+    web_server.daemon_threads = True
+
+    shared = None
+    if utils.shared_memory_name is not None:
+        shared = SharedSnapshot(utils.shared_memory_name, utils.shared_memory_size)
 
-    web_server = HTTPServer(('localhost', 35396), MyServer)
+    def on_tick(slots: int):
+        # The snapshot should be the last thing that's updated, so that
+        # everything rendered from it is at least as new.
+        if utils.cpu_attribution:
+            cpu_attribution.update()
+        snapshot.update(slots)
+        if shared is not None:
+            # Readers of the shared memory still send a request now and then
+            # (which is answered with a 304), so they count as clients.
+            shared.publish(snapshot.latest.encoded(None, None, frame.CONTENT_TYPE, None))
+
+    Thread(target=discovery.discover, daemon=True).start()
+    Thread(target=usage.monitor, args=(on_tick,)).start()
+    Thread(target=generation.monitor, args=()).start()
     print('Server started at http://%s:%s' % ('localhost', 35396))
 
     try:
@@ -50,4 +237,6 @@ def run():
         pass
 
     web_server.server_close()
+    if shared is not None:
+        shared.unlink()
     print('Server stopped. Interrupt again to also stop generation and usage monitors.')
@@ -0,0 +1,227 @@
+import os
+import pwd
+import re
+import time
+
+import server.energy_usage as usage
+import server.utils as utils
+from server.energy_usage import RaplSource
+from server.ring_buffer import RingBuffer
+
+# Splits the energy of the RAPL sources between the users of the machine and
+# their Jupyter kernels. RAPL measures whole packages, so on a shared machine,
+# everyone would otherwise see everyone's energy.
+#
+# The idle power of a source (the lowest power it had recently) is reported on
+# its own, because it would be used anyway. The rest of the energy of a tick
+# is split by the CPU time that the processes of every user and kernel used
+# during the tick. Processes belong to the kernel of their closest ancestor
+# that is a kernel.
+#
+# All of this needs only one scan of /proc per tick, no matter how many
+# kernels and users there are. The command lines of the processes, which tell
+# whether they are kernels, are only read once per process.
+
+# Kernels get their connection file on the command line, and jupyter_client
+# names it after the kernel id.
+_KERNEL_ID = re.compile(rb'kernel-([0-9a-f-]{36})\.json')
+
+
+class Share:
+    __slots__ = ['joules', 'watts']
+
+    def __init__(self):
+        self.joules = 0.0
+        self.watts = 0.0
+
+    def add(self, joules: float, seconds: float):
+        self.joules += joules
+        self.watts = joules / seconds if seconds > 0 else 0.0
+
+    def to_json(self) -> dict:
+        return {'joules': self.joules, 'watts': self.watts}
+
+
+class SourceShares:
+    # The shares of one source since the server started.
+
+    def __init__(self, source):
+        self.idle = Share()
+        # energy above the idle power while no process used the CPU
+        self.other = Share()
+        self.users = {}
+        self.kernels = {}
+        self._last_joules = source.joules
+        # the watts of the last ticks, to find the idle power; they start with
+        # the short-term history of the source (which is zero before it came
+        # online)
+        self._watts = RingBuffer(round(utils.idle_power_window / utils.short_term_resolution))
+        for watts in source.watts_over_time.view():
+            if watts > 0:
+                self._watts.append(watts)
+
+    def split(self, joules: float, seconds: float, user_cpu: dict, kernel_cpu: dict):
+        used = joules - self._last_joules
+        self._last_joules = joules
+        if seconds <= 0:
+            return
+        self._watts.append(used / seconds)
+        idle = min(used, min(self._watts.view()) * seconds)
+        active = used - idle
+        self.idle.add(idle, seconds)
+
+        total = sum(user_cpu.values())
+        self.other.add(active if total == 0 else 0.0, seconds)
+        for shares, cpu in [(self.users, user_cpu), (self.kernels, kernel_cpu)]:
+            for id in cpu.keys() - shares.keys():
+                shares[id] = Share()
+            for id, share in shares.items():
+                share.add(active * cpu.get(id, 0) / total if total else 0.0, seconds)
+
+
+# The shares of every RAPL source by its id.
+shares = {}
+# What clients get. It's replaced after every update, so readers don't need
+# to lock anything.
+latest = {'sources': {}}
+
+# (starttime, CPU time) of every process by pid, as of the last scan
+_processes = {}
+_scanned_at = None
+# the kernel id (or None) in the command line of every process by
+# (pid, starttime), so that it's only read once
+_kernel_ids = {}
+# the user of every kernel and when it was last seen
+_kernel_users = {}
+_kernel_seen = {}
+_user_names = {}
+
+
+def _scan() -> dict:
+    # The (parent pid, uid, CPU time in clock ticks, starttime) of all
+    # processes by pid.
+    processes = {}
+    for entry in os.scandir('/proc'):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry.name}/stat', 'rb') as file:
+                stat = file.read()
+            uid = entry.stat().st_uid
+        except OSError:
+            continue  # The process exited in the meantime.
+        # The name of the process is in parentheses and may contain anything.
+        fields = stat[stat.rindex(b')') + 2:].split()
+        processes[int(entry.name)] = (
+            int(fields[1]), uid, int(fields[11]) + int(fields[12]), int(fields[19]))
+    return processes
+
+
+def _kernel_in_command_line(pid: int, started: int):
+    key = (pid, started)
+    if key not in _kernel_ids:
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as file:
+                match = _KERNEL_ID.search(file.read())
+        except OSError:
+            match = None
+        _kernel_ids[key] = None if match is None else match.group(1).decode()
+    return _kernel_ids[key]
+
+
+def _user_name(uid: int) -> str:
+    if uid not in _user_names:
+        try:
+            _user_names[uid] = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            _user_names[uid] = str(uid)
+    return _user_names[uid]
+
+
+def update():
+    # Should be called from the usage monitor thread after every tick.
+    global _processes, _scanned_at, _kernel_ids, latest
+    now = time.time()
+    processes = _scan()
+
+    own_kernels = {}
+    for pid, (_, uid, _, started) in processes.items():
+        kernel = _kernel_in_command_line(pid, started)
+        if kernel is not None:
+            own_kernels[pid] = kernel
+            _kernel_users[kernel] = _user_name(uid)
+            _kernel_seen[kernel] = now
+
+    def kernel_of(pid: int):
+        # The kernel of the closest ancestor that is a kernel.
+        seen = set()
+        while pid in processes and pid not in seen:
+            if pid in own_kernels:
+                return own_kernels[pid]
+            seen.add(pid)
+            pid = processes[pid][0]
+        return None
+
+    # Kernels that didn't use the CPU still get a share of zero.
+    user_cpu, kernel_cpu = {}, {kernel: 0 for kernel in own_kernels.values()}
+    for pid, (_, uid, cpu, started) in processes.items():
+        before = _processes.get(pid)
+        if before is not None and before[0] == started:
+            used = cpu - before[1]
+        else:
+            # The process started since the last scan (unless this is the
+            # first one), so all of its CPU time is new.
+            used = 0 if _scanned_at is None else cpu
+        if used <= 0:
+            continue
+        user = _user_name(uid)
+        user_cpu[user] = user_cpu.get(user, 0) + used
+        kernel = kernel_of(pid)
+        if kernel is not None:
+            kernel_cpu[kernel] = kernel_cpu.get(kernel, 0) + used
+
+    seconds = 0 if _scanned_at is None else now - _scanned_at
+    for source in usage.sources:
+        if not isinstance(source, RaplSource):
+            continue
+        if source.id not in shares:
+            shares[source.id] = SourceShares(source)
+        else:
+            shares[source.id].split(source.joules, seconds, user_cpu, kernel_cpu)
+
+    _forget_stopped_kernels(now)
+    _processes = {pid: (started, cpu) for pid, (_, _, cpu, started) in processes.items()}
+    _kernel_ids = {
+        (pid, started): _kernel_ids[(pid, started)]
+        for pid, (_, _, _, started) in processes.items()
+    }
+    _scanned_at = now
+    latest = _to_json()
+
+
+def _forget_stopped_kernels(now: float):
+    stopped = [
+        kernel for kernel, seen in _kernel_seen.items()
+        if now - seen > utils.stopped_kernels_history.total_seconds()
+    ]
+    for kernel in stopped:
+        del _kernel_seen[kernel]
+        del _kernel_users[kernel]
+        for source_shares in shares.values():
+            source_shares.kernels.pop(kernel, None)
+
+
+def _to_json() -> dict:
+    response = {'sources': {}}
+    for id, source_shares in shares.items():
+        kernels = {}
+        for kernel, share in source_shares.kernels.items():
+            kernels[kernel] = share.to_json()
+            kernels[kernel]['user'] = _kernel_users.get(kernel)
+        response['sources'][id] = {
+            'idle': source_shares.idle.to_json(),
+            'other': source_shares.other.to_json(),
+            'users': {user: share.to_json() for user, share in source_shares.users.items()},
+            'kernels': kernels,
+        }
+    return response
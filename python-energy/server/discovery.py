@@ -0,0 +1,169 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fnmatch import fnmatch
+
+from measure import McpDevice, MeasureError, NvmlHandle, RaplGroup
+
+import server.energy_usage as usage
+import server.utils as utils
+from server.energy_usage import McpMeter, McpSource, NvmlSource, RaplDevice, RaplSource
+
+# Finds the sources of this machine in the background, so that the server can
+# start right away.
+#
+# Devices are probed concurrently, because some of them take a while (like an
+# MCP that doesn't answer or NVML loading its driver). Every source is handed
+# to the usage monitor as soon as its device answered. Devices that had sources
+# in the last run are remembered, so that a restart only probes those at first.
+# Devices without sources are probed again every discovery_interval.
+
+RAPL_SOURCES = [
+    # (internal id, user-visible name, event type)
+    ('all', 'RAPL, all', 'energy-pkg'),
+    ('cpu', 'RAPL, CPU', 'energy-cores'),
+    ('ram', 'RAPL, RAM', 'energy-ram'),
+    ('gpu', 'RAPL, integrated GPU', 'energy-gpu'),
+]
+NUM_MCPS = 5
+# `{}` is replaced with the number of the MCP.
+MCP_DEVICE_PATH = '/dev/ttyACM{}'
+NUM_GPUS = 10
+
+
+class Probe:
+    # A device that may have sources. `discover` returns them and raises a
+    # MeasureError if the device isn't there.
+
+    def __init__(self, name: str, ids: list, discover):
+        self.name = name
+        self.ids = ids
+        self.discover = discover
+
+    def __repr__(self):
+        return self.name
+
+
+def _discover_rapl():
+    device = RaplDevice(RaplGroup())
+    found = []
+    for (id, name, event_type) in RAPL_SOURCES:
+        if not _allowed(id):
+            continue
+        try:
+            index = device.group.add(event_type)
+        except MeasureError:
+            continue  # Event is not available on this machine.
+        found.append(RaplSource(id, name, device, index))
+    return found
+
+
+def _discover_mcp(device_id: int):
+    meter = McpMeter(McpDevice(MCP_DEVICE_PATH.format(device_id)))
+    return [
+        McpSource(f'mcp{device_id}ch{channel}', f'MCP {device_id}, channel {channel}', meter, channel)
+        for channel in range(2)
+    ]
+
+
+def _discover_nvml():
+    found = []
+    for gpu_index in range(NUM_GPUS):
+        try:
+            handle = NvmlHandle(gpu_index)
+        except MeasureError:
+            break  # GPUs are numbered without gaps.
+        found.append(NvmlSource(f'nvml{gpu_index}', f'NVML, external Nvidia GPU {gpu_index}', handle))
+    return found
+
+
+def _probes() -> list:
+    probes = [Probe('rapl', [id for id, _, _ in RAPL_SOURCES], _discover_rapl)]
+    for device_id in range(NUM_MCPS):
+        probes.append(Probe(
+            f'mcp{device_id}', [f'mcp{device_id}ch{channel}' for channel in range(2)],
+            lambda device_id=device_id: _discover_mcp(device_id),
+        ))
+    probes.append(Probe('nvml', [f'nvml{index}' for index in range(NUM_GPUS)], _discover_nvml))
+    # Devices that can't have allowed sources aren't probed at all.
+    return [probe for probe in probes if any(_allowed(id) for id in probe.ids)]
+
+
+def _allowed(id: str) -> bool:
+    if utils.source_allowlist is None:
+        return True
+    return any(fnmatch(id, pattern) for pattern in utils.source_allowlist)
+
+
+def _load_topology():
+    # The names of the devices that had sources the last time or None.
+    if utils.topology_cache is None or not os.path.exists(utils.topology_cache):
+        return None
+    try:
+        with open(utils.topology_cache) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_topology(names: list):
+    if utils.topology_cache is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(utils.topology_cache), exist_ok=True)
+        temporary = utils.topology_cache + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(names, file)
+        os.replace(temporary, utils.topology_cache)
+    except OSError as e:
+        print(f"Couldn't cache the topology: {e}")
+
+
+def _probe_all(probes: list) -> list:
+    # Probes the devices concurrently and returns the ones that had sources.
+    if not probes:
+        return []
+    found = []
+    with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+        futures = {executor.submit(probe.discover): probe for probe in probes}
+        for future in as_completed(futures):
+            probe = futures[future]
+            try:
+                sources = [source for source in future.result() if _allowed(source.id)]
+            except MeasureError:
+                continue  # The device isn't there.
+            except Exception as e:
+                print(f'Probing {probe} failed: {e}')
+                continue
+            if sources:
+                usage.add_sources(sources)
+                found.append(probe)
+    return found
+
+
+def discover():
+    # Runs on its own thread until all devices have sources (or forever).
+    print('Discovering sources.')
+    probes = _probes()
+    known = _load_topology()
+    remaining = probes
+    if known and utils.discovery_interval is not None:
+        # Devices that had sources the last time usually still have them.
+        # The others are only probed with the next round.
+        remaining = [probe for probe in probes if probe.name in known]
+
+    online = []
+    while True:
+        online += _probe_all(remaining)
+        names = sorted(probe.name for probe in online)
+        if names != known:
+            _save_topology(names)
+            known = names
+        if not online and remaining is probes:
+            print('No sources available yet. Maybe you want to run this as sudo or adjust '
+                  'perf_event levels?')
+        remaining = [probe for probe in probes if probe not in online]
+        if utils.discovery_interval is None or not remaining:
+            return
+        time.sleep(utils.discovery_interval.total_seconds())
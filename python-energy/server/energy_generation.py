@@ -1,9 +1,10 @@
-import json
+import traceback
+from collections import namedtuple
 from datetime import datetime, timedelta
-from typing import List
-
-import requests
 
+import server.utils as utils
+from server.generation_fetcher import GenerationFetcher
+from server.generation_providers import ChartProvider, TransparencyApiProvider
 from server.utils import *
 
 
@@ -23,86 +24,87 @@ class Info:
         }
 
 
-def _get_info(day: datetime):
-    # Returns a list of `Info`s, one for every long_term_resolution since the day started.
-
-    url = 'https://transparency.entsoe.eu/generation/r2/actualGenerationPerProductionType/show?name=&defaultValue=false&viewType=GRAPH&areaType=CTY&atch=false&datepicker-day-offset-select-dv-date-from_input=D&dateTime.dateTime=16.01.2022 00:00|CET|DAYTIMERANGE&dateTime.endDateTime=16.01.2022 00:00|CET|DAYTIMERANGE&area.values=CTY|10Y1001A1001A83F!CTY|10Y1001A1001A83F&productionType.values=B01&productionType.values=B02&productionType.values=B03&productionType.values=B04&productionType.values=B05&productionType.values=B06&productionType.values=B07&productionType.values=B08&productionType.values=B09&productionType.values=B10&productionType.values=B11&productionType.values=B12&productionType.values=B13&productionType.values=B14&productionType.values=B20&productionType.values=B15&productionType.values=B16&productionType.values=B17&productionType.values=B18&productionType.values=B19&dateTime.timezone=CET_CEST&dateTime.timezone_input=CET (UTC+1) / CEST (UTC+2)&_=1642498848217'
-    r = requests.get(url)
-    print(r)
-
-    content = str(r.content)
-    chart = json.loads(content.split('var chart = ')[1].split(';')[0])
-
-    keys = chart['chartKeys']
-    renewable_keys, non_renewable_keys, storage_keys, unknown_keys = set(), set(), set(), set()
-    for key in keys:
-        name: str = (chart['graphDesign'][key]['title']).lower()
-        if 'consumption' in name:
-            continue
-
-        def matches_keywords(keywords):
-            return any(map(lambda it: it in name, keywords))
-
-        if matches_keywords(['reservoir', 'storage']):
-            storage_keys.add(key)
-        elif matches_keywords(['biomass', 'geothermal', 'hydro', 'renewable', 'solar', 'waste', 'wind']):
-            renewable_keys.add(key)
-        elif matches_keywords(['fossil', 'nuclear']):
-            non_renewable_keys.add(key)
-        else:
-            unknown_keys.add(key)
-    # print(f'Renewable: {renewable_keys}')
-    # print(f'Non-Renewable: {non_renewable_keys}')
-    # print(f'From Storage: {storage_keys}')
-    # print(f'Unknown: {unknown_keys}')
-
-    assert(chart['chartDesign']['xAxisTitle'] == 'Time [Hours]')
-
-    output = []
-    for data in chart['chartData']:
-        time = data['cat']
-        storage, renewable, non_renewable, unknown = 0, 0, 0, 0
-        for key in keys:
-            energy = int(data[key])
-            if key in storage_keys:
-                storage += energy
-            if key in renewable_keys:
-                renewable += energy
-            if key in non_renewable_keys:
-                non_renewable += energy
-            if key in unknown_keys:
-                unknown += energy
-        output.append(Info(
-            storage, renewable, non_renewable, unknown))
-    return output
-
-
-# A map from days to a list of `Info`s reported for that day.
-_infos_by_day = {}
-
-# A list that contains an Info for every long_term_resolution since the server
-# started.
-infos: List[datetime] = []
+# The `Info`s for every long_term_resolution since the server started, as far
+# as they are still kept. `start` is the index of the first one, counted like
+# the long-term buckets of the sources.
+History = namedtuple('History', ['start', 'infos'])
+history: History = History(0, [])
+
+# Where the history is persisted, if anywhere.
+store = None
+# Created on the first tick, once the configuration is known.
+fetcher = None
+
+
+def _provider():
+    # The structured API is preferred, but it needs a token.
+    if utils.entsoe_api_token is not None:
+        return TransparencyApiProvider(utils.entsoe_api_token)
+    return ChartProvider()
+
+
+def use_store(new_store):
+    # Continues with the history of the last run of the server. Must be called
+    # before the monitor starts.
+    global history, store
+    store = new_store
+    saved = store.load_json('generation')
+    if saved is not None:
+        history = History(saved['start'], [Info(*info) for info in saved['infos']])
+
+
+def _with_day(history: History, day: datetime, day_infos: list) -> History:
+    # Replaces the Infos of the day. Readers may look at `history` at any
+    # time, so we build a new list instead of changing it.
+    capacity = round(long_term_history / long_term_resolution)
+    # The index of the day's first Info if the server had all of them.
+    day_index = round((day - utils.server_started) / long_term_resolution)
+    start, infos = history
+    if day_index - start - len(infos) > capacity:
+        start, infos = day_index, []  # The server didn't run for a long time.
+    skipped = max(0, start - day_index, -day_index)
+    day_infos = day_infos[skipped:]
+    day_index += skipped
+
+    kept = infos[:max(0, day_index - start)]
+    missing = day_index - start - len(kept)
+    after = infos[day_index - start + len(day_infos):]
+    new_infos = kept + [Info(0, 0, 0, 0)] * missing + day_infos + after
+    to_drop = max(0, len(new_infos) - capacity)
+    return History(start + to_drop, new_infos[to_drop:])
 
 
 def tick():
-    global infos
+    global history, fetcher
+    if fetcher is None:
+        fetcher = GenerationFetcher(_provider(), store)
 
+    # The last intervals of yesterday may only be reported after midnight.
+    # Days that are final don't cost anything.
     today = only_date(datetime.now())
-    day_info = _get_info(today)
-    _infos_by_day[today.isoformat()] = day_info
-
-    infos = []
-    day = only_date(server_started)
-    while day <= today:
-        day_infos = _infos_by_day[day.isoformat()]
-        if day == only_date(server_started):
-            to_trim = round((server_started - only_date(server_started)) /
-                            long_term_resolution)
-            day_infos = day_infos[to_trim:]
-        infos.extend(day_infos)
-        day += timedelta(days=1)
+    new_history = history
+    for day in [today - timedelta(days=1), today]:
+        day_infos, changed = fetcher.fetch(day)
+        if changed:
+            new_history = _with_day(new_history, day, [Info(*info) for info in day_infos])
+    if new_history is history:
+        return
+
+    history = new_history
+    if store is not None:
+        store.save_json('generation', {
+            'start': history.start,
+            'infos': [[info.storage, info.renewable, info.non_renewable, info.unknown]
+                      for info in history.infos],
+        })
 
 
 def monitor():
-    tick_repeatedly(long_term_resolution, tick)
+    def tick_safely():
+        # The monitor should keep running no matter what goes wrong in a tick.
+        try:
+            tick()
+        except Exception:
+            traceback.print_exc()
+
+    tick_repeatedly(long_term_resolution, tick_safely)
@@ -0,0 +1,141 @@
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # The builtins are slower, but give the same results.
+
+import server.energy_usage as usage
+
+# Splits the long-term joules of every source into the joules that came from
+# storage, renewable, non-renewable and unknown generation, by the share of
+# each of them in the generation of the same long-term bucket.
+#
+# Buckets only change while they are current or when the generation data
+# changes (or arrives, which is usually about an hour late), so the results
+# are cached and only the buckets after the first change are computed again.
+# Buckets without generation data count as unknown.
+
+CATEGORIES = ['storage', 'renewable', 'nonRenewable', 'unknown']
+
+
+class Attribution:
+    __slots__ = ['start', 'values', '_valid_until']
+
+    def __init__(self):
+        # the index of the bucket of the first values
+        self.start = 0
+        # the joules of every category, one value per bucket
+        self.values = [array('d') for _ in CATEGORIES]
+        # Buckets before this one don't need to be computed again.
+        self._valid_until = 0
+
+    def update(self, joules, generation, changed_from: int):
+        # `joules` are the long-term joules of the source, `generation` the
+        # `_Generation` of the current history and `changed_from` the first
+        # bucket for which the generation changed.
+        if joules.start > self.start:
+            for values in self.values:
+                del values[:joules.start - self.start]
+            self.start = joules.start
+        first = max(self.start, min(self._valid_until, changed_from))
+        for values in self.values:
+            del values[first - self.start:]
+
+        end = joules.total
+        for values, attributed in zip(self.values, _attribute(
+                joules.between(first, end), generation, first)):
+            values.extend(attributed)
+        # The current bucket still changes, and so do the ones that are still
+        # waiting for their generation data.
+        self._valid_until = max(first, min(end - 1, generation.end))
+
+    def to_json(self) -> dict:
+        response = {'from': self.start}
+        for category, values in zip(CATEGORIES, self.values):
+            response[category] = values.tolist()
+        return response
+
+
+class _Generation:
+    # The generation history as one row per category, so that ranges of it
+    # can be combined with the joules all at once.
+
+    def __init__(self, history):
+        self.start = history.start
+        self.end = history.start + len(history.infos)
+        rows = [
+            [info.storage for info in history.infos],
+            [info.renewable for info in history.infos],
+            [info.non_renewable for info in history.infos],
+            [info.unknown for info in history.infos],
+        ]
+        if np is not None:
+            self.rows = np.array(rows, dtype=np.float64)
+        else:
+            self.rows = [array('d', row) for row in rows]
+
+
+def _attribute(joules: memoryview, generation: _Generation, first: int) -> list:
+    # The joules of the buckets from `first` on, split into the categories.
+    length = len(joules)
+    # The part of the buckets that has generation data.
+    known_from = min(length, max(0, generation.start - first))
+    known_until = max(known_from, min(length, generation.end - first))
+    offset = first - generation.start
+
+    if np is not None:
+        joules = np.frombuffer(joules, dtype=np.float64)
+        shares = np.zeros((len(CATEGORIES), length))
+        shares[3] = 1.0
+        if known_until > known_from:
+            rows = generation.rows[:, offset + known_from:offset + known_until]
+            totals = rows.sum(axis=0)
+            has_generation = totals > 0
+            known = shares[:, known_from:known_until]
+            np.divide(rows, totals, out=known, where=has_generation)
+            known[3][~has_generation] = 1.0
+        return [array('d', row.tobytes()) for row in shares * joules]
+
+    attributed = [array('d', bytes(8 * length)) for _ in CATEGORIES]
+    for i in range(length):
+        total = 0.0
+        if known_from <= i < known_until:
+            total = sum(row[offset + i] for row in generation.rows)
+        if total <= 0:
+            attributed[3][i] = joules[i]
+            continue
+        for row, values in zip(generation.rows, attributed):
+            values[i] = joules[i] * row[offset + i] / total
+    return attributed
+
+
+attributions = {}
+_generation = None
+_history = None
+
+
+def _first_change(old, new) -> int:
+    # The first bucket whose generation data differs between two versions of
+    # the history. Infos that didn't change are the same objects.
+    if old is None:
+        return new.start
+    for i, info in enumerate(new.infos):
+        j = new.start + i - old.start
+        if j < 0 or j >= len(old.infos) or old.infos[j] is not info:
+            return new.start + i
+    return new.start + len(new.infos)
+
+
+def update(history):
+    # Should be called from the usage monitor thread after every tick.
+    global _generation, _history
+    changed_from = float('inf')
+    if history is not _history:
+        changed_from = _first_change(_history, history)
+        _generation = _Generation(history)
+        _history = history
+    for source in usage.sources:
+        if source.id not in attributions:
+            attributions[source.id] = Attribution()
+        attributions[source.id].update(source.long_term_joules, _generation, changed_from)
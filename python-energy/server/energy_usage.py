@@ -2,132 +2,375 @@
 
 import itertools
 import time
-from collections import deque
-from datetime import datetime
-from math import ceil
-from re import M
+from datetime import datetime, timedelta
+from math import floor
+from threading import Lock, Thread
 
-from measure import McpDevice, McpHandle, MeasureError, NvmlHandle, RaplHandle
+from measure import McpDevice, NvmlHandle, RaplGroup
 
+import server.utils as utils
+from server.high_rate import HighRateRecorder
+from server.ring_buffer import RingBuffer
+from server.rollups import Rollups
+from server.sampling import Sample, Sampler
+from server.store import Store
 from server.utils import *
 
 
 class Source:
+    # Servers can have many sources (several GPUs and meters), so they don't
+    # have a __dict__ and keep their history in preallocated ring buffers.
+    __slots__ = ['id', 'name', 'joules', 'watts', 'device', 'stale', 'timestamp',
+                 '_recorded_joules', '_recorded_at', 'watts_over_time', 'joules_at_ticks',
+                 'rollups', 'long_term_joules']
+
     def __init__(self, id: str, name: str):
         self.id = id
         self.name = name
         self.joules = 0
         self.watts = 0
 
+        # The device this source gets its values from. Several sources can
+        # share a device (like the RAPL domains), which is then read only once
+        # per tick.
+        self.device = None
+
+        # Whether the device didn't deliver a sample in the last tick.
+        self.stale = False
+        # The time.monotonic_ns() of the last sample.
+        self.timestamp = None
+        # The joules that are already part of the rollups and the seconds
+        # since server start when they were added.
+        self._recorded_joules = 0
+        self._recorded_at = None
+
         # has one watts value per short_term_resolution
-        self.watts_over_time = deque([])
+        self.watts_over_time = RingBuffer(round(short_term_history / short_term_resolution))
+        # has the joules at the end of every tick, see `tick_times`
+        self.joules_at_ticks = RingBuffer(round(short_term_history / short_term_resolution))
+
+        # the energy in several resolutions, each kept for a limited time
+        self.rollups = Rollups(rollup_tiers)
+
+        # has one joules value per long_term_resolution since server start;
+        # its `start` is the index of the oldest bucket that is still kept
+        self.long_term_joules = self.rollups.tier(long_term_resolution).joules
+
+    # Called every tick with the sample of the device. A tick covers `slots`
+    # short_term_resolutions, which is more than one if the monitor backed off
+    # because nothing was going on.
+    def tick(self, sample: Sample, slots: int = 1):
+        self.stale = False
+        self.timestamp = sample.timestamp
+        self._record(slots)
 
-        # has one joules value per long_term_resolution since server start
-        self.long_term_joules = []
+    def _seconds_since_last_sample(self, sample: Sample):
+        # Ticks may start late or devices may have been stale, so we never
+        # assume that exactly short_term_resolution passed.
+        if self.timestamp is None:
+            return 0
+        return (sample.timestamp - self.timestamp) / 1e9
 
-    # called every short_term_resolution
-    def tick(self):
-        self.watts_over_time.append(self.watts)
-        if len(self.watts_over_time) > 100:
-            self.watts_over_time.popleft()
+    # called every tick if the device didn't deliver a sample in time
+    def tick_stale(self, slots: int = 1):
+        self.stale = True
+        self._record(slots)
 
-        index = ceil((datetime.now() - server_started) / long_term_resolution)
-        while len(self.long_term_joules) < index - 1:
-            self.long_term_joules.append(0)
-        if len(self.long_term_joules) < index:
-            self.long_term_joules.append(self.watts)
-        else:
-            self.long_term_joules[index - 1] += self.watts
+    def _record(self, slots: int):
+        # The watts are the average over the whole tick, so we use them for
+        # all slots it covers.
+        for _ in range(min(slots, self.watts_over_time.capacity)):
+            self.watts_over_time.append(self.watts)
+
+        new_joules = self.joules - self._recorded_joules
+        now = (datetime.now() - utils.server_started).total_seconds()
+        since = now if self._recorded_at is None else self._recorded_at
+        self.rollups.add(since, now, new_joules, self.watts)
+        self._recorded_joules = self.joules
+        self._recorded_at = now
 
     def __repr__(self):
         return self.id
 
 
+class RaplDevice:
+    # Reads all RAPL domains with one syscall, so that they are consistent.
+    deadline = timedelta(milliseconds=100)
+    # Reading RAPL is cheap enough to do it many times per second.
+    supports_high_rate = True
+
+    def __init__(self, group: RaplGroup):
+        self.group = group
+
+    def read(self):
+        return self.group.used_joules()
+
+
 class RaplSource(Source):
-    def __init__(self, id: str, name: str, handle: RaplHandle):
+    __slots__ = ['index', '_last_reading']
+
+    def __init__(self, id: str, name: str, device: RaplDevice, index: int):
         super().__init__(id, name)
-        self.handle = handle
+        self.device = device
+        self.index = index
+        # The counter only starts when we open it, so we add up the differences
+        # instead of using it directly. That way, the joules can continue
+        # where a previous run of the server stopped.
+        self._last_reading = None
+
+    def tick(self, sample: Sample, slots: int = 1):
+        # RAPL counts joules, so after stale or slow ticks we get the energy of
+        # all of them and spread it over the time since the last sample.
+        reading = sample.reading[self.index]
+        joules = 0 if self._last_reading is None else reading - self._last_reading
+        self._last_reading = reading
+        seconds = self._seconds_since_last_sample(sample)
+        self.watts = 0 if joules == 0 or seconds == 0 else joules / seconds
+        self.joules += joules
+        super().tick(sample, slots)
+
+class McpMeter:
+    # Reads both channels of an MCP with one serial command.
+    deadline = timedelta(milliseconds=500)
+
+    def __init__(self, device: McpDevice):
+        self.device = device
+
+    def read(self):
+        return self.device.current_watts()
 
-    def tick(self):
-        joules = self.handle.used_joules()
-        self.watts = 0 if joules == self.joules else \
-            (joules - self.joules) / short_term_resolution.total_seconds()
-        self.joules = joules
-        super().tick()
 
 class McpSource(Source):
-    def __init__(self, id: str, name: str, handle: McpHandle):
+    __slots__ = ['channel']
+
+    def __init__(self, id: str, name: str, meter: McpMeter, channel: int):
         super().__init__(id, name)
+        self.device = meter
+        self.channel = channel
+
+    def tick(self, sample: Sample, slots: int = 1):
+        self.joules += self.watts * self._seconds_since_last_sample(sample)
+        self.watts = sample.reading[self.channel]
+        super().tick(sample, slots)
+
+class NvmlDevice:
+    deadline = timedelta(milliseconds=300)
+
+    def __init__(self, handle: NvmlHandle):
         self.handle = handle
 
-    def tick(self):
-        self.joules += self.watts * short_term_resolution.total_seconds()
-        self.watts = self.handle.current_watts()
-        super().tick()
+    def read(self):
+        return self.handle.current_watts()
+
 
 class NvmlSource(Source):
+    __slots__ = []
+
     def __init__(self, id: str, name: str, handle: NvmlHandle):
         super().__init__(id, name)
-        self.handle = handle
+        self.device = NvmlDevice(handle)
 
-    def tick(self):
-        self.joules += self.watts * short_term_resolution.total_seconds()
-        self.watts = self.handle.current_watts()
-        super().tick()
-
-
-def discover_sources():
-    print("Discovering sources.")
-    
-    # RAPL sources
-    print("Discovering RAPL.")
-    rapl_sources = [
-        # (internal id, user-visible name, event type)
-        ('all', 'RAPL, all', 'energy-pkg'),
-        ('cpu', 'RAPL, CPU', 'energy-cores'),
-        ('ram', 'RAPL, RAM', 'energy-ram'),
-        ('gpu', 'RAPL, integrated GPU', 'energy-gpu'),
-    ]
-    for (id, name, event_type) in rapl_sources:
-        try:
-            yield RaplSource(id, name, RaplHandle(event_type))
-        except MeasureError:
-            pass # Event is not available on this machine.
-
-    # MCP sources
-    print("Discovering MCP.")
-    for device_id in range(5):
-        try:
-            device = McpDevice(f'/dev/ttyACM{device_id}')
-        except MeasureError:
-            continue # This MCP is not connected.
-        for channel in range(2):
-            yield McpSource(
-                f'mcp{device_id}ch{channel}',
-                f'MCP {device_id}, channel {channel}',
-                McpHandle(device, channel),
-            )
-
-    # NVML sources
-    print("Discovering NVML.")
-    for gpu_index in range(10):
-        try:
-            handle = NvmlHandle(gpu_index)
-        except MeasureError:
-            continue # This GPU doesn't exist.
-        yield NvmlSource(f'nvml{gpu_index}', f'NVML, external Nvidia GPU {gpu_index}', handle)
-
-
-sources = list(discover_sources())
-if len(sources) == 0:
-    print(f'No sources available. Maybe you want to run this as sudo or adjust perf_event levels?')
-    exit(0)
-else:
+    def tick(self, sample: Sample, slots: int = 1):
+        self.joules += self.watts * self._seconds_since_last_sample(sample)
+        self.watts = sample.reading
+        super().tick(sample, slots)
+
+
+# All sources that are online. Discovery (see server.discovery) runs in the
+# background and hands new sources to `add_sources`; the monitor adopts them
+# at the start of its next tick and then replaces this list, so readers can
+# just grab the current one.
+sources = []
+_new_sources = []
+_new_sources_lock = Lock()
+
+# Every device is read by its own sampler.
+samplers = []
+
+# Recorders for devices that are sampled with a high rate. They are only
+# created when the devices come online, so that the high-rate configuration
+# can be changed before.
+high_rate_recorders = []
+
+# How many short_term_resolutions all ticks covered so far.
+total_slots = 0
+
+# The unix time at the end of every recent tick. Together with the
+# `joules_at_ticks` of the sources, this tells how much energy they used
+# between any two points in time (see server.intervals). Readers need to hold
+# the lock, because the values of a tick are appended one after another.
+tick_times = RingBuffer(round(short_term_history / short_term_resolution))
+ticks_lock = Lock()
+
+
+def add_sources(new_sources: list):
+    # Can be called from any thread.
+    with _new_sources_lock:
+        _new_sources.extend(new_sources)
+    # Don't let a backed-off monitor wait until it notices them.
+    adaptive_rate.wakeup.set()
+
+
+def _adopt_new_sources():
+    global sources
+    with _new_sources_lock:
+        new_sources = [it for it in _new_sources if it.id not in {source.id for source in sources}]
+        _new_sources.clear()
+    if not new_sources:
+        return
+
+    new_samplers = []
+    for source in new_sources:
+        # The short-term history of all sources ends at the same tick.
+        source.watts_over_time.pad_to(total_slots)
+        if store is not None:
+            _restore(source)
+        # The source didn't use anything before it came online.
+        with ticks_lock:
+            source.joules_at_ticks.pad_to(tick_times.total, source.joules)
+        sampler = next((it for it in samplers if it.device is source.device), None)
+        if sampler is None:
+            sampler = Sampler(source.device, [])
+            samplers.append(sampler)
+            new_samplers.append(sampler)
+        sampler.sources.append(source)
+    for sampler in new_samplers:
+        _start_high_rate_recorder(sampler)
+    sources = sources + new_sources
     print(f'Available sources: {sources}')
 
-def tick():
+
+def _start_high_rate_recorder(sampler: Sampler):
+    if utils.high_rate_resolution is None or \
+            not getattr(sampler.device, 'supports_high_rate', False):
+        return
+    recorder = HighRateRecorder(
+        sampler.device, sampler.sources, utils.high_rate_resolution, utils.high_rate_history)
+    high_rate_recorders.append(recorder)
+    Thread(target=tick_repeatedly, args=(utils.high_rate_resolution, recorder.sample),
+           daemon=True).start()
+    # The recorders aggregate per tick, so we never back off.
+    adaptive_rate.slow = adaptive_rate.fast
+
+def tick(slots: int = 1):
+    # Reads all devices in parallel and waits for each of them until its
+    # deadline. Sources of devices that didn't make it are marked as stale.
+    global total_slots
+    _adopt_new_sources()
+    tick_started = time.monotonic()
+    for sampler in samplers:
+        sampler.start()
+    for sampler in samplers:
+        sample = sampler.collect(tick_started)
+        for source in sampler.sources:
+            if sample is None:
+                source.tick_stale(slots)
+            else:
+                source.tick(sample, slots)
+    for recorder in high_rate_recorders:
+        recorder.finish_second()
+    with ticks_lock:
+        for source in sources:
+            source.joules_at_ticks.append(source.joules)
+        tick_times.append(time.time())
+    adaptive_rate.observe([source.watts for source in sources])
+    # Until discovery found the first sources, there is nothing to keep (and
+    # every restart would leave a segment without columns behind).
+    if store is not None and sources:
+        store.append(time.time(), [source.id for source in sources],
+                     [source.joules for source in sources])
+        _save_long_tiers()
+    total_slots += slots
+
+# Where the history is persisted, if anywhere.
+store: Store = None
+
+# The buckets of the tiers that outlive the records of the store, per source id
+# and resolution in seconds. The records can't rebuild those after a restart, so
+# they are saved on their own every long_term_resolution.
+_long_tiers: dict = {}
+_long_tiers_saved_in = None
+
+def use_store(new_store: Store):
+    # Sources continue where they stopped in the last run of the server. Must
+    # be called before the monitor starts.
+    global store, _long_tiers
+    store = new_store
+    _long_tiers = store.load_json('rollups') or {}
+
+
+def _save_long_tiers():
+    global _long_tiers_saved_in
+    seconds = long_term_resolution.total_seconds()
+    bucket = floor((time.time() - utils.server_started.timestamp()) / seconds)
+    if bucket == _long_tiers_saved_in:
+        return
+    _long_tiers_saved_in = bucket
+    # Sources that are offline keep what they had.
     for source in sources:
-        source.tick()
+        _long_tiers[source.id] = {
+            str(tier.resolution.total_seconds()): {
+                'from': tier.joules.start,
+                'joules': tier.joules.tolist(),
+                'min': tier.minimum.tolist(),
+                'max': tier.maximum.tolist(),
+            }
+            for tier in source.rollups.tiers
+            if tier.resolution * tier.joules.capacity > utils.store_history
+        }
+    store.save_json('rollups', _long_tiers)
+
+
+def _restore(source: Source):
+    epoch = utils.server_started.timestamp()
+    now = time.time()
+    latest = store.latest(source.id)
+    if latest is None:
+        return  # This source is new.
+    source.joules = source._recorded_joules = latest[1]
+    source._recorded_at = now - epoch
+
+    # The joules of the store are cumulative, so the energy of any bucket is
+    # just the difference of the values at its borders. Borders before the
+    # first record are the first record, not 0.
+    first_time = store.first_time(source.id)
+    saved_tiers = _long_tiers.get(source.id, {})
+    for tier in source.rollups.tiers:
+        seconds = tier.resolution.total_seconds()
+        last = floor((now - epoch) / seconds)
+        kept_from = max(0, last - tier.joules.capacity + 1)
+        first = max(kept_from, floor((first_time - epoch) / seconds))
+        saved = saved_tiers.get(str(seconds))
+        if saved is not None:
+            # The saved buckets come first, except the last one, which was
+            # still current when it was saved. The records have the rest.
+            start = max(kept_from, saved['from'])
+            end = min(last, saved['from'] + len(saved['joules']) - 1)
+            if start < end:
+                offset = start - saved['from']
+                tier.load(start, *(saved[key][offset:end - saved['from']]
+                                   for key in ['joules', 'min', 'max']))
+                first = max(first, end)
+        borders = [store.value_at(source.id, max(first_time, epoch + index * seconds))
+                   for index in range(first, last + 1)] + [latest[1]]
+        tier.load(first, [end - start for start, end in zip(borders, borders[1:])])
+
+    seconds = short_term_resolution.total_seconds()
+    slots = source.watts_over_time.capacity
+    borders = [store.value_at(source.id, now - (slots - index) * seconds)
+               for index in range(slots + 1)]
+    for start, end in zip(borders, borders[1:]):
+        source.watts_over_time.append((end - start) / seconds)
+
+scheduler_stats = SchedulerStats()
+# RAPL counts joules, so backing off doesn't lose any energy. MCP and NVML only
+# report watts, but we only back off while those are flat.
+adaptive_rate = AdaptiveRate(short_term_resolution, idle_resolution)
 
-def monitor():
-    tick_repeatedly(short_term_resolution, tick)
+def monitor(on_tick=lambda slots: None):
+    # `on_tick` is called on the monitor thread after all sources ticked, with
+    # the number of short_term_resolutions the tick covered.
+    def tick_and_notify(slots: int):
+        tick(slots)
+        on_tick(slots)
+    tick_adaptively(adaptive_rate, tick_and_notify, scheduler_stats)
@@ -0,0 +1,99 @@
+import json
+import struct
+import sys
+from array import array
+
+# A compact binary encoding of responses, for clients that send
+# `Accept: application/vnd.python-energy.frame`. Responses are mostly long
+# lists of numbers, which are much cheaper to copy around as raw float64s than
+# to turn into text and back:
+#
+#     magic:  b'PEF1'
+#     uint32: length of the header in bytes (little endian)
+#     header: the response as JSON, where every list of numbers is replaced by
+#             {"$f64": [offset, length]}, counted in float64s from the start
+#             of the data; padded with spaces, so that the data is aligned
+#     data:   the float64s of all lists (little endian)
+#
+# This module only uses the standard library, because jupyter_energy uses it
+# too (its frame.py is a link to this file): there, lists of numbers are kept
+# as the `array('d')`s that `decode` returns, so merging and forwarding them
+# is just copying memory.
+
+CONTENT_TYPE = 'application/vnd.python-energy.frame'
+MAGIC = b'PEF1'
+
+
+def encode(response: dict) -> bytes:
+    # Both `array('d')`s and lists of numbers are stored as float64s.
+    arrays = []
+    num_floats = 0
+
+    def replace(value):
+        nonlocal num_floats
+        if isinstance(value, dict):
+            return {key: replace(item) for key, item in value.items()}
+        if isinstance(value, array) or (isinstance(value, list) and _is_numeric(value)):
+            floats = value if isinstance(value, array) and value.typecode == 'd' else array('d', value)
+            arrays.append(floats)
+            num_floats += len(floats)
+            return {'$f64': [num_floats - len(floats), len(floats)]}
+        if isinstance(value, list):
+            return [replace(item) for item in value]
+        return value
+
+    header = json.dumps(replace(response)).encode('utf-8')
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+    data = b''.join(_little_endian(floats) for floats in arrays)
+    return MAGIC + struct.pack('<I', len(header)) + header + data
+
+
+def decode(data: bytes) -> dict:
+    # Turns a frame into a response whose lists of numbers are `array('d')`s.
+    # The data can also be a memoryview; the response never refers to it.
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('Not a frame.')
+    (header_length,) = struct.unpack_from('<I', data, len(MAGIC))
+    header_end = len(MAGIC) + 4 + header_length
+    floats = memoryview(data)[header_end:].cast('d')
+
+    def restore(value):
+        if isinstance(value, dict):
+            if '$f64' in value:
+                offset, length = value['$f64']
+                values = array('d', floats[offset:offset + length])
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                return values
+            return {key: restore(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [restore(item) for item in value]
+        return value
+
+    try:
+        return restore(json.loads(bytes(data[len(MAGIC) + 4:header_end])))
+    finally:
+        floats.release()
+
+
+def to_json(response: dict) -> str:
+    # Encodes a response that may contain `array('d')`s as JSON.
+    return json.dumps(response, default=_array_to_list)
+
+
+def _array_to_list(value):
+    if isinstance(value, array):
+        return value.tolist()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _is_numeric(values: list) -> bool:
+    return all(type(value) is float or type(value) is int for value in values)
+
+
+def _little_endian(floats: array) -> bytes:
+    if sys.byteorder == 'little':
+        return floats.tobytes()
+    swapped = array('d', floats)
+    swapped.byteswap()
+    return swapped.tobytes()
@@ -0,0 +1,109 @@
+import hashlib
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+import server.utils as utils
+from server.utils import *
+
+# Fetches how the energy of a day was generated from a provider (see
+# server.generation_providers), as [storage, renewable, non_renewable, unknown]
+# for every long_term_resolution of the day.
+#
+# Days that are over for a while don't change anymore, so they are only
+# fetched until they are final and then served from the cache. The cache is
+# kept in memory and, if there is a store, also in the store, so that it
+# survives restarts. For the other days, we send conditional requests and only
+# parse the response again if it changed.
+
+
+class GenerationFetcher:
+    def __init__(self, provider, store=None):
+        self.provider = provider
+        self.session = requests.Session()
+        self.store = store
+        # cached days by their ISO date: {'final', 'etag', 'lastModified',
+        # 'digest', 'infos'}
+        self.days = {}
+        if store is not None:
+            self.days = store.load_json(f'generation-days-{provider.name}') or {}
+
+    def fetch(self, day: datetime) -> tuple:
+        # Returns the infos of the day (a list of lists, empty if we don't
+        # know anything about the day) and whether they changed since the last
+        # call. Never raises; if ENTSO-E can't be reached, we just keep what we
+        # have.
+        key = day.date().isoformat()
+        cached = self.days.get(key)
+        if cached is not None and cached['final']:
+            return cached['infos'], False
+
+        fetched_at = datetime.now()
+        try:
+            response = self._get(day, cached)
+        except requests.RequestException as e:
+            # The message of the exception may contain the URL, which may
+            # contain the security token of the provider.
+            print(f'Fetching the generation of {key} from {self.provider.name} '
+                  f'failed: {_describe(e)}')
+            return (cached['infos'] if cached else []), False
+
+        final = fetched_at - (day + timedelta(days=1)) >= utils.generation_final_after
+        if response.status_code == 304:
+            infos = cached['infos']
+        else:
+            digest = hashlib.sha256(response.content).hexdigest()
+            if cached is not None and cached['digest'] == digest:
+                infos = cached['infos']
+            else:
+                try:
+                    infos = self.provider.parse(response.content, day)
+                except (ValueError, KeyError, IndexError, TypeError) as e:
+                    print(f'The generation page of {key} changed its format: {e}')
+                    return (cached['infos'] if cached else []), False
+            cached = {
+                'etag': response.headers.get('ETag'),
+                'lastModified': response.headers.get('Last-Modified'),
+                'digest': digest,
+            }
+        changed = key not in self.days or self.days[key]['infos'] != infos
+        self.days[key] = {**cached, 'final': final, 'infos': infos}
+        self._forget_old_days(day)
+        if self.store is not None and (changed or final):
+            self.store.save_json(f'generation-days-{self.provider.name}', self.days)
+        return infos, changed
+
+    def _get(self, day: datetime, cached: dict):
+        headers = {}
+        if cached is not None and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached is not None and cached['lastModified']:
+            headers['If-Modified-Since'] = cached['lastModified']
+        url = self.provider.url(day)
+
+        for attempt in range(utils.generation_retries + 1):
+            try:
+                response = self.session.get(
+                    url, headers=headers, timeout=utils.generation_timeout.total_seconds())
+                if response.status_code < 500:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(
+                    f'{response.status_code} {response.reason}', response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt < utils.generation_retries:
+                time.sleep(2 ** attempt)
+        raise error
+
+    def _forget_old_days(self, today: datetime):
+        oldest = (today - long_term_history - timedelta(days=1)).date().isoformat()
+        for key in [key for key in self.days if key < oldest]:
+            del self.days[key]
+
+
+def _describe(error: requests.RequestException) -> str:
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return f'{type(error).__name__} {error.response.status_code}'
+    return type(error).__name__
@@ -0,0 +1,226 @@
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from math import floor
+from urllib.parse import urlencode
+from xml.etree import ElementTree
+from zoneinfo import ZoneInfo
+
+import server.utils as utils
+from server.utils import *
+
+# Providers know where the energy generation of a day comes from and how to
+# parse it. `parse` turns the content of the response into a list with an entry
+# for every long_term_resolution of the day that was reported so far:
+# [storage, renewable, non_renewable, unknown], all in MW.
+#
+# Both providers classify production types by their names. Classifying them is
+# done once per name, not for every value.
+
+STORAGE, RENEWABLE, NON_RENEWABLE, UNKNOWN = range(4)
+
+
+def classify(name: str):
+    # The category of a production type or None if it consumes energy.
+    name = name.lower()
+    if 'consumption' in name:
+        return None
+
+    def matches_keywords(keywords):
+        return any(keyword in name for keyword in keywords)
+
+    if matches_keywords(['reservoir', 'storage']):
+        return STORAGE
+    if matches_keywords(['biomass', 'geothermal', 'hydro', 'renewable', 'solar', 'waste', 'wind']):
+        return RENEWABLE
+    if matches_keywords(['fossil', 'nuclear']):
+        return NON_RENEWABLE
+    return UNKNOWN
+
+
+class GenerationProvider:
+    name = None
+
+    def url(self, day: datetime) -> str:
+        raise NotImplementedError()
+
+    def parse(self, content: bytes, day: datetime) -> list:
+        raise NotImplementedError()
+
+
+class ChartProvider(GenerationProvider):
+    # Scrapes the chart on the generation page of the ENTSO-E transparency
+    # platform. It's embedded into the page as `var chart = {...};`.
+    name = 'chart'
+    _PREFIX = 'var chart = '
+
+    def __init__(self, url: str = None):
+        self._url = url
+        self._categories = {}
+
+    def url(self, day: datetime) -> str:
+        return (self._url or utils.generation_url).format(date=day.strftime('%d.%m.%Y'))
+
+    def parse(self, content: bytes, day: datetime) -> list:
+        page = content.decode('utf-8')
+        start = page.find(self._PREFIX)
+        if start < 0:
+            raise ValueError('The page contains no chart.')
+        # Only decodes the chart, no matter what follows it.
+        chart, _ = json.JSONDecoder().raw_decode(page, start + len(self._PREFIX))
+        return self.parse_chart(chart)
+
+    def parse_chart(self, chart: dict) -> list:
+        if chart['chartDesign']['xAxisTitle'] != 'Time [Hours]':
+            raise ValueError(f'Unexpected x axis {chart["chartDesign"]["xAxisTitle"]}.')
+        rows = chart['chartData']
+        keys = chart['chartKeys']
+        # Intervals that aren't reported yet have no values at all.
+        num_reported = len(rows)
+        while num_reported > 0 and not any(rows[num_reported - 1].get(key) for key in keys):
+            num_reported -= 1
+        rows = rows[:num_reported]
+
+        # Every category is the sum of the columns of its production types.
+        columns = [[] for _ in range(4)]
+        for key in keys:
+            title = chart['graphDesign'][key]['title']
+            if title not in self._categories:
+                self._categories[title] = classify(title)
+            category = self._categories[title]
+            if category is not None:
+                columns[category].append([int(row.get(key) or 0) for row in rows])
+        sums = [
+            list(map(sum, zip(*category_columns))) if category_columns else [0] * len(rows)
+            for category_columns in columns
+        ]
+        return [list(values) for values in zip(*sums)]
+
+
+# The production types of ENTSO-E by their codes.
+PRODUCTION_TYPES = {
+    'B01': 'Biomass',
+    'B02': 'Fossil Brown coal/Lignite',
+    'B03': 'Fossil Coal-derived gas',
+    'B04': 'Fossil Gas',
+    'B05': 'Fossil Hard coal',
+    'B06': 'Fossil Oil',
+    'B07': 'Fossil Oil shale',
+    'B08': 'Fossil Peat',
+    'B09': 'Geothermal',
+    'B10': 'Hydro Pumped Storage',
+    'B11': 'Hydro Run-of-river and poundage',
+    'B12': 'Hydro Water Reservoir',
+    'B13': 'Marine',
+    'B14': 'Nuclear',
+    'B15': 'Other renewable',
+    'B16': 'Solar',
+    'B17': 'Waste',
+    'B18': 'Wind Offshore',
+    'B19': 'Wind Onshore',
+    'B20': 'Other',
+    'B25': 'Energy storage',
+}
+_CATEGORIES = {code: classify(name) for code, name in PRODUCTION_TYPES.items()}
+_RESOLUTION = re.compile(r'PT(\d+)([MH])')
+
+
+class TransparencyApiProvider(GenerationProvider):
+    # Uses the REST API of the ENTSO-E transparency platform, which returns the
+    # actual generation per production type (document type A75) as XML. It
+    # needs a security token, which can be requested from ENTSO-E for free.
+    name = 'api'
+    API_URL = 'https://web-api.tp.entsoe.eu/api'
+
+    # Days are the days of the market of the area (like on the generation
+    # page), not the ones of this host.
+    def __init__(self, token: str, area: str = '10Y1001A1001A83F',
+                 market_timezone: str = 'Europe/Berlin'):
+        self.token = token
+        self.area = area
+        self.market_timezone = ZoneInfo(market_timezone)
+
+    def url(self, day: datetime) -> str:
+        start, end = _utc_day(day, self.market_timezone)
+        return self.API_URL + '?' + urlencode({
+            'securityToken': self.token,
+            'documentType': 'A75',
+            'processType': 'A16',
+            'in_Domain': self.area,
+            'periodStart': start.strftime('%Y%m%d%H%M'),
+            'periodEnd': end.strftime('%Y%m%d%H%M'),
+        })
+
+    def parse(self, content: bytes, day: datetime) -> list:
+        try:
+            root = ElementTree.fromstring(content)
+        except ElementTree.ParseError as e:
+            raise ValueError(f'Invalid XML: {e}') from e
+        if not root.tag.endswith('GL_MarketDocument'):
+            reason = root.findtext('.//{*}Reason/{*}text') or root.tag
+            raise ValueError(f'Not a generation document: {reason}')
+
+        # Looking elements up with the namespace is much faster than with a
+        # wildcard.
+        ns = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+        day_start, day_end = _utc_day(day, self.market_timezone)
+        num_intervals = round((day_end - day_start) / long_term_resolution)
+        sums = [[0.0] * num_intervals for _ in range(4)]
+        num_reported = 0
+        for series in root.iterfind(ns + 'TimeSeries'):
+            # Series with an out domain are the consumption of storages.
+            if series.find(ns + 'outBiddingZone_Domain.mRID') is not None:
+                continue
+            category = _CATEGORIES.get(series.findtext(f'{ns}MktPSRType/{ns}psrType'), UNKNOWN)
+            if category is None:
+                continue
+            # With curve type A03, points are only given when the value
+            # changes.
+            variable = series.findtext(ns + 'curveType') == 'A03'
+            category_sums = sums[category]
+            for period in series.iterfind(ns + 'Period'):
+                start = _parse_time(period.findtext(f'{ns}timeInterval/{ns}start'))
+                end = _parse_time(period.findtext(f'{ns}timeInterval/{ns}end'))
+                resolution = _parse_resolution(period.findtext(ns + 'resolution'))
+                points = sorted(
+                    (int(point.findtext(ns + 'position')), float(point.findtext(ns + 'quantity')))
+                    for point in period.iterfind(ns + 'Point')
+                )
+                num_positions = round((end - start) / resolution)
+                # Values are average MW, so finer resolutions are averaged.
+                weight = min(1.0, resolution / long_term_resolution)
+                # The intervals per position and the interval of position 1.
+                ratio = resolution / long_term_resolution
+                offset = (start - day_start) / long_term_resolution
+                for i, (position, quantity) in enumerate(points):
+                    if variable:
+                        last = points[i + 1][0] if i + 1 < len(points) else num_positions + 1
+                    else:
+                        last = position + 1
+                    first = floor(offset + (position - 1) * ratio)
+                    until = max(first + 1, floor(offset + (last - 1) * ratio))
+                    value = weight * quantity
+                    for interval in range(max(0, first), min(num_intervals, until)):
+                        category_sums[interval] += value
+                    num_reported = max(num_reported, min(num_intervals, until))
+        return [[round(sums[category][i]) for category in range(4)] for i in range(num_reported)]
+
+
+def _utc_day(day: datetime, market_timezone: ZoneInfo) -> tuple:
+    # The start and end of the day in the market's timezone in UTC. They are
+    # 23 or 25 hours apart when the clocks change.
+    start = datetime.combine(day.date(), datetime.min.time(), market_timezone)
+    end = datetime.combine(day.date() + timedelta(days=1), datetime.min.time(), market_timezone)
+    return start.astimezone(timezone.utc), end.astimezone(timezone.utc)
+
+
+def _parse_time(text: str) -> datetime:
+    return datetime.strptime(text, '%Y-%m-%dT%H:%MZ').replace(tzinfo=timezone.utc)
+
+
+def _parse_resolution(text: str) -> timedelta:
+    match = _RESOLUTION.fullmatch(text or '')
+    if match is None:
+        raise ValueError(f'Unsupported resolution {text}.')
+    amount = int(match.group(1))
+    return timedelta(minutes=amount) if match.group(2) == 'M' else timedelta(hours=amount)
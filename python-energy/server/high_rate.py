@@ -0,0 +1,163 @@
+import time
+from array import array
+from datetime import timedelta
+from math import inf
+from threading import Lock
+
+from server.utils import *
+
+
+class HighRateRecorder:
+    # Samples a device much more often than once per second, so that short
+    # spikes become visible. This only makes sense for devices that are cheap
+    # to read and count joules (like RAPL): each reading is a list of joules,
+    # and every source has an `index` into it.
+    #
+    # All samples of the last `history` are kept in preallocated ring buffers.
+    # In addition, every second is aggregated into its minimum, maximum and
+    # mean watts and its joules, which are kept for `seconds_history` seconds.
+    # Nothing allocates per sample, so a high rate doesn't create garbage.
+
+    def __init__(self, device, sources: list, resolution: timedelta, history: timedelta,
+                 seconds_history: int = 100):
+        self.device = device
+        self.sources = sources
+        self.resolution = resolution
+        self._lock = Lock()
+        num_sources = len(sources)
+
+        # samples
+        self.capacity = round(history / resolution)
+        self.num_samples = 0
+        self.timestamps = array('q', bytes(8 * self.capacity))
+        self.watts = [array('d', bytes(8 * self.capacity)) for _ in sources]
+        self._last_joules = None
+        self._last_timestamp = None
+
+        # aggregates of the current second
+        self._minimum = array('d', [inf] * num_sources)
+        self._maximum = array('d', [0.0] * num_sources)
+        self._joules = array('d', [0.0] * num_sources)
+        self._seconds = 0.0
+
+        # aggregates of finished seconds
+        self.seconds_capacity = seconds_history
+        self.num_seconds = 0
+        self.second_minimum = [array('d', bytes(8 * seconds_history)) for _ in sources]
+        self.second_maximum = [array('d', bytes(8 * seconds_history)) for _ in sources]
+        self.second_mean = [array('d', bytes(8 * seconds_history)) for _ in sources]
+        self.second_joules = [array('d', bytes(8 * seconds_history)) for _ in sources]
+
+    # called every resolution on the recorder's own thread
+    def sample(self):
+        reading = self.device.read()
+        timestamp = time.monotonic_ns()
+        with self._lock:
+            if self._last_joules is not None and timestamp > self._last_timestamp:
+                seconds = (timestamp - self._last_timestamp) / 1e9
+                slot = self.num_samples % self.capacity
+                self.timestamps[slot] = timestamp
+                for i, source in enumerate(self.sources):
+                    joules = reading[source.index] - self._last_joules[source.index]
+                    watts = joules / seconds
+                    self.watts[i][slot] = watts
+                    if watts < self._minimum[i]:
+                        self._minimum[i] = watts
+                    if watts > self._maximum[i]:
+                        self._maximum[i] = watts
+                    self._joules[i] += joules
+                self._seconds += seconds
+                self.num_samples += 1
+            self._last_joules = reading
+            self._last_timestamp = timestamp
+
+    # called every short_term_resolution by the usage monitor
+    def finish_second(self):
+        with self._lock:
+            slot = self.num_seconds % self.seconds_capacity
+            for i in range(len(self.sources)):
+                no_samples = self._minimum[i] == inf
+                self.second_minimum[i][slot] = 0 if no_samples else self._minimum[i]
+                self.second_maximum[i][slot] = self._maximum[i]
+                self.second_mean[i][slot] = self._joules[i] / self._seconds if self._seconds else 0
+                self.second_joules[i][slot] = self._joules[i]
+                self._minimum[i] = inf
+                self._maximum[i] = 0.0
+                self._joules[i] = 0.0
+            self._seconds = 0.0
+            self.num_seconds += 1
+
+    def between(self, start: int, end: int):
+        # The joules and the peak watts of every source between two
+        # time.monotonic_ns() timestamps, counting samples that only partly
+        # overlap the range by the overlapping part. None if the kept samples
+        # don't cover the whole range.
+        with self._lock:
+            length = min(self.num_samples, self.capacity)
+            first = self.num_samples - length
+
+            def timestamp(index: int) -> int:
+                # Indices count from the oldest kept sample.
+                return self.timestamps[(first + index) % self.capacity]
+
+            if length < 2 or timestamp(0) > start or timestamp(length - 1) < end:
+                return None
+            # Every sample covers the time since the one before it. These are
+            # the first one that ends after the start and the first one that
+            # ends at or after the end.
+            lo = _first_index(timestamp, 1, length - 1, lambda it: it > start)
+            hi = _first_index(timestamp, lo, length - 1, lambda it: it >= end)
+
+            joules = [0.0] * len(self.sources)
+            peak = [0.0] * len(self.sources)
+            for index in range(lo, hi + 1):
+                slot = (first + index) % self.capacity
+                overlap = (min(timestamp(index), end) - max(timestamp(index - 1), start)) / 1e9
+                for i in range(len(self.sources)):
+                    watts = self.watts[i][slot]
+                    joules[i] += watts * overlap
+                    if watts > peak[i]:
+                        peak[i] = watts
+            return joules, peak
+
+    def to_json(self):
+        with self._lock:
+            samples = _ordered(self.num_samples, self.capacity)
+            seconds = _ordered(self.num_seconds, self.seconds_capacity)
+            response = {
+                'resolution': self.resolution.total_seconds(),
+                'timestamps': [monotonic_to_unix(self.timestamps[slot]) for slot in samples],
+                'sources': {},
+            }
+            for i, source in enumerate(self.sources):
+                response['sources'][source.id] = {
+                    'watts': [self.watts[i][slot] for slot in samples],
+                    'seconds': {
+                        'minimum': [self.second_minimum[i][slot] for slot in seconds],
+                        'maximum': [self.second_maximum[i][slot] for slot in seconds],
+                        'mean': [self.second_mean[i][slot] for slot in seconds],
+                        'joules': [self.second_joules[i][slot] for slot in seconds],
+                    },
+                }
+            return response
+
+
+def _first_index(timestamp, lo: int, hi: int, condition) -> int:
+    # The first index between lo and hi (inclusive) whose timestamp fulfills
+    # the condition, assuming it does for hi and for every index after one
+    # that does.
+    while lo < hi:
+        middle = (lo + hi) // 2
+        if condition(timestamp(middle)):
+            hi = middle
+        else:
+            lo = middle + 1
+    return lo
+
+
+def _ordered(length: int, capacity: int) -> list:
+    # The slots of a ring buffer from the oldest to the newest value.
+    if length <= capacity:
+        return list(range(length))
+    start = length % capacity
+    return [*range(start, capacity), *range(start)]
@@ -0,0 +1,97 @@
+from bisect import bisect_left, bisect_right
+
+import server.energy_usage as usage
+from server.utils import *
+
+# The energy that sources used between two points in time, like the start and
+# end of a notebook cell's execution, which rarely fall on the ticks of the
+# usage monitor.
+#
+# Devices that are sampled with a high rate answer this from their samples, so
+# even cells that only run for some milliseconds get their own peak. All other
+# sources interpolate the joules they had at the end of the surrounding ticks
+# (or, for older ranges, the records of the store). That's exact for the
+# energy, but the peak can only be as fine as the ticks.
+
+# Clients can't ask for more intervals at once.
+MAX_INTERVALS = 1000
+
+
+def energy(intervals: list) -> list:
+    # `intervals` is a list of (start, end) unix timestamps. For every one of
+    # them, returns either None if the usage monitor didn't tick since its end
+    # yet (so clients should ask again later) or the joules, mean and peak
+    # watts of every source. Sources that have no data for an interval (because
+    # they weren't online or it's too long ago) are missing. The peak is None
+    # for intervals that only the store knows about.
+
+    # Sources may come online while we answer, so we stick to the ones whose
+    # joules we copied.
+    with usage.ticks_lock:
+        sources = list(usage.sources)
+        times = usage.tick_times.tolist()
+        joules = {source.id: source.joules_at_ticks.tolist() for source in sources}
+    ranges = {}
+    for recorder in usage.high_rate_recorders:
+        for i, source in enumerate(recorder.sources):
+            ranges[source.id] = (recorder, i)
+
+    results = []
+    for start, end in intervals:
+        if not times or end > times[-1]:
+            results.append(None)
+            continue
+        seconds = end - start
+        result = {}
+        for source in sources:
+            high_rate = None
+            if source.id in ranges:
+                recorder, i = ranges[source.id]
+                high_rate = recorder.between(unix_to_monotonic(start), unix_to_monotonic(end))
+            if high_rate is not None:
+                used, peak = high_rate[0][i], high_rate[1][i]
+            else:
+                used, peak = _from_ticks(source, times, joules[source.id], start, end)
+            if used is None:
+                continue
+            result[source.id] = {
+                'joules': used,
+                'meanWatts': used / seconds if seconds > 0 else peak or 0.0,
+                'peakWatts': peak,
+                'highResolution': high_rate is not None,
+            }
+        results.append(result)
+    return results
+
+
+def _from_ticks(source, times: list, joules: list, start: float, end: float):
+    # The joules and the peak watts between start and end from the ticks. If
+    # the ticks don't reach back far enough, the store may still know the
+    # joules, but not the peak.
+    if start < times[0]:
+        if usage.store is None:
+            return None, None
+        used = usage.store.value_at(source.id, end) - usage.store.value_at(source.id, start)
+        return used, None
+
+    # The watts during a tick are the same all the time, so the peak is the
+    # one of the ticks that overlap the range.
+    first = min(max(1, bisect_right(times, start)), len(times) - 1)
+    last = min(max(first, bisect_left(times, end)), len(times) - 1)
+    peak = max((
+        (joules[i] - joules[i - 1]) / (times[i] - times[i - 1])
+        for i in range(first, last + 1) if i > 0 and times[i] > times[i - 1]
+    ), default=0.0)
+    used = _joules_at(times, joules, end) - _joules_at(times, joules, start)
+    return used, peak
+
+
+def _joules_at(times: list, joules: list, timestamp: float) -> float:
+    index = bisect_left(times, timestamp)
+    if index == 0:
+        return joules[0]
+    if index == len(times):
+        return joules[-1]
+    before, after = times[index - 1], times[index]
+    part = (timestamp - before) / (after - before) if after > before else 1
+    return joules[index - 1] + part * (joules[index] - joules[index - 1])
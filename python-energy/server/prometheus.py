@@ -0,0 +1,79 @@
+import server.cpu_attribution as cpu_attribution
+import server.utils as utils
+
+# The latest snapshot in the text format of Prometheus, so that scrapers don't
+# need to go through Jupyter. Like the other formats, it's only rendered once
+# per snapshot, no matter how many scrapers ask.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+GENERATION_CATEGORIES = [
+    ('storage', 'storage'), ('renewable', 'renewable'),
+    ('nonRenewable', 'non_renewable'), ('unknown', 'unknown'),
+]
+
+_rendered = (None, b'')
+
+
+def render(snapshot) -> bytes:
+    global _rendered
+    if _rendered[0] is not snapshot:
+        _rendered = (snapshot, _render(snapshot.response).encode('utf-8'))
+    return _rendered[1]
+
+
+def _render(response: dict) -> str:
+    lines = []
+
+    def metric(name: str, kind: str, help: str, samples: list):
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+            lines.append(f'{name}{{{label_text}}} {float(value)!r}')
+
+    usage = response['usage']
+    metric('python_energy_joules_total', 'counter', 'Energy used by the source.', [
+        ({'source': id, 'name': source['name']}, source['joules']) for id, source in usage.items()
+    ])
+    metric('python_energy_watts', 'gauge', 'Current power of the source.', [
+        ({'source': id, 'name': source['name']}, source['watts']) for id, source in usage.items()
+    ])
+    metric('python_energy_stale', 'gauge', 'Whether the source missed its last sample.', [
+        ({'source': id, 'name': source['name']}, source['stale']) for id, source in usage.items()
+    ])
+    metric('python_energy_generation_share', 'gauge',
+           'Share of the latest known energy generation by category.', [
+               ({'category': category}, share)
+               for category, share in generation_shares(response['generation']).items()
+           ])
+    if utils.cpu_attribution:
+        metric('python_energy_user_joules_total', 'counter',
+               'Energy of the RAPL source that the processes of the user used above idle.', [
+                   ({'source': id, 'user': user}, share['joules'])
+                   for id, source in cpu_attribution.latest['sources'].items()
+                   for user, share in source['users'].items()
+               ])
+        metric('python_energy_idle_joules_total', 'counter',
+               'Energy the RAPL source used at its idle power.', [
+                   ({'source': id}, source['idle']['joules'])
+                   for id, source in cpu_attribution.latest['sources'].items()
+               ])
+    return '\n'.join(lines) + '\n'
+
+
+def generation_shares(generation: dict) -> dict:
+    # The share of every category in the latest bucket that has generation
+    # data. Empty if there is none.
+    for index in reversed(range(len(generation['unknown']))):
+        total = sum(generation[category][index] for category, _ in GENERATION_CATEGORIES)
+        if total > 0:
+            return {
+                label: generation[category][index] / total
+                for category, label in GENERATION_CATEGORIES
+            }
+    return {}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
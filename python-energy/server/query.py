@@ -0,0 +1,144 @@
+from datetime import timedelta
+from math import ceil, floor
+
+import server.energy_generation as generation
+import server.energy_usage as usage
+import server.utils as utils
+
+# Answers questions like "how much energy did the CPU use per hour during the
+# last week?" from the rollup tiers of the sources. The tiers are indexed by
+# the time since the server started, so finding the buckets of a time range
+# doesn't need to look at any other buckets.
+
+# No matter what clients ask for, responses don't get larger than this.
+MAX_POINTS = 10000
+
+
+def query(start: float, end: float, sources: list, resolution: float = None,
+          max_points: int = 300, method: str = 'buckets') -> dict:
+    # `start` and `end` are unix timestamps. Either a `resolution` in seconds
+    # is given, or the resolution is chosen so that there are at most about
+    # `max_points` buckets.
+    epoch = utils.server_started.timestamp()
+    wanted = resolution if resolution is not None else (end - start) / max(1, max_points)
+    tier_resolution = _choose_tier(start - epoch, wanted)
+    seconds = tier_resolution.total_seconds()
+    # Every bucket of the response consists of this many buckets of the tier.
+    factor = max(1, floor(wanted / seconds), ceil((end - start) / seconds / MAX_POINTS))
+    width = factor * seconds
+    first = floor((start - epoch) / width) * factor
+    end_index = ceil((end - epoch) / width) * factor
+
+    response = {
+        'from': epoch + first * seconds,
+        'to': epoch + end_index * seconds,
+        'resolution': width,
+        'method': method,
+        'sources': {},
+    }
+    for source in sources:
+        tier = source.rollups.tier(tier_resolution)
+        if method == 'lttb':
+            response['sources'][source.id] = _lttb(
+                tier, epoch, first, end_index, max(3, ceil((end_index - first) / factor)))
+        else:
+            response['sources'][source.id] = _buckets(tier, first, end_index, factor)
+        response['sources'][source.id]['name'] = source.name
+    response['generation'] = _generation(first * seconds, end_index * seconds, width)
+    return response
+
+
+def _choose_tier(start: float, wanted: float) -> timedelta:
+    # The coarsest tier that is still at least as fine as the wanted
+    # resolution and that still has data from the start of the range. If no
+    # tier is fine enough, the finest one that has the data.
+    # All sources have the same tiers.
+    if not usage.sources:
+        return utils.long_term_resolution
+    tiers = usage.sources[0].rollups.tiers
+    covering = [
+        tier for tier in tiers
+        if tier.joules.start * tier.resolution.total_seconds() <= max(0, start)
+    ] or tiers[-1:]
+    fine_enough = [tier for tier in covering if tier.resolution.total_seconds() <= wanted]
+    if fine_enough:
+        return fine_enough[-1].resolution
+    return covering[0].resolution
+
+
+def _buckets(tier, first: int, end: int, factor: int) -> dict:
+    # Combines every `factor` buckets of the tier. Buckets that aren't kept
+    # (anymore) are None.
+    seconds = tier.resolution.total_seconds()
+    joules = tier.joules.between(first, end)
+    minimum = tier.minimum.between(first, end)
+    maximum = tier.maximum.between(first, end)
+    kept_from = max(first, tier.joules.start)
+
+    result = {'joules': [], 'mean': [], 'min': [], 'max': []}
+    for bucket_start in range(first, end, factor):
+        offset = bucket_start - kept_from
+        lo, hi = max(0, offset), min(len(joules), offset + factor)
+        if hi <= lo:
+            for values in result.values():
+                values.append(None)
+            continue
+        total = sum(joules[lo:hi])
+        result['joules'].append(total)
+        result['mean'].append(total / ((hi - lo) * seconds))
+        result['min'].append(min(minimum[lo:hi]))
+        result['max'].append(max(maximum[lo:hi]))
+    return result
+
+
+def _lttb(tier, epoch: float, first: int, end: int, num_points: int) -> dict:
+    # Picks the points of the mean watts that keep the shape of the curve
+    # best, using Largest-Triangle-Three-Buckets.
+    seconds = tier.resolution.total_seconds()
+    joules = tier.joules.between(first, end)
+    kept_from = max(first, tier.joules.start)
+    times = [epoch + (kept_from + index + 0.5) * seconds for index in range(len(joules))]
+    watts = [value / seconds for value in joules]
+    if len(watts) <= num_points:
+        return {'times': times, 'watts': watts}
+
+    picked = [0]
+    every = (len(watts) - 2) / (num_points - 2)
+    for bucket in range(num_points - 2):
+        # The average of the next bucket is the third point of the triangles.
+        next_start = floor((bucket + 1) * every) + 1
+        next_end = min(len(watts), floor((bucket + 2) * every) + 1)
+        average_time = sum(times[next_start:next_end]) / (next_end - next_start)
+        average_watts = sum(watts[next_start:next_end]) / (next_end - next_start)
+
+        previous = picked[-1]
+        best, best_area = None, -1
+        for index in range(floor(bucket * every) + 1, floor((bucket + 1) * every) + 1):
+            area = abs(
+                (times[previous] - average_time) * (watts[index] - watts[previous])
+                - (times[previous] - times[index]) * (average_watts - watts[previous])
+            )
+            if area > best_area:
+                best, best_area = index, area
+        picked.append(best)
+    picked.append(len(watts) - 1)
+    return {'times': [times[index] for index in picked], 'watts': [watts[index] for index in picked]}
+
+
+def _generation(start: float, end: float, width: float) -> dict:
+    # The mean generation during every bucket. `start` and `end` are seconds
+    # since the server started.
+    history = generation.history
+    seconds = utils.long_term_resolution.total_seconds()
+    result = {'storage': [], 'renewable': [], 'nonRenewable': [], 'unknown': []}
+    bucket_start = start
+    while bucket_start < end:
+        lo = max(history.start, floor(bucket_start / seconds))
+        hi = min(history.start + len(history.infos), max(lo + 1, ceil((bucket_start + width) / seconds)))
+        infos = history.infos[lo - history.start:hi - history.start] if hi > lo else []
+        for key, attribute in [('storage', 'storage'), ('renewable', 'renewable'),
+                               ('nonRenewable', 'non_renewable'), ('unknown', 'unknown')]:
+            result[key].append(
+                sum(getattr(info, attribute) for info in infos) / len(infos) if infos else None)
+        bucket_start += width
+    return result
@@ -0,0 +1,85 @@
+from array import array
+
+
+class RingBuffer:
+    # A preallocated buffer of floats that keeps the last `capacity` values,
+    # so its memory use doesn't grow no matter how long the server runs.
+    #
+    # Every value is stored twice, `capacity` slots apart. That way, the
+    # current values are always a contiguous part of the array and can be
+    # handed out as a memoryview without copying them.
+
+    __slots__ = ['capacity', 'total', '_values', '_end']
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        # how many values were ever appended
+        self.total = 0
+        self._values = array('d', bytes(2 * 8 * capacity))
+        # the slot after the newest value in the second half
+        self._end = capacity
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    @property
+    def start(self) -> int:
+        # The number of values that were dropped because the buffer was full,
+        # which is also the total index of the oldest value.
+        return self.total - len(self)
+
+    def append(self, value: float):
+        if self._end == 2 * self.capacity:
+            self._end = self.capacity
+        self._values[self._end - self.capacity] = value
+        self._values[self._end] = value
+        self._end += 1
+        self.total += 1
+
+    def pad_to(self, total: int, value: float = 0.0):
+        # Appends the value (zeros by default) until `total` values were
+        # appended.
+        missing = total - self.total
+        if missing <= 0:
+            return
+        for _ in range(min(missing, self.capacity)):
+            self.append(value)
+        self.total = total
+
+    def set_last(self, value: float):
+        self._values[self._end - 1] = value
+        self._values[self._end - 1 - self.capacity] = value
+
+    def add_to_last(self, value: float):
+        self._values[self._end - 1] += value
+        self._values[self._end - 1 - self.capacity] += value
+
+    def last(self) -> float:
+        return self._values[self._end - 1] if self.total > 0 else 0.0
+
+    def view(self, since: int = None) -> memoryview:
+        # The values oldest first. If `since` is given, only the values with a
+        # total index of at least `since` are included.
+        length = len(self)
+        if since is not None:
+            length = max(0, min(length, self.total - since))
+        return memoryview(self._values)[self._end - length:self._end]
+
+    def between(self, first: int, end: int) -> memoryview:
+        # The values with a total index from `first` up to `end` (exclusive),
+        # as far as they are kept. The first of them has the index
+        # max(first, self.start).
+        first = max(first, self.start)
+        end = min(end, self.total)
+        offset = self._end - (self.total - first)
+        return memoryview(self._values)[offset:offset + max(0, end - first)]
+
+    def tolist(self, since: int = None) -> list:
+        return self.view(since).tolist()
+
+    def toarray(self, since: int = None) -> array:
+        # A copy of the values that doesn't change when new ones are
+        # appended. Unlike a list, it's a single copy of the memory.
+        values = array('d')
+        values.frombytes(self.view(since).cast('B'))
+        return values
@@ -0,0 +1,80 @@
+from datetime import timedelta
+from math import floor
+
+from server.ring_buffer import RingBuffer
+
+
+class Tier:
+    # The joules and the minimum and maximum watts of a source for every
+    # `resolution` since the server started. Only the buckets of the last
+    # `retention` are kept.
+
+    __slots__ = ['resolution', 'joules', 'minimum', 'maximum', '_seconds']
+
+    def __init__(self, resolution: timedelta, retention: timedelta):
+        capacity = round(retention / resolution)
+        self.resolution = resolution
+        self.joules = RingBuffer(capacity)
+        self.minimum = RingBuffer(capacity)
+        self.maximum = RingBuffer(capacity)
+        self._seconds = resolution.total_seconds()
+
+    def add(self, start: float, end: float, joules: float, watts: float):
+        # Adds the joules used between `start` and `end` (in seconds since the
+        # server started). If that spans several buckets, the joules are
+        # spread over them.
+        last = floor(end / self._seconds)
+        # Only the newest bucket can still change, so joules of older ones go
+        # into it.
+        first = min(last, max(floor(start / self._seconds), self.joules.total - 1))
+        # Buckets that are already out of retention are skipped.
+        for index in range(max(first, last - self.joules.capacity + 1), last + 1):
+            if end <= start or first == last:
+                share = joules
+            else:
+                covered_from = start if index == first else index * self._seconds
+                covered_to = min(end, (index + 1) * self._seconds)
+                share = joules * (covered_to - covered_from) / (end - start)
+            self._add_to_bucket(index, share, watts)
+
+    def load(self, first: int, joules: list, minimum: list = None, maximum: list = None):
+        # Fills the buckets from `first` on, for example from a store. Without
+        # the minimum and maximum watts, we use the mean. Buckets have to be
+        # loaded in order.
+        for offset, value in enumerate(joules):
+            mean = value / self._seconds
+            self._add_to_bucket(first + offset, value, mean if minimum is None else minimum[offset])
+            if maximum is not None:
+                self.maximum.set_last(max(self.maximum.last(), maximum[offset]))
+
+    def _add_to_bucket(self, index: int, joules: float, watts: float):
+        if self.joules.total <= index:
+            self.joules.pad_to(index + 1)
+            self.minimum.pad_to(index + 1)
+            self.maximum.pad_to(index + 1)
+            self.minimum.set_last(watts)
+            self.maximum.set_last(watts)
+        else:
+            self.minimum.set_last(min(self.minimum.last(), watts))
+            self.maximum.set_last(max(self.maximum.last(), watts))
+        self.joules.add_to_last(joules)
+
+
+class Rollups:
+    # Rolls the samples of a source up into several tiers, from fine to
+    # coarse. Every tick updates the newest bucket of each tier in place, so
+    # both the memory and the time per tick are bounded no matter how long the
+    # server runs.
+
+    __slots__ = ['tiers']
+
+    def __init__(self, tiers: list):
+        # `tiers` is a list of (resolution, retention) tuples.
+        self.tiers = [Tier(resolution, retention) for resolution, retention in tiers]
+
+    def tier(self, resolution: timedelta) -> Tier:
+        return next(tier for tier in self.tiers if tier.resolution == resolution)
+
+    def add(self, start: float, end: float, joules: float, watts: float):
+        for tier in self.tiers:
+            tier.add(start, end, joules, watts)
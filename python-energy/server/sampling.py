@@ -0,0 +1,49 @@
+import concurrent.futures as futures
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# A reading of a device together with the time.monotonic_ns() at which it was
+# taken.
+Sample = namedtuple('Sample', ['reading', 'timestamp'])
+
+
+class Sampler:
+    # Reads one device on its own thread, so that a slow or stuck device (like
+    # an MCP that doesn't ACK) can't delay the sources on other devices.
+    #
+    # Devices need a `read` method returning a reading and a `deadline`
+    # timedelta that says how long after the start of a tick we're willing to
+    # wait for it.
+
+    def __init__(self, device, sources: list):
+        self.device = device
+        self.sources = sources
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    def _read(self) -> Sample:
+        reading = self.device.read()
+        return Sample(reading, time.monotonic_ns())
+
+    def start(self):
+        # If the previous read is still running, we don't start another one
+        # but keep waiting for that one.
+        if self._pending is None:
+            self._pending = self._executor.submit(self._read)
+
+    def collect(self, tick_started: float):
+        # `tick_started` is a time.monotonic().
+        # Returns the Sample or None if the device didn't deliver one before
+        # its deadline.
+        deadline = tick_started + self.device.deadline.total_seconds()
+        futures.wait([self._pending], timeout=max(0, deadline - time.monotonic()))
+        # We don't catch the TimeoutError of result(), because devices may
+        # raise one themselves and then have to be read again next time.
+        if not self._pending.done():
+            return None
+        pending, self._pending = self._pending, None
+        if pending.exception() is not None:
+            print(f'Reading {self.sources} failed: {pending.exception()}')
+            return None
+        return pending.result()
@@ -0,0 +1,63 @@
+import mmap
+import os
+import struct
+
+# Publishes the latest snapshot (as a frame) in shared memory, so that Jupyter
+# servers on the same machine can read it without any HTTP requests. No matter
+# how many users there are, the server only writes it once per tick.
+#
+# Layout of the shared memory:
+#
+#     uint64:  seqlock counter, odd while the snapshot is being written
+#     uint64:  length of the frame
+#     uint64:  reserved
+#     uint64:  reserved
+#     frame
+#
+# Readers read the counter, copy the frame and then read the counter again. If
+# it changed (or was odd), they try again. They never write, so they can map
+# the memory read-only, and the Jupyter servers of other users can read it too.
+#
+# The shared memory is a file in SHARED_MEMORY_DIRECTORY, which is where Linux
+# keeps POSIX shared memory. That's the same as shm_open, but lets us choose
+# who may read it.
+
+SHARED_MEMORY_DIRECTORY = '/dev/shm'
+
+_HEADER = struct.Struct('<QQQQ')
+
+
+class SharedSnapshot:
+    def __init__(self, name: str, size: int):
+        self.path = os.path.join(SHARED_MEMORY_DIRECTORY, name)
+        try:
+            # A previous run of the server didn't clean up.
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            # Everyone may read it, no matter our umask.
+            os.fchmod(fd, 0o644)
+            os.ftruncate(fd, size)
+            self.memory = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        _HEADER.pack_into(self.memory, 0, 0, 0, 0, 0)
+        self._counter = 0
+
+    def publish(self, frame: bytes):
+        buffer = self.memory
+        if _HEADER.size + len(frame) > len(buffer):
+            frame = b''  # Readers fall back to HTTP.
+        self._counter += 1
+        struct.pack_into('<Q', buffer, 0, self._counter)
+        buffer[_HEADER.size:_HEADER.size + len(frame)] = frame
+        struct.pack_into('<Q', buffer, 8, len(frame))
+        self._counter += 1
+        struct.pack_into('<Q', buffer, 0, self._counter)
+
+    def unlink(self):
+        # The usage monitor may still publish afterwards, which is harmless:
+        # the memory stays mapped, it just can't be found by its name anymore.
+        os.unlink(self.path)
@@ -0,0 +1,212 @@
+import gzip
+import secrets
+import zlib
+from collections import deque
+
+import server.energy_generation as generation
+import server.energy_mix as energy_mix
+import server.energy_usage as usage
+import server.frame as frame
+from server.utils import *
+
+
+JSON = 'text/json'
+
+# Identifies this run of the server. Sequence numbers start at 0 again after
+# a restart, so they only mean something together with the run they are from.
+RUN = secrets.token_hex(8)
+
+
+class Snapshot:
+    # An immutable view of all sources and the energy generation at one point
+    # in time. Every format and content encoding of it is only encoded once,
+    # so serving it to any number of clients doesn't need to touch the sources
+    # at all.
+    #
+    # Every snapshot has a sequence number that increases by one per
+    # short_term_resolution (so by several at once if the usage monitor backed
+    # off). The last value of every source's `wattsOverTime` is the sample with
+    # that sequence number, the one before has the previous number, etc.
+    # Clients only get deltas for sequence numbers of the same `RUN`.
+
+    def __init__(self, seq: int, response: dict, long_term_buckets: tuple, generation_seq: int,
+                 sources_seq: int = 0):
+        self.seq = seq
+        self.etag = f'W/"{RUN}-{seq}"'
+        self.response = response
+
+        # The index of the long-term bucket that was current at each of the
+        # sequence numbers covered by `wattsOverTime`, oldest first.
+        self._long_term_buckets = long_term_buckets
+        # The sequence number at which the generation data last changed.
+        self._generation_seq = generation_seq
+        # The sequence number at which sources last came online.
+        self._sources_seq = sources_seq
+        # Deltas by the `since` they were requested for. Most clients poll
+        # once per tick, so they all ask for the same one.
+        self._deltas = {}
+        # Encoded responses by (since, content type, content encoding).
+        self._encoded = {}
+
+    def _long_term_bucket_at(self, seq: int):
+        index = seq - (self.seq - len(self._long_term_buckets) + 1)
+        if index < 0 or index >= len(self._long_term_buckets):
+            return None
+        return self._long_term_buckets[index]
+
+    def encoded(self, since: int, run: str, content_type: str, content_encoding: str) -> bytes:
+        # The changes since the snapshot with the given sequence number of the
+        # given run (or everything if `since` is None, it's from another run or
+        # the client needs the full response anyway) in the given format.
+        if since is not None and (run != RUN or self.delta(since) is None):
+            since = None
+        return self._encoded_since(since, content_type, content_encoding)
+
+    def _encoded_since(self, since: int, content_type: str, content_encoding: str) -> bytes:
+        key = (since, content_type, content_encoding)
+        if key not in self._encoded:
+            if content_encoding is None:
+                response = self.response if since is None else self.delta(since)
+                self._encoded[key] = encode(response, content_type, None)
+            else:
+                self._encoded[key] = compress(
+                    self._encoded_since(since, content_type, None), content_encoding)
+        return self._encoded[key]
+
+    def delta(self, since: int):
+        # Returns the changes since the snapshot of this run with the given
+        # sequence number or None if a client that saw that snapshot needs the
+        # full response (because it's too old or sources came online since
+        # then).
+        if since in self._deltas:
+            return self._deltas[since]
+        from_bucket = self._long_term_bucket_at(since)
+        if from_bucket is None or since < self._sources_seq or any(
+            from_bucket < source['longTermJoulesFrom'] for source in self.response['usage'].values()
+        ):
+            return None
+
+        num_new = self.seq - since
+        response = {
+            'run': RUN,
+            'seq': self.seq,
+            'since': since,
+            'usage': {},
+            'sampler': self.response['sampler'],
+        }
+        for id, source in self.response['usage'].items():
+            response['usage'][id] = {
+                'name': source['name'],
+                'joules': source['joules'],
+                'watts': source['watts'],
+                'stale': source['stale'],
+                'wattsOverTime': source['wattsOverTime'][len(source['wattsOverTime']) - num_new:],
+                'longTermJoulesFrom': from_bucket,
+                'longTermJoules': source['longTermJoules'][from_bucket - source['longTermJoulesFrom']:],
+            }
+        if since < self._generation_seq:
+            # The attribution of older buckets changes with the generation.
+            response['generation'] = self.response['generation']
+            response['attribution'] = self.response['attribution']
+        else:
+            response['attribution'] = {}
+            for id, attribution in self.response['attribution'].items():
+                first = max(0, from_bucket - attribution['from'])
+                response['attribution'][id] = {'from': attribution['from'] + first}
+                for category in energy_mix.CATEGORIES:
+                    response['attribution'][id][category] = attribution[category][first:]
+
+        self._deltas[since] = response
+        return response
+
+
+def encode(response: dict, content_type: str, content_encoding: str) -> bytes:
+    # Clients that understand frames get them, everyone else gets JSON.
+    if content_type == frame.CONTENT_TYPE:
+        body = frame.encode(response)
+    else:
+        body = bytes(frame.to_json(response) + '\n', 'utf-8')
+    return compress(body, content_encoding)
+
+
+def compress(body: bytes, content_encoding: str) -> bytes:
+    if content_encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    if content_encoding == 'deflate':
+        return zlib.compress(body, 6)
+    return body
+
+
+def _build_response(seq: int, generation_history) -> dict:
+    response = {
+        'run': RUN,
+        'seq': seq,
+        'usage': {},
+        'generation': {},
+        # how well the usage monitor keeps up with its schedule
+        'sampler': usage.scheduler_stats.to_json(),
+    }
+    for source in usage.sources:
+        response['usage'][source.id] = {
+            'name': source.name,
+            'joules': source.joules,
+            'watts': source.watts,
+            'stale': source.stale,
+            # Arrays are copied in one go and written to frames as they are,
+            # only JSON turns them into lists (when someone asks for it).
+            'wattsOverTime': source.watts_over_time.toarray(),
+            # Long-term buckets are numbered since the server started, but
+            # the oldest ones may have been dropped already.
+            'longTermJoulesFrom': source.long_term_joules.start,
+            'longTermJoules': source.long_term_joules.toarray(),
+        }
+    infos = generation_history.infos
+    response['generation'] = {
+        # the index of the long-term bucket of the first values
+        'from': generation_history.start,
+        'storage': [info.storage for info in infos],
+        'renewable': [info.renewable for info in infos],
+        'nonRenewable': [info.non_renewable for info in infos],
+        'unknown': [info.unknown for info in infos],
+    }
+    # For every source, its long-term joules split by how they were generated.
+    response['attribution'] = {
+        id: attribution.to_json() for id, attribution in energy_mix.attributions.items()
+    }
+    return response
+
+
+_long_term_buckets = deque([], maxlen=round(short_term_history / short_term_resolution))
+_generation_history = generation.history
+_generation_seq = 0
+_sources = usage.sources
+_sources_seq = 0
+
+# The most recent snapshot. Readers just grab this reference; the usage monitor
+# replaces it after every tick.
+latest: Snapshot = Snapshot(0, _build_response(0, _generation_history), (), 0)
+
+
+def update(slots: int = 1):
+    # Should only be called from the usage monitor thread, right after the
+    # sources ticked, so that the snapshot is consistent.
+    global latest, _generation_history, _generation_seq, _sources, _sources_seq
+    seq = latest.seq + slots
+
+    num_buckets = max((source.long_term_joules.total for source in usage.sources), default=1)
+    for _ in range(slots):
+        _long_term_buckets.append(num_buckets - 1)
+    # The generation monitor replaces the history instead of mutating it, so
+    # we only need to make sure to look at one version of it.
+    history = generation.history
+    if history is not _generation_history:
+        _generation_history = history
+        _generation_seq = seq
+    energy_mix.update(history)
+    # The monitor replaces the list of sources when new ones come online.
+    if usage.sources is not _sources:
+        _sources = usage.sources
+        _sources_seq = seq
+
+    latest = Snapshot(seq, _build_response(seq, history), tuple(_long_term_buckets),
+                      _generation_seq, _sources_seq)
@@ -0,0 +1,224 @@
+import json
+import mmap
+import os
+import struct
+from bisect import bisect_right
+from datetime import datetime
+
+# Keeps the history of the server on disk, so that restarting it doesn't lose
+# anything.
+#
+# Every tick appends one record: the unix time and the joules every source used
+# so far. Records have a fixed size and are stored in segment files, one column
+# after the other:
+#
+#     header (4 KiB): magic, capacity, count, column names as JSON
+#     time column:    capacity float64s
+#     column 1:       capacity float64s
+#     ...
+#
+# Segments are memory-mapped, so reading them after a restart just maps the
+# files; there's nothing to parse. Writing a record means writing the values and
+# then increasing the count in the header, so if the server crashes, the
+# segment only ever contains complete records. New segments are prepared in a
+# temporary file and renamed into place once they're complete.
+
+MAGIC = b'PYENRGY1'
+HEADER_SIZE = 4096
+_CAPACITY_AND_COUNT = struct.Struct('<QQ')
+_COUNT_OFFSET = len(MAGIC) + 8
+
+# Records further apart than this belong to different runs of the server. The
+# usage monitor may back off, so this is quite generous.
+MAX_GAP_SECONDS = 60.0
+
+
+class Segment:
+    def __init__(self, path: str, writable: bool = False):
+        self.path = path
+        self.writable = writable
+        with open(path, 'r+b' if writable else 'rb') as file:
+            self._mmap = mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a segment')
+        self.capacity, count = _CAPACITY_AND_COUNT.unpack_from(self._mmap, len(MAGIC))
+        self.count = min(count, self.capacity)
+        names_start = len(MAGIC) + _CAPACITY_AND_COUNT.size
+        names_end = self._mmap.find(b'\0', names_start, HEADER_SIZE)
+        self.columns = json.loads(self._mmap[names_start:names_end])
+        self._values = memoryview(self._mmap)[HEADER_SIZE:].cast('d')
+
+    @staticmethod
+    def create(path: str, columns: list, capacity: int) -> 'Segment':
+        names = json.dumps(columns).encode('utf-8')
+        if len(MAGIC) + _CAPACITY_AND_COUNT.size + len(names) >= HEADER_SIZE:
+            raise ValueError('Too many columns for one segment.')
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.truncate(HEADER_SIZE + 8 * capacity * (len(columns) + 1))
+            file.write(MAGIC + _CAPACITY_AND_COUNT.pack(capacity, 0) + names)
+            file.flush()
+            os.fsync(file.fileno())
+        os.rename(temporary, path)
+        return Segment(path, writable=True)
+
+    def column(self, index: int) -> memoryview:
+        # The values of the column with the given index, where 0 is the time.
+        start = index * self.capacity
+        return self._values[start:start + self.count]
+
+    @property
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+
+    def append(self, timestamp: float, values: list):
+        for index, value in enumerate([timestamp] + values):
+            self._values[index * self.capacity + self.count] = value
+        self.count += 1
+        struct.pack_into('<Q', self._mmap, _COUNT_OFFSET, self.count)
+
+    def flush(self):
+        self._mmap.flush()
+
+
+class Store:
+    # All segments in a directory, oldest first. Only the newest one is
+    # written to.
+
+    def __init__(self, directory: str, segment_capacity: int, retention_seconds: float):
+        self.directory = directory
+        self.segment_capacity = segment_capacity
+        self.retention_seconds = retention_seconds
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)  # We crashed while creating it.
+            elif name.endswith('.segment'):
+                try:
+                    self.segments.append(Segment(path))
+                except ValueError as e:
+                    print(f'Ignoring {path}: {e}')
+        self._next_number = 1 + max(
+            (int(os.path.basename(segment.path).split('.')[0]) for segment in self.segments),
+            default=0,
+        )
+        self._writing = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def epoch(self, default: datetime) -> datetime:
+        # The time the server started for the first time with this store.
+        path = self._path('epoch')
+        if os.path.exists(path):
+            with open(path) as file:
+                return datetime.fromisoformat(file.read().strip())
+        self._write_atomically('epoch', default.isoformat())
+        return default
+
+    def load_json(self, name: str):
+        path = self._path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as file:
+            return json.load(file)
+
+    def save_json(self, name: str, value):
+        self._write_atomically(name, json.dumps(value))
+
+    def _write_atomically(self, name: str, content: str):
+        temporary = self._path(name + '.tmp')
+        with open(temporary, 'w') as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.rename(temporary, self._path(name))
+
+    def first_time(self, column: str):
+        # The time of the oldest record of the column or None if it was never
+        # written.
+        for segment in self.segments:
+            if column in segment.columns and segment.count > 0:
+                return segment.column(0)[0]
+        return None
+
+    def latest(self, column: str):
+        # The newest (time, value) of the column or None if it was never
+        # written.
+        for segment in reversed(self.segments):
+            if column in segment.columns and segment.count > 0:
+                index = segment.columns.index(column) + 1
+                return segment.column(0)[-1], segment.column(index)[-1]
+        return None
+
+    def records(self, column: str, start: float, end: float):
+        # Yields (times, values) memoryviews of the column for every segment
+        # that has records between start and end, including the records right
+        # before and after, so that values in between can be interpolated.
+        for segment in list(self.segments):
+            if column not in segment.columns or segment.count == 0:
+                continue
+            times = segment.column(0)
+            if times[-1] < start or times[0] > end:
+                continue
+            first = max(0, bisect_right(times, start) - 1)
+            last = bisect_right(times, end) + 1
+            values = segment.column(segment.columns.index(column) + 1)
+            yield times[first:last], values[first:last]
+
+    def value_at(self, column: str, timestamp: float) -> float:
+        # The value of the column at the given time, interpolated between the
+        # surrounding records. Before the first record, it's 0; in gaps (while
+        # the server didn't run), it stays at the value before the gap.
+        before, after = None, None
+        for segment in list(self.segments):
+            if column not in segment.columns or segment.count == 0:
+                continue
+            times = segment.column(0)
+            values = segment.column(segment.columns.index(column) + 1)
+            index = bisect_right(times, timestamp)
+            if index > 0:
+                before = (times[index - 1], values[index - 1])
+            if index < len(times):
+                after = (times[index], values[index])
+                break
+        if before is None:
+            return 0.0
+        if after is None or after[0] - before[0] > MAX_GAP_SECONDS:
+            return before[1]
+        return before[1] + (after[1] - before[1]) * (timestamp - before[0]) / (after[0] - before[0])
+
+    def append(self, timestamp: float, columns: list, values: list):
+        # `columns` are the names of the values. If they changed (for example
+        # because a source came online), a new segment is started.
+        if self._writing is None or self._writing.is_full or self._writing.columns != columns:
+            self._rotate(columns, timestamp)
+        self._writing.append(timestamp, values)
+
+    def _rotate(self, columns: list, now: float):
+        # Readers may still look at the segments we stop using, so we never
+        # close them explicitly. They are unmapped once nobody uses them.
+        previous = self._writing
+        if previous is not None:
+            previous.flush()
+        elif self.segments and self.segments[-1].columns == columns \
+                and not self.segments[-1].is_full:
+            # Continue the segment of the last run.
+            self._writing = self.segments[-1] = Segment(self.segments[-1].path, writable=True)
+            return
+
+        path = self._path(f'{self._next_number:08d}.segment')
+        self._next_number += 1
+        self._writing = Segment.create(path, columns, self.segment_capacity)
+        self.segments.append(self._writing)
+
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            if oldest.count > 0 and oldest.column(0)[-1] >= now - self.retention_seconds:
+                break
+            self.segments.pop(0)
+            os.remove(oldest.path)
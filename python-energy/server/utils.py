@@ -1,7 +1,10 @@
 import itertools
+import os
 import time
+from bisect import bisect_left
 from datetime import datetime, timedelta
-from math import floor
+from math import floor, inf
+from threading import Event
 
 # The server tracks both a short-term history of the energy consumption, so that
 # you can immediately see the impact of individual actions.
@@ -14,6 +17,98 @@ from math import floor
 short_term_resolution: timedelta = timedelta(seconds=1)
 long_term_resolution: timedelta = timedelta(minutes=15)
 
+# How much of the histories are kept. Older values are dropped.
+short_term_history: timedelta = timedelta(seconds=100)
+long_term_history: timedelta = timedelta(days=28)
+
+# Every source rolls its energy up into these tiers of (resolution, retention),
+# from fine to coarse. The tier with the long_term_resolution is what clients
+# see as the long-term history.
+rollup_tiers: list = [
+    (timedelta(seconds=1), timedelta(minutes=10)),
+    (timedelta(minutes=1), timedelta(days=1)),
+    (long_term_resolution, long_term_history),
+    (timedelta(hours=1), timedelta(days=365)),
+]
+
+# Where the server keeps its history, so that it survives restarts. None keeps
+# everything in memory only.
+store_directory: str = os.path.expanduser('~/.local/share/python-energy')
+store_history: timedelta = timedelta(days=7)
+store_segment_length: timedelta = timedelta(hours=6)
+
+# Devices that are cheap to read (like RAPL) can additionally be sampled with a
+# high rate, so that short spikes are visible. The samples of the last
+# high_rate_history are kept. None disables high-rate sampling.
+high_rate_resolution: timedelta = None
+high_rate_history: timedelta = timedelta(seconds=10)
+
+# Where the energy generation of a day comes from: the ENTSO-E page with the
+# actual generation per production type in Germany. `{date}` is replaced with
+# the day as dd.mm.yyyy.
+generation_url: str = 'https://transparency.entsoe.eu/generation/r2/actualGenerationPerProductionType/show?name=&defaultValue=false&viewType=GRAPH&areaType=CTY&atch=false&datepicker-day-offset-select-dv-date-from_input=D&dateTime.dateTime={date} 00:00|CET|DAYTIMERANGE&dateTime.endDateTime={date} 00:00|CET|DAYTIMERANGE&area.values=CTY|10Y1001A1001A83F!CTY|10Y1001A1001A83F&productionType.values=B01&productionType.values=B02&productionType.values=B03&productionType.values=B04&productionType.values=B05&productionType.values=B06&productionType.values=B07&productionType.values=B08&productionType.values=B09&productionType.values=B10&productionType.values=B11&productionType.values=B12&productionType.values=B13&productionType.values=B14&productionType.values=B20&productionType.values=B15&productionType.values=B16&productionType.values=B17&productionType.values=B18&productionType.values=B19&dateTime.timezone=CET_CEST&dateTime.timezone_input=CET (UTC+1) / CEST (UTC+2)'
+# With a security token of the ENTSO-E transparency platform, the generation
+# is fetched as XML from its API instead of being scraped from the page above.
+entsoe_api_token: str = None
+generation_timeout: timedelta = timedelta(seconds=30)
+# Failed requests are retried this often, waiting 1, 2, 4, ... seconds.
+generation_retries: int = 3
+# Days that ended this long ago don't change anymore and are never fetched again.
+generation_final_after: timedelta = timedelta(hours=3)
+
+# Only sources whose ids match one of these patterns (like 'cpu' or 'mcp*')
+# are used. None uses all sources that are found.
+source_allowlist: list = None
+# The devices that had sources the last time, so that only those are probed
+# when the server starts. None doesn't cache them.
+topology_cache: str = os.path.expanduser('~/.cache/python-energy/topology.json')
+# How often devices without sources are probed again, so that sources can come
+# online later (like an MCP that is plugged in). None only probes once.
+discovery_interval: timedelta = timedelta(minutes=1)
+
+# The latest snapshot is also published in shared memory with this name, so
+# that Jupyter servers on the same machine don't need to poll over HTTP. None
+# disables it. Snapshots that don't fit into shared_memory_size bytes are only
+# served over HTTP.
+shared_memory_name: str = 'python-energy'
+shared_memory_size: int = 16 * 1024 * 1024
+
+# On machines that many people share, the energy of the RAPL sources (which
+# measure whole packages) is split between the users and their Jupyter
+# kernels by the CPU time their processes used. The lowest power of a source
+# during the last idle_power_window counts as its idle power and is reported
+# on its own. Kernels that stopped are still reported for
+# stopped_kernels_history. This reads all of /proc every tick, so it's off
+# unless you ask for it.
+cpu_attribution: bool = False
+idle_power_window: timedelta = timedelta(minutes=10)
+stopped_kernels_history: timedelta = timedelta(hours=1)
+
+# When the power of all sources stays flat and no client asked for metrics
+# recently, the usage monitor backs off to idle_resolution, so that an idle
+# machine isn't woken up every second just to find out that it's still idle.
+idle_resolution: timedelta = timedelta(seconds=10)
+# How long after their last request clients count as connected.
+client_timeout: timedelta = timedelta(seconds=5)
+# Changes of the power by less than this fraction (or less than half a watt for
+# small values) count as flat.
+flat_power_tolerance: float = 0.05
+# How many flat ticks in a row it takes to back off.
+flat_ticks_before_idle: int = 5
+
+
+# Samples are timestamped with time.monotonic_ns(), which is only meaningful
+# within this process. This converts them into unix timestamps for clients.
+_unix_minus_monotonic_ns = time.time_ns() - time.monotonic_ns()
+
+
+def monotonic_to_unix(timestamp: int) -> float:
+    return (timestamp + _unix_minus_monotonic_ns) / 1e9
+
+
+def unix_to_monotonic(timestamp: float) -> int:
+    return round(timestamp * 1e9) - _unix_minus_monotonic_ns
+
 
 def only_date(dt: datetime) -> datetime:
     return datetime(dt.year, dt.month, dt.day)
@@ -29,8 +124,126 @@ def _start_time_floored_to_long_term_resolution() -> datetime:
 server_started: datetime = _start_time_floored_to_long_term_resolution()
 
 
-def tick_repeatedly(delay: timedelta, callback) -> None:
-    start_time = time.time()
-    for i in itertools.count():
-        time.sleep(max(0, start_time + i * delay.total_seconds() - time.time()))
-        callback()
+class Histogram:
+    # Counts values in buckets with the given upper bounds. Values above the
+    # last bound are counted in an additional bucket.
+    def __init__(self, bounds: list):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def record(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def to_json(self):
+        return {
+            'bounds': self.bounds,
+            'counts': list(self.counts),
+            'sum': self.sum,
+        }
+
+
+class SchedulerStats:
+    # Statistics about how well `tick_repeatedly` manages to keep its schedule.
+    # If the machine is so busy that ticks start late or take longer than the
+    # delay, that shows up here.
+
+    # in seconds
+    buckets = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1]
+
+    def __init__(self):
+        self.ticks = 0
+        self.skipped_ticks = 0
+        # how long after their scheduled time ticks started
+        self.lateness = Histogram(self.buckets)
+        # how much longer than the delay ticks took (only for those that did)
+        self.overrun = Histogram(self.buckets)
+
+    def to_json(self):
+        return {
+            'ticks': self.ticks,
+            'skippedTicks': self.skipped_ticks,
+            'lateness': self.lateness.to_json(),
+            'overrun': self.overrun.to_json(),
+        }
+
+
+class AdaptiveRate:
+    # Decides how often the usage monitor ticks: every `fast` while the power
+    # changes or clients are connected, every `slow` otherwise. Slow ticks
+    # stay on the grid of the fast ones and simply cover several slots.
+
+    def __init__(self, fast: timedelta, slow: timedelta):
+        self.fast = fast
+        self.slow = slow
+        self.idle = False
+        self._flat_ticks = 0
+        self._last_watts = None
+        self._last_client = -inf
+        # Set to end a slow tick early because a client showed up.
+        self.wakeup = Event()
+
+    # called by the web server for every request
+    def client_seen(self):
+        self._last_client = time.monotonic()
+        if self.idle:
+            self.idle = False
+            self._flat_ticks = 0
+            self.wakeup.set()
+
+    # called after every tick with the watts of all sources
+    def observe(self, watts: list):
+        last, self._last_watts = self._last_watts, watts
+        flat = last is not None and len(last) == len(watts) and all(
+            abs(new - old) <= max(flat_power_tolerance * abs(old), 0.5)
+            for old, new in zip(last, watts)
+        )
+        self._flat_ticks = self._flat_ticks + 1 if flat else 0
+        has_clients = time.monotonic() - self._last_client < client_timeout.total_seconds()
+        self.idle = self._flat_ticks >= flat_ticks_before_idle and not has_clients
+
+    @property
+    def period(self) -> timedelta:
+        return self.slow if self.idle else self.fast
+
+
+def tick_adaptively(rate: AdaptiveRate, callback, stats: SchedulerStats = None) -> None:
+    # Calls the callback every rate.period with the number of fast periods
+    # that passed since the last call. If a tick starts so late that it missed
+    # the time of the next ones, those are skipped and covered by the next
+    # call.
+    stats = stats or SchedulerStats()
+    period = round(rate.fast.total_seconds() * 1e9)
+    origin = time.monotonic_ns()
+    slot = 0
+    previous_slot = -1
+    while True:
+        scheduled = origin + slot * period
+        remaining = max(0, scheduled - time.monotonic_ns()) / 1e9
+        if rate.wakeup.wait(remaining):
+            # Tick at the next fast slot instead of waiting for the slow one.
+            rate.wakeup.clear()
+            next_slot = -(-(time.monotonic_ns() - origin) // period)
+            slot = max(previous_slot + 1, min(slot, next_slot))
+            continue
+        started = time.monotonic_ns()
+        skipped = (started - scheduled) // period
+        slot += skipped
+        stats.ticks += 1
+        stats.skipped_ticks += skipped
+        stats.lateness.record((started - scheduled) / 1e9)
+
+        callback(slot - previous_slot)
+        previous_slot = slot
+
+        duration = time.monotonic_ns() - started
+        if duration > period:
+            stats.overrun.record((duration - period) / 1e9)
+        slot += round(rate.period / rate.fast)
+
+
+def tick_repeatedly(delay: timedelta, callback, stats: SchedulerStats = None) -> None:
+    # Calls the callback every delay. If a tick starts so late that it missed
+    # the time of the next ones, those are skipped.
+    tick_adaptively(AdaptiveRate(delay, delay), lambda slots: callback(), stats)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The server is not a package that's installed, it runs from this directory.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
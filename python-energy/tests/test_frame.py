@@ -0,0 +1,66 @@
+import json
+import struct
+from array import array
+
+import pytest
+
+import server.frame as frame
+
+
+def test_round_trip():
+    response = {
+        'seq': 3,
+        'usage': {'cpu': {'name': 'CPU', 'stale': False, 'wattsOverTime': [1.5, 2, 3.25]}},
+        'generation': {'storage': array('d', [0.5]), 'unknown': []},
+        'sampler': None,
+    }
+    decoded = frame.decode(frame.encode(response))
+    assert decoded['seq'] == 3
+    assert decoded['usage']['cpu']['name'] == 'CPU'
+    assert decoded['usage']['cpu']['stale'] is False
+    assert decoded['sampler'] is None
+    # All lists of numbers come back as arrays of floats.
+    assert decoded['usage']['cpu']['wattsOverTime'] == array('d', [1.5, 2.0, 3.25])
+    assert decoded['generation']['storage'] == array('d', [0.5])
+    assert decoded['generation']['unknown'] == array('d')
+
+
+def test_only_lists_of_numbers_become_floats():
+    response = {'ids': ['cpu', 'gpu'], 'mixed': [1.0, None], 'flags': [True], 'nested': [[1.0]]}
+    decoded = frame.decode(frame.encode(response))
+    assert decoded['ids'] == ['cpu', 'gpu']
+    assert decoded['mixed'] == [1.0, None]
+    assert decoded['flags'] == [True]
+    assert decoded['nested'] == [array('d', [1.0])]
+
+
+def test_layout():
+    data = frame.encode({'a': [1.0, 2.0], 'b': array('d', [3.0])})
+    assert data[:4] == frame.MAGIC
+    (header_length,) = struct.unpack_from('<I', data, 4)
+    header = json.loads(data[8:8 + header_length])
+    assert header == {'a': {'$f64': [0, 2]}, 'b': {'$f64': [2, 1]}}
+    # The floats are aligned, so they can be read right out of the frame.
+    assert (8 + header_length) % 8 == 0
+    assert struct.unpack_from('<3d', data, 8 + header_length) == (1.0, 2.0, 3.0)
+
+
+def test_decodes_memoryviews_without_keeping_them():
+    data = bytearray(frame.encode({'watts': [1.0, 2.0]}))
+    with memoryview(data) as view:
+        decoded = frame.decode(view)
+    # The view could be released, so nothing refers to it anymore.
+    data[-8:] = struct.pack('<d', 7.0)
+    assert decoded['watts'].tolist() == [1.0, 2.0]
+
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError):
+        frame.decode(b'{"seq": 1}')
+
+
+def test_to_json():
+    assert json.loads(frame.to_json({'watts': array('d', [1.0]), 'ids': ['cpu']})) == {
+        'watts': [1.0], 'ids': ['cpu']}
+    with pytest.raises(TypeError):
+        frame.to_json({'watts': {1.0}})
@@ -0,0 +1,169 @@
+import json
+import os
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+
+import server.generation_fetcher as generation_fetcher
+from server.generation_fetcher import GenerationFetcher
+from server.generation_providers import ChartProvider
+from server.store import Store
+
+# Replays the bundled chart.json through a local stand-in for the generation
+# page of ENTSO-E.
+
+CHART_PATH = os.path.join(os.path.dirname(__file__), '..', 'chart.json')
+
+
+class StandIn:
+    # Serves the chart like the generation page does. `failures` are status
+    # codes that the next requests get instead.
+
+    def __init__(self):
+        with open(CHART_PATH) as file:
+            self.chart = json.load(file)
+        self.page = f'<script>var chart = {json.dumps(self.chart)};</script>'.encode('utf-8')
+        self.etag = '"1"'
+        self.failures = []
+        self.requests = []
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests.append((self.path, dict(self.headers)))
+                if stand_in.failures:
+                    self.send_response(stand_in.failures.pop(0))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                elif stand_in.etag is not None and self.headers.get('If-None-Match') == stand_in.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                else:
+                    self.send_response(200)
+                    if stand_in.etag is not None:
+                        self.send_header('ETag', stand_in.etag)
+                    self.send_header('Content-Length', str(len(stand_in.page)))
+                    self.end_headers()
+                    self.wfile.write(stand_in.page)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('localhost', 0), Handler)
+        self.url = f'http://localhost:{self.server.server_port}/show?securityToken=secret&date={{date}}'
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_in():
+    stand_in = StandIn()
+    yield stand_in
+    stand_in.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(generation_fetcher.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def today() -> datetime:
+    return datetime.combine(datetime.now().date(), datetime.min.time())
+
+
+def long_ago() -> datetime:
+    return today() - timedelta(days=3)
+
+
+def test_parses_the_chart(stand_in):
+    provider = ChartProvider(stand_in.url)
+    infos, changed = GenerationFetcher(provider).fetch(today())
+    assert infos == provider.parse_chart(stand_in.chart)
+    assert len(infos) == 96
+    assert changed
+    assert stand_in.requests[0][0].endswith('date=' + today().strftime('%d.%m.%Y'))
+
+
+def test_sends_conditional_requests(stand_in):
+    fetcher = GenerationFetcher(ChartProvider(stand_in.url))
+    infos, _ = fetcher.fetch(today())
+    again, changed = fetcher.fetch(today())
+    assert again == infos
+    assert not changed
+    assert len(stand_in.requests) == 2
+    assert stand_in.requests[1][1]['If-None-Match'] == stand_in.etag
+
+
+def test_only_parses_changed_pages(stand_in, monkeypatch):
+    stand_in.etag = None
+    provider = ChartProvider(stand_in.url)
+    parsed = []
+    parse = provider.parse
+    monkeypatch.setattr(provider, 'parse', lambda *args: parsed.append(args) or parse(*args))
+    fetcher = GenerationFetcher(provider)
+    fetcher.fetch(today())
+    _, changed = fetcher.fetch(today())
+    assert not changed
+    assert len(stand_in.requests) == 2
+    assert len(parsed) == 1
+
+
+def test_retries_server_errors(stand_in, sleeps):
+    stand_in.failures = [503, 502]
+    infos, changed = GenerationFetcher(ChartProvider(stand_in.url)).fetch(today())
+    assert len(infos) == 96
+    assert changed
+    assert len(stand_in.requests) == 3
+    assert sleeps == [1, 2]
+
+
+def test_keeps_what_it_has_if_the_page_fails(stand_in, sleeps, capsys):
+    fetcher = GenerationFetcher(ChartProvider(stand_in.url))
+    infos, _ = fetcher.fetch(today())
+    stand_in.failures = [503] * 4
+    again, changed = fetcher.fetch(today())
+    assert again == infos
+    assert not changed
+    assert len(stand_in.requests) == 1 + 4
+    assert sleeps == [1, 2, 4]
+    assert 'HTTPError 503' in capsys.readouterr().out
+
+
+def test_doesnt_log_the_url(stand_in, sleeps, capsys):
+    url = stand_in.url
+    stand_in.close()
+    infos, changed = GenerationFetcher(ChartProvider(url)).fetch(today())
+    assert infos == []
+    assert not changed
+    output = capsys.readouterr().out
+    assert 'ConnectionError' in output
+    assert 'secret' not in output
+
+
+def test_serves_final_days_from_the_cache(stand_in):
+    fetcher = GenerationFetcher(ChartProvider(stand_in.url))
+    infos, _ = fetcher.fetch(long_ago())
+    again, changed = fetcher.fetch(long_ago())
+    assert again == infos
+    assert not changed
+    assert len(stand_in.requests) == 1
+
+
+def test_keeps_the_cache_in_the_store(stand_in, tmp_path):
+    store = Store(str(tmp_path), 10, 3600)
+    infos, _ = GenerationFetcher(ChartProvider(stand_in.url), store).fetch(long_ago())
+
+    # Like after a restart.
+    store = Store(str(tmp_path), 10, 3600)
+    again, changed = GenerationFetcher(ChartProvider(stand_in.url), store).fetch(long_ago())
+    assert again == infos
+    assert not changed
+    assert len(stand_in.requests) == 1
@@ -0,0 +1,42 @@
+import json
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from server.generation_providers import ChartProvider, TransparencyApiProvider
+
+DIRECTORY = os.path.join(os.path.dirname(__file__), '..')
+# The day of the bundled chart.json and generation.xml.
+DAY = datetime(2022, 1, 16)
+
+
+@pytest.fixture(params=['UTC', 'Europe/Berlin', 'America/New_York'])
+def host_timezone(request, monkeypatch):
+    monkeypatch.setenv('TZ', request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_providers_agree(host_timezone):
+    with open(os.path.join(DIRECTORY, 'chart.json')) as file:
+        from_chart = ChartProvider().parse_chart(json.load(file))
+    with open(os.path.join(DIRECTORY, 'generation.xml'), 'rb') as file:
+        from_api = TransparencyApiProvider('token').parse(file.read(), DAY)
+    assert len(from_api) == 96
+    assert from_api == from_chart
+
+
+def test_asks_for_the_market_day(host_timezone):
+    url = TransparencyApiProvider('token').url(DAY)
+    assert 'periodStart=202201152300' in url
+    assert 'periodEnd=202201162300' in url
+
+
+def test_days_with_clock_changes():
+    provider = TransparencyApiProvider('token')
+    assert 'periodEnd=202203272200' in provider.url(datetime(2022, 3, 27))
+    assert 'periodEnd=202210302300' in provider.url(datetime(2022, 10, 30))
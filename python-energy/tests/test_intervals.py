@@ -0,0 +1,59 @@
+import pytest
+
+import server.energy_usage as usage
+import server.intervals as intervals
+from server.energy_usage import Source
+from server.ring_buffer import RingBuffer
+from server.store import Store
+
+# The ticks of the usage monitor are at 1000, 1001, ..., 1010, with the source
+# using 2 watts. Before them, the store has records at 900, 901, ..., 910, with
+# the source using 5 watts.
+
+
+@pytest.fixture
+def source(monkeypatch, tmp_path):
+    source = Source('cpu', 'CPU')
+    tick_times = RingBuffer(100)
+    for i in range(11):
+        tick_times.append(1000.0 + i)
+        source.joules_at_ticks.append(100.0 + 2 * i)
+    store = Store(str(tmp_path), 100, 3600)
+    for i in range(11):
+        store.append(900.0 + i, ['cpu'], [50.0 + 5 * i])
+
+    monkeypatch.setattr(usage, 'sources', [source])
+    monkeypatch.setattr(usage, 'tick_times', tick_times)
+    monkeypatch.setattr(usage, 'high_rate_recorders', [])
+    monkeypatch.setattr(usage, 'store', store)
+    return source
+
+
+def test_interpolates_between_ticks(source):
+    [result] = intervals.energy([(1002.5, 1004.5)])
+    assert result['cpu'] == {
+        'joules': pytest.approx(4.0),
+        'meanWatts': pytest.approx(2.0),
+        'peakWatts': pytest.approx(2.0),
+        'highResolution': False,
+    }
+
+
+def test_answers_older_intervals_from_the_store(source):
+    [result] = intervals.energy([(902.0, 904.0)])
+    assert result['cpu']['joules'] == pytest.approx(10.0)
+    assert result['cpu']['meanWatts'] == pytest.approx(5.0)
+    assert result['cpu']['peakWatts'] is None
+
+
+def test_cells_that_take_no_time(source):
+    # Like a cell that only defines a function.
+    from_ticks, from_store = intervals.energy([(1003.0, 1003.0), (903.0, 903.0)])
+    assert from_ticks['cpu']['joules'] == 0.0
+    assert from_ticks['cpu']['meanWatts'] == pytest.approx(2.0)
+    assert from_store['cpu']['joules'] == 0.0
+    assert from_store['cpu']['meanWatts'] == 0.0
+
+
+def test_waits_for_the_next_tick(source):
+    assert intervals.energy([(1009.0, 1011.0)]) == [None]
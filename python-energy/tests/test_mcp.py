@@ -0,0 +1,64 @@
+import os
+import time
+from threading import Thread
+
+import pytest
+
+import server.discovery as discovery
+import server.utils as utils
+from measure.fake_mcp import FakeMcp
+from server.energy_usage import McpMeter, McpSource
+from server.sampling import Sampler
+
+# Runs discovery and the reads of the MCP sources against the fake MCP in
+# measure/fake_mcp.py, which speaks the protocol of mcp_com.c on a pseudo
+# terminal.
+
+pytestmark = pytest.mark.skipif(
+    not os.path.exists(os.path.join(os.path.dirname(discovery.__file__), '..', 'measure', 'mcp.so')),
+    reason='measure/mcp.so is not built',
+)
+
+
+@pytest.fixture
+def fake_mcp(monkeypatch, tmp_path):
+    fake = FakeMcp((12.5, 3.25))
+    Thread(target=fake.serve_forever, daemon=True).start()
+    # Only the first MCP is there.
+    monkeypatch.setattr(discovery, 'MCP_DEVICE_PATH', str(tmp_path / 'ttyACM{}'))
+    os.symlink(fake.filename, tmp_path / 'ttyACM0')
+    monkeypatch.setattr(utils, 'source_allowlist', ['mcp*'])
+    return fake
+
+
+@pytest.fixture
+def added_sources(monkeypatch):
+    added = []
+    monkeypatch.setattr(discovery.usage, 'add_sources', added.extend)
+    return added
+
+
+def test_discovers_both_channels(fake_mcp, added_sources):
+    found = discovery._probe_all(discovery._probes())
+    assert [probe.name for probe in found] == ['mcp0']
+    assert [source.id for source in added_sources] == ['mcp0ch0', 'mcp0ch1']
+    # Both channels are read through the same meter.
+    assert all(isinstance(source, McpSource) for source in added_sources)
+    assert added_sources[0].device is added_sources[1].device
+
+
+def test_reads_both_channels_with_one_command(fake_mcp, added_sources):
+    discovery._probe_all(discovery._probes())
+    meter = added_sources[0].device
+    assert isinstance(meter, McpMeter)
+    sampler = Sampler(meter, added_sources)
+
+    for _ in range(3):
+        commands_before = fake_mcp.num_commands
+        sampler.start()
+        sample = sampler.collect(time.monotonic())
+        assert sample is not None
+        for source in added_sources:
+            source.tick(sample)
+        assert fake_mcp.num_commands - commands_before == 1
+        assert [source.watts for source in added_sources] == [12.5, 3.25]
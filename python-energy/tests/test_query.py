@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import server.energy_generation as generation
+import server.energy_usage as usage
+import server.query as query
+import server.utils as utils
+from server.energy_generation import History, Info
+from server.energy_usage import Source
+from server.rollups import Rollups
+
+# The server started at EPOCH and ran for an hour. The source used 2 watts all
+# the time, except for 10 watts from second 100 to 110 and 3300 to 3302.
+# Seconds are kept for 10 minutes, minutes for a day.
+
+EPOCH = datetime(2022, 1, 16, 12, 0)
+START = EPOCH.timestamp()
+
+
+@pytest.fixture
+def source(monkeypatch):
+    source = Source('cpu', 'CPU')
+    source.rollups = Rollups([
+        (timedelta(seconds=1), timedelta(minutes=10)),
+        (timedelta(minutes=1), timedelta(days=1)),
+    ])
+    for second in range(3600):
+        watts = 10.0 if 100 <= second < 110 or 3300 <= second < 3302 else 2.0
+        source.rollups.add(second, second + 1, watts, watts)
+
+    monkeypatch.setattr(utils, 'server_started', EPOCH)
+    monkeypatch.setattr(usage, 'sources', [source])
+    # The renewable share changes every quarter of an hour.
+    monkeypatch.setattr(generation, 'history', History(0, [
+        Info(0, 10, 90, 0), Info(0, 20, 80, 0), Info(0, 30, 70, 0), Info(0, 40, 60, 0),
+    ]))
+    return source
+
+
+def test_chooses_the_resolution_for_the_points(source):
+    response = query.query(START, START + 3600, [source], max_points=60)
+    assert (response['from'], response['to']) == (START, START + 3600)
+    assert response['resolution'] == 60
+    buckets = response['sources']['cpu']
+    assert buckets['name'] == 'CPU'
+    assert len(buckets['joules']) == 60
+    assert buckets['joules'][0] == pytest.approx(120.0)
+    assert buckets['joules'][1] == pytest.approx(200.0)
+    assert buckets['mean'][1] == pytest.approx(200.0 / 60)
+    assert (buckets['min'][1], buckets['max'][1]) == (2.0, 10.0)
+    assert sum(buckets['joules']) == pytest.approx(2 * 3600 + 8 * 10 + 8 * 2)
+
+
+def test_combines_buckets_of_a_tier(source):
+    response = query.query(START, START + 3600, [source], resolution=300)
+    assert response['resolution'] == 300
+    assert response['sources']['cpu']['joules'][:2] == [pytest.approx(680.0), pytest.approx(600.0)]
+    assert len(response['sources']['cpu']['joules']) == 12
+
+
+def test_uses_fine_tiers_for_recent_ranges(source):
+    response = query.query(START + 3500, START + 3510, [source], resolution=1)
+    assert response['resolution'] == 1
+    assert response['sources']['cpu']['joules'] == [pytest.approx(2.0)] * 10
+
+
+def test_uses_coarser_tiers_for_what_fine_ones_dropped(source):
+    # The seconds around the spike aren't kept anymore.
+    response = query.query(START + 60, START + 180, [source], resolution=1)
+    assert response['resolution'] == 60
+    assert response['sources']['cpu']['max'] == [10.0, 2.0]
+
+
+def test_buckets_that_are_not_kept_are_none(source):
+    response = query.query(START + 3540, START + 3780, [source], resolution=60)
+    # The bucket at 3600 just started.
+    assert response['sources']['cpu']['joules'] == [pytest.approx(120.0), 0.0, None, None]
+
+
+def test_limits_the_number_of_points(source):
+    response = query.query(START - 86400 * 365, START + 3600, [source], resolution=60)
+    assert len(response['sources']['cpu']['joules']) <= query.MAX_POINTS
+
+
+def test_lttb_keeps_the_spike(source):
+    response = query.query(START + 3010, START + 3590, [source], method='lttb', max_points=20)
+    assert response['method'] == 'lttb'
+    points = response['sources']['cpu']
+    # One point per bucket of the resolution, out of the seconds of the tier.
+    num_points = round((response['to'] - response['from']) / response['resolution'])
+    assert len(points['times']) == len(points['watts']) == num_points
+    assert max(points['watts']) == pytest.approx(10.0)
+    assert points['times'] == sorted(points['times'])
+    assert response['from'] < points['times'][0] < points['times'][-1] < response['to']
+    assert all(time % 1 == 0.5 for time in points['times'])
+
+
+def test_lttb_of_few_buckets_returns_them_all(source):
+    points = query.query(START, START + 300, [source], method='lttb', resolution=60)['sources']['cpu']
+    assert points['watts'] == [
+        pytest.approx(2.0), pytest.approx(200 / 60), pytest.approx(2.0), pytest.approx(2.0),
+        pytest.approx(2.0)]
+
+
+def test_generation_per_bucket(source):
+    response = query.query(START, START + 3600, [source], resolution=1800)
+    assert response['generation']['renewable'] == [15.0, 35.0]
+    response = query.query(START + 3600, START + 7200, [source], resolution=1800)
+    assert response['generation']['renewable'] == [None, None]
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import server.energy_usage as usage
+import server.utils as utils
+from server.energy_usage import Source
+from server.rollups import Rollups
+from server.store import Store
+
+# The last run of the server started at EPOCH and ran for 10 hours. In hour h,
+# the source used h + 1 watts. Minutes are kept for an hour and hours for two
+# days, but the store only keeps records for three hours.
+
+EPOCH = datetime(2022, 1, 16, 12, 0)
+START = EPOCH.timestamp()
+HOUR = 3600
+
+
+def make_source() -> Source:
+    source = Source('cpu', 'CPU')
+    source.rollups = Rollups([
+        (timedelta(minutes=1), timedelta(hours=1)),
+        (timedelta(hours=1), timedelta(days=2)),
+    ])
+    return source
+
+
+def watts(second: float) -> float:
+    return second // HOUR + 1
+
+
+def joules_at(second: int) -> float:
+    hours, rest = divmod(second, HOUR)
+    return HOUR * hours * (hours + 1) / 2 + rest * (hours + 1)
+
+
+class Clock:
+    now = START
+
+    @classmethod
+    def time(cls) -> float:
+        return cls.now
+
+
+@pytest.fixture
+def last_run(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, 'server_started', EPOCH)
+    monkeypatch.setattr(utils, 'store_history', timedelta(hours=3))
+    monkeypatch.setattr(usage, 'time', Clock)
+    monkeypatch.setattr(Clock, 'now', START)
+    # use_store sets these.
+    monkeypatch.setattr(usage, 'store', None)
+    monkeypatch.setattr(usage, '_long_tiers', {})
+    monkeypatch.setattr(usage, '_long_tiers_saved_in', None)
+    source = make_source()
+    for second in range(0, 10 * HOUR, 60):
+        source.rollups.add(second, second + 60, 60 * watts(second), watts(second))
+    monkeypatch.setattr(usage, 'sources', [source])
+
+    # What the store of the last run kept: the records of the last 2.5 hours.
+    store = Store(str(tmp_path), 1000, 3 * HOUR)
+    for second in range(int(7.5 * HOUR), 10 * HOUR + 1, 60):
+        store.append(START + second, ['cpu'], [joules_at(second)])
+    return source, store
+
+
+def restart(store: Store) -> Source:
+    Clock.now = START + 10.5 * HOUR
+    usage.use_store(Store(store.directory, 1000, 3 * HOUR))
+    source = make_source()
+    usage._restore(source)
+    return source
+
+
+def test_saves_the_tiers_that_outlive_the_store(last_run):
+    source, store = last_run
+    usage.use_store(store)
+    Clock.now = START + 10 * HOUR
+    usage._save_long_tiers()
+    saved = store.load_json('rollups')
+    assert list(saved['cpu']) == ['3600.0']
+    assert saved['cpu']['3600.0']['from'] == 0
+    assert saved['cpu']['3600.0']['joules'][:2] == [HOUR * 1.0, HOUR * 2.0]
+    assert saved['cpu']['3600.0']['max'][:2] == [1.0, 2.0]
+
+
+def test_restores_hours_the_store_dropped(last_run):
+    source, store = last_run
+    usage.use_store(store)
+    Clock.now = START + 10 * HOUR
+    usage._save_long_tiers()
+
+    restored = restart(store)
+    assert restored.joules == joules_at(10 * HOUR)
+    hours = restored.rollups.tier(timedelta(hours=1))
+    assert hours.joules.tolist() == [pytest.approx(HOUR * (h + 1)) for h in range(10)] + [0.0]
+    assert hours.maximum.tolist()[:10] == [float(h + 1) for h in range(10)]
+
+
+def test_starts_with_the_first_record(last_run):
+    # Nothing was saved, so the hours before the records are gone. The hour
+    # of the first record only has the energy since that record.
+    source, store = last_run
+    restored = restart(store)
+    hours = restored.rollups.tier(timedelta(hours=1))
+    assert hours.joules.tolist() == [0.0] * 7 + [
+        pytest.approx(HOUR * 8 / 2), pytest.approx(HOUR * 9), pytest.approx(HOUR * 10), 0.0]
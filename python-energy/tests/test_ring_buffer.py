@@ -0,0 +1,86 @@
+from server.ring_buffer import RingBuffer
+
+
+def filled(capacity: int, count: int) -> RingBuffer:
+    # A buffer to which 0, 1, ..., count - 1 were appended.
+    buffer = RingBuffer(capacity)
+    for value in range(count):
+        buffer.append(float(value))
+    return buffer
+
+
+def test_keeps_the_newest_values():
+    buffer = filled(4, 3)
+    assert (len(buffer), buffer.start, buffer.total) == (3, 0, 3)
+    assert buffer.tolist() == [0.0, 1.0, 2.0]
+
+    buffer = filled(4, 10)
+    assert (len(buffer), buffer.start, buffer.total) == (4, 6, 10)
+    assert buffer.tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert buffer.last() == 9.0
+
+
+def test_views_are_contiguous_at_every_position():
+    for count in range(20):
+        buffer = filled(4, count)
+        expected = [float(value) for value in range(max(0, count - 4), count)]
+        assert buffer.view().tolist() == expected
+        assert buffer.view().contiguous
+
+
+def test_since():
+    buffer = filled(4, 10)
+    assert buffer.tolist(since=8) == [8.0, 9.0]
+    assert buffer.tolist(since=10) == []
+    # Values that were dropped already can't be returned.
+    assert buffer.tolist(since=2) == [6.0, 7.0, 8.0, 9.0]
+
+
+def test_between_across_the_wrap():
+    buffer = filled(4, 10)
+    # The slots of 7 and 8 are on both sides of the wrap.
+    assert buffer.between(7, 9).tolist() == [7.0, 8.0]
+    assert buffer.between(6, 10).tolist() == [6.0, 7.0, 8.0, 9.0]
+    # Only what is still kept, starting at max(first, start).
+    assert buffer.between(3, 8).tolist() == [6.0, 7.0]
+    assert buffer.between(8, 20).tolist() == [8.0, 9.0]
+    assert buffer.between(0, 5).tolist() == []
+    assert buffer.between(9, 9).tolist() == []
+
+
+def test_changing_the_last_value_after_a_wrap():
+    for count in [4, 5, 8]:
+        buffer = filled(4, count)
+        buffer.set_last(100.0)
+        buffer.add_to_last(1.0)
+        assert buffer.last() == 101.0
+        assert buffer.tolist()[-1] == 101.0
+        # Both copies of the value changed, so it stays after more appends.
+        for value in range(3):
+            buffer.append(float(value))
+        assert buffer.tolist() == [101.0, 0.0, 1.0, 2.0]
+
+
+def test_pad_to():
+    buffer = filled(4, 2)
+    buffer.pad_to(4, 5.0)
+    assert buffer.tolist() == [0.0, 1.0, 5.0, 5.0]
+    # Padding more than the capacity only writes what is kept.
+    buffer.pad_to(100)
+    assert (buffer.total, buffer.start) == (100, 96)
+    assert buffer.tolist() == [0.0, 0.0, 0.0, 0.0]
+    buffer.append(7.0)
+    assert buffer.between(99, 101).tolist() == [0.0, 7.0]
+    # It never goes back.
+    buffer.pad_to(50)
+    assert buffer.total == 101
+
+
+def test_toarray_is_a_copy():
+    buffer = filled(4, 6)
+    values = buffer.toarray()
+    for value in range(10):
+        buffer.append(-1.0)
+    assert values.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert values.typecode == 'd'
+    assert buffer.toarray(since=15).tolist() == [-1.0]
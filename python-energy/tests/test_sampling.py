@@ -0,0 +1,58 @@
+import time
+from datetime import timedelta
+from threading import Event
+
+from server.sampling import Sampler
+
+
+class Device:
+    # Reads are answered by `results` in order: exceptions are raised, Events
+    # are waited for and everything else is returned.
+
+    def __init__(self, *results):
+        self.deadline = timedelta(milliseconds=50)
+        self.results = list(results)
+        self.num_reads = 0
+
+    def read(self):
+        self.num_reads += 1
+        result = self.results.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        if isinstance(result, Event):
+            result.wait()
+            return 'late'
+        return result
+
+
+def tick(sampler: Sampler):
+    sampler.start()
+    return sampler.collect(time.monotonic())
+
+
+def test_returns_the_reading():
+    sample = tick(Sampler(Device(42), []))
+    assert sample.reading == 42
+
+
+def test_waits_for_slow_devices():
+    answer = Event()
+    device = Device(answer, 1)
+    sampler = Sampler(device, [])
+    assert tick(sampler) is None
+    # The read that is still running is the one we keep waiting for.
+    assert tick(sampler) is None
+    assert device.num_reads == 1
+    answer.set()
+    assert tick(sampler).reading == 'late'
+    assert tick(sampler).reading == 1
+
+
+def test_reads_again_after_device_errors(capsys):
+    for error in [OSError('broken pipe'), TimeoutError('no ACK')]:
+        device = Device(error, 1)
+        sampler = Sampler(device, [])
+        assert tick(sampler) is None
+        assert tick(sampler).reading == 1
+        assert device.num_reads == 2
+        assert str(error) in capsys.readouterr().out
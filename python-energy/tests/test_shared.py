@@ -0,0 +1,94 @@
+import mmap
+import os
+import stat
+import struct
+import time
+from threading import Event, Thread
+
+import pytest
+
+import server.frame as frame
+import server.shared as shared
+from server.shared import SharedSnapshot
+
+
+@pytest.fixture
+def published(monkeypatch, tmp_path):
+    monkeypatch.setattr(shared, 'SHARED_MEMORY_DIRECTORY', str(tmp_path))
+    snapshot = SharedSnapshot('python-energy-test', 4096)
+    yield snapshot
+    if os.path.exists(snapshot.path):
+        snapshot.unlink()
+
+
+def read(path: str):
+    # What readers see: the seqlock counter and the frame.
+    with open(path, 'rb') as file:
+        data = file.read()
+    counter, length, _, _ = struct.unpack_from('<QQQQ', data)
+    return counter, data[32:32 + length]
+
+
+def test_everyone_may_read_it(monkeypatch, tmp_path):
+    monkeypatch.setattr(shared, 'SHARED_MEMORY_DIRECTORY', str(tmp_path))
+    umask = os.umask(0o077)
+    try:
+        snapshot = SharedSnapshot('python-energy-test', 4096)
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(os.stat(snapshot.path).st_mode) == 0o644
+    assert os.path.getsize(snapshot.path) == 4096
+
+
+def test_publishes_frames(published):
+    assert read(published.path) == (0, b'')
+    for seq in [1, 2]:
+        published.publish(frame.encode({'seq': seq, 'watts': [1.0, 2.0]}))
+        counter, data = read(published.path)
+        assert counter == 2 * seq
+        assert frame.decode(data)['seq'] == seq
+        assert frame.decode(data)['watts'].tolist() == [1.0, 2.0]
+
+
+def test_leaves_frames_that_dont_fit_to_http(published):
+    published.publish(frame.encode({'watts': [0.0] * 1000}))
+    assert read(published.path) == (2, b'')
+
+
+def test_replaces_the_memory_of_a_previous_run(published):
+    published.publish(frame.encode({'seq': 1}))
+    again = SharedSnapshot('python-energy-test', 4096)
+    assert again.path == published.path
+    assert read(published.path) == (0, b'')
+
+
+def test_readers_never_see_half_written_frames(published):
+    # Like the readers of jupyter_energy: read the counter, copy the frame and
+    # only use it if the counter didn't change and was even.
+    stop = Event()
+
+    def publish():
+        seq = 0
+        while not stop.is_set():
+            seq += 1
+            published.publish(frame.encode({'seq': seq, 'watts': [float(seq)] * 100}))
+
+    publisher = Thread(target=publish)
+    publisher.start()
+    num_read = 0
+    try:
+        with open(published.path, 'rb') as file:
+            memory = mmap.mmap(file.fileno(), 0, prot=mmap.PROT_READ)
+        deadline = time.monotonic() + 0.5
+        while time.monotonic() < deadline:
+            counter, length = struct.unpack_from('<QQ', memory)
+            data = memory[32:32 + length]
+            if counter % 2 == 1 or struct.unpack_from('<Q', memory)[0] != counter or not data:
+                continue
+            snapshot = frame.decode(data)
+            assert snapshot['watts'].tolist() == [float(snapshot['seq'])] * 100
+            num_read += 1
+    finally:
+        stop.set()
+        publisher.join()
+    assert num_read > 0
@@ -0,0 +1,129 @@
+import gzip
+import json
+import zlib
+from array import array
+
+import server.frame as frame
+import server.snapshot as snapshot
+from server.snapshot import Snapshot
+
+# The snapshots of these tests have one source whose last five samples were
+# seq - 4 to seq. Its long-term buckets 0 and 1 are kept, and bucket 1 started
+# at seq - 2.
+
+
+def make_snapshot(seq: int, generation_seq: int = 0, sources_seq: int = 0,
+                  long_term_joules_from: int = 0) -> Snapshot:
+    response = {
+        'run': snapshot.RUN,
+        'seq': seq,
+        'usage': {
+            'cpu': {
+                'name': 'CPU',
+                'joules': 20.0,
+                'watts': 5.0,
+                'stale': False,
+                'wattsOverTime': array('d', [1.0, 2.0, 3.0, 4.0, 5.0]),
+                'longTermJoulesFrom': long_term_joules_from,
+                'longTermJoules': array('d', [10.0, 10.0][long_term_joules_from:]),
+            },
+        },
+        'generation': {'from': 0, 'storage': [1.0], 'renewable': [2.0], 'nonRenewable': [3.0],
+                       'unknown': [0.0]},
+        'sampler': {},
+        'attribution': {
+            'cpu': {'from': 0, 'storage': [1.0, 2.0], 'renewable': [3.0, 4.0],
+                    'nonRenewable': [5.0, 6.0], 'unknown': [0.0, 0.0]},
+        },
+    }
+    return Snapshot(seq, response, (0, 0, 1, 1, 1), generation_seq, sources_seq)
+
+
+def decoded(latest: Snapshot, since: int, run: str = snapshot.RUN) -> dict:
+    return json.loads(latest.encoded(since, run, snapshot.JSON, None))
+
+
+def test_delta_only_has_new_samples():
+    delta = decoded(make_snapshot(10), 8)
+    assert delta['run'] == snapshot.RUN
+    assert (delta['seq'], delta['since']) == (10, 8)
+    assert delta['usage']['cpu']['wattsOverTime'] == [4.0, 5.0]
+    # The bucket that was current at 8 may have changed since.
+    assert delta['usage']['cpu']['longTermJoulesFrom'] == 1
+    assert delta['usage']['cpu']['longTermJoules'] == [10.0]
+    assert delta['attribution']['cpu'] == {
+        'from': 1, 'storage': [2.0], 'renewable': [4.0], 'nonRenewable': [6.0], 'unknown': [0.0]}
+    assert 'generation' not in delta
+
+
+def test_delta_of_a_bucket_that_is_still_current():
+    delta = decoded(make_snapshot(10), 6)
+    assert delta['usage']['cpu']['wattsOverTime'] == [2.0, 3.0, 4.0, 5.0]
+    assert delta['usage']['cpu']['longTermJoulesFrom'] == 0
+    assert delta['usage']['cpu']['longTermJoules'] == [10.0, 10.0]
+
+
+def test_deltas_since_the_latest_are_empty():
+    delta = decoded(make_snapshot(10), 10)
+    assert delta['usage']['cpu']['wattsOverTime'] == []
+
+
+def is_full(response: dict) -> bool:
+    return 'since' not in response and response['usage']['cpu']['wattsOverTime'] == [
+        1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_other_runs_get_everything():
+    latest = make_snapshot(10)
+    assert is_full(decoded(latest, 8, '0123456789abcdef'))
+    assert is_full(decoded(latest, 8, None))
+    assert decoded(latest, 8, '0123456789abcdef')['run'] == snapshot.RUN
+
+
+def test_clients_that_are_too_far_behind_get_everything():
+    latest = make_snapshot(10)
+    assert is_full(decoded(latest, 5))
+    assert is_full(decoded(latest, 11))
+    assert is_full(decoded(latest, None))
+
+
+def test_new_sources_mean_everything():
+    assert is_full(decoded(make_snapshot(10, sources_seq=9), 8))
+    assert not is_full(decoded(make_snapshot(10, sources_seq=8), 8))
+
+
+def test_dropped_buckets_mean_everything():
+    # The bucket that was current at 6 isn't kept anymore.
+    latest = make_snapshot(10, long_term_joules_from=1)
+    assert is_full(decoded(latest, 6))
+    assert not is_full(decoded(latest, 8))
+
+
+def test_new_generation_is_sent_with_all_attributions():
+    delta = decoded(make_snapshot(10, generation_seq=9), 8)
+    assert delta['generation']['renewable'] == [2.0]
+    assert delta['attribution']['cpu']['from'] == 0
+    assert delta['attribution']['cpu']['renewable'] == [3.0, 4.0]
+
+
+def test_encodes_every_response_once():
+    latest = make_snapshot(10)
+    assert latest.encoded(8, snapshot.RUN, snapshot.JSON, None) is \
+        latest.encoded(8, snapshot.RUN, snapshot.JSON, None)
+    # All clients that need everything share the same response.
+    assert latest.encoded(5, snapshot.RUN, snapshot.JSON, 'gzip') is \
+        latest.encoded(None, None, snapshot.JSON, 'gzip')
+
+
+def test_content_types_and_encodings():
+    latest = make_snapshot(10)
+    body = latest.encoded(8, snapshot.RUN, snapshot.JSON, None)
+    assert gzip.decompress(latest.encoded(8, snapshot.RUN, snapshot.JSON, 'gzip')) == body
+    assert zlib.decompress(latest.encoded(8, snapshot.RUN, snapshot.JSON, 'deflate')) == body
+    delta = frame.decode(latest.encoded(8, snapshot.RUN, frame.CONTENT_TYPE, None))
+    assert delta['usage']['cpu']['wattsOverTime'].tolist() == [4.0, 5.0]
+    assert (delta['run'], delta['since']) == (snapshot.RUN, 8)
+
+
+def test_etag_names_the_run():
+    assert make_snapshot(10).etag == f'W/"{snapshot.RUN}-10"'
@@ -0,0 +1,149 @@
+import os
+
+import pytest
+
+from server.store import MAX_GAP_SECONDS, Segment, Store
+
+
+def segment_names(directory) -> list:
+    return sorted(name for name in os.listdir(directory) if name.endswith('.segment'))
+
+
+def records(store: Store, column: str, start=0.0, end=1e12) -> list:
+    return [
+        (time, value)
+        for times, values in store.records(column, start, end)
+        for time, value in zip(times.tolist(), values.tolist())
+    ]
+
+
+def test_reads_what_it_wrote(tmp_path):
+    store = Store(str(tmp_path), 10, 3600)
+    for i in range(5):
+        store.append(100.0 + i, ['cpu', 'gpu'], [i, 10.0 * i])
+    assert records(store, 'gpu') == [(100.0 + i, 10.0 * i) for i in range(5)]
+    assert store.first_time('cpu') == 100.0
+    assert store.latest('cpu') == (104.0, 4.0)
+    assert store.latest('mcp0ch0') is None
+
+
+def test_rotates_full_segments(tmp_path):
+    store = Store(str(tmp_path), 4, 3600)
+    for i in range(10):
+        store.append(100.0 + i, ['cpu'], [float(i)])
+    assert segment_names(tmp_path) == ['00000001.segment', '00000002.segment', '00000003.segment']
+    assert [segment.count for segment in store.segments] == [4, 4, 2]
+    assert [value for _, value in records(store, 'cpu')] == [float(i) for i in range(10)]
+
+
+def test_starts_a_segment_when_sources_come_online(tmp_path):
+    store = Store(str(tmp_path), 10, 3600)
+    store.append(100.0, ['cpu'], [1.0])
+    store.append(101.0, ['cpu', 'gpu'], [2.0, 5.0])
+    assert [segment.columns for segment in store.segments] == [['cpu'], ['cpu', 'gpu']]
+    assert records(store, 'cpu') == [(100.0, 1.0), (101.0, 2.0)]
+    assert records(store, 'gpu') == [(101.0, 5.0)]
+
+
+def test_records_include_their_neighbors(tmp_path):
+    store = Store(str(tmp_path), 100, 3600)
+    for i in range(10):
+        store.append(100.0 + i, ['cpu'], [float(i)])
+    # The records right before and after the range, for interpolating.
+    assert [time for time, _ in records(store, 'cpu', 103.5, 105.5)] == [103.0, 104.0, 105.0, 106.0]
+    assert records(store, 'cpu', 200.0, 300.0) == []
+
+
+def test_continues_after_a_restart(tmp_path):
+    store = Store(str(tmp_path), 10, 3600)
+    store.append(100.0, ['cpu'], [1.0])
+    store.append(101.0, ['cpu'], [2.0])
+
+    store = Store(str(tmp_path), 10, 3600)
+    assert store.latest('cpu') == (101.0, 2.0)
+    store.append(200.0, ['cpu'], [3.0])
+    # The segment of the last run wasn't full yet, so it's continued.
+    assert segment_names(tmp_path) == ['00000001.segment']
+    assert records(store, 'cpu') == [(100.0, 1.0), (101.0, 2.0), (200.0, 3.0)]
+
+
+def test_numbers_segments_after_the_ones_it_found(tmp_path):
+    store = Store(str(tmp_path), 10, 3600)
+    store.append(100.0, ['cpu'], [1.0])
+    store = Store(str(tmp_path), 10, 3600)
+    store.append(101.0, ['gpu'], [1.0])
+    assert segment_names(tmp_path) == ['00000001.segment', '00000002.segment']
+
+
+def test_drops_segments_after_the_retention(tmp_path):
+    store = Store(str(tmp_path), 2, 100)
+    for i in range(10):
+        store.append(1000.0 + 30 * i, ['cpu'], [float(i)])
+    # Segments are dropped when a new one is started, which was at 1240, so
+    # records before 1140 could go. Only whole segments are dropped: the one
+    # from 1120 to 1150 stays.
+    assert store.first_time('cpu') == 1120.0
+    assert len(segment_names(tmp_path)) == len(store.segments) == 3
+
+
+def test_cleans_up_after_crashes(tmp_path):
+    store = Store(str(tmp_path), 10, 3600)
+    store.append(100.0, ['cpu'], [1.0])
+    # A segment that was being created and a file that isn't a segment.
+    (tmp_path / '00000002.segment.tmp').write_bytes(b'PYENRGY1')
+    (tmp_path / '00000003.segment').write_bytes(b'garbage' * 1000)
+
+    store = Store(str(tmp_path), 10, 3600)
+    assert not (tmp_path / '00000002.segment.tmp').exists()
+    assert [os.path.basename(segment.path) for segment in store.segments] == ['00000001.segment']
+
+
+def test_only_counts_complete_records(tmp_path):
+    segment = Segment.create(str(tmp_path / '00000001.segment'), ['cpu'], 10)
+    segment.append(100.0, [1.0])
+    # Like a crash while writing the second record: its values are there, but
+    # the count wasn't increased yet.
+    segment._values[1] = 101.0
+    segment._values[11] = 2.0
+    segment.flush()
+    assert Segment(segment.path).count == 1
+
+
+def test_value_at(tmp_path):
+    store = Store(str(tmp_path), 100, 3600)
+    for i in range(5):
+        store.append(100.0 + i, ['cpu'], [10.0 * i])
+    # After a restart long after, it continues with the joules it had.
+    store.append(1000.0, ['cpu'], [50.0])
+    store.append(1001.0, ['cpu'], [60.0])
+
+    assert store.value_at('cpu', 50.0) == 0.0
+    assert store.value_at('cpu', 100.0) == 0.0
+    assert store.value_at('cpu', 101.5) == pytest.approx(15.0)
+    assert store.value_at('cpu', 104.0) == 40.0
+    assert 1000.0 - 104.0 > MAX_GAP_SECONDS
+    assert store.value_at('cpu', 500.0) == 40.0
+    assert store.value_at('cpu', 1000.5) == pytest.approx(55.0)
+    assert store.value_at('cpu', 2000.0) == 60.0
+    assert store.value_at('gpu', 101.0) == 0.0
+
+
+def test_value_at_across_segments(tmp_path):
+    store = Store(str(tmp_path), 2, 3600)
+    for i in range(6):
+        store.append(100.0 + i, ['cpu'], [10.0 * i])
+    assert len(store.segments) == 3
+    assert store.value_at('cpu', 101.5) == pytest.approx(15.0)
+    assert store.value_at('cpu', 103.25) == pytest.approx(32.5)
+
+
+def test_epoch_and_json(tmp_path):
+    from datetime import datetime
+    store = Store(str(tmp_path), 10, 3600)
+    first = datetime(2022, 1, 16, 12, 0)
+    assert store.epoch(first) == first
+    assert Store(str(tmp_path), 10, 3600).epoch(datetime(2023, 1, 1)) == first
+
+    assert store.load_json('rollups') is None
+    store.save_json('rollups', {'cpu': [1.0, 2.0]})
+    assert Store(str(tmp_path), 10, 3600).load_json('rollups') == {'cpu': [1.0, 2.0]}